@@ -0,0 +1,80 @@
+"""
+Import time of the compute modules, each measured in a fresh interpreter.
+Fails if a compute module pulls in a plotting library or is slower than
+--max-seconds.
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --repeat 10 --max-seconds 2
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+src = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+# Modules that must import without plotting libraries
+compute_modules = ['emissions', 'forcing', 'basis', 'uncertainty', 'sweep',
+                   'figure_data', 'breakeven', 'fleet', 'sensitivity',
+                   'store', 'cache', 'shared', 'server', 'profiling',
+                   'figures', 'metrics', 'batch']
+plotting_modules = ['matplotlib', 'seaborn']
+
+_probe = '''
+import json, sys, time
+t0 = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - t0
+loaded = [m for m in {plotting} if m in sys.modules]
+print(json.dumps({{'seconds': elapsed, 'plotting': loaded}}))
+'''
+
+
+def import_time(module, repeat=5):
+    """
+    Median import time of a module in new interpreters, and any plotting
+    libraries that it loaded.
+
+    inputs:
+        module: str
+        repeat: int
+            Number of interpreters to start
+    outputs:
+        seconds: float
+        plotting: list
+    """
+    code = _probe.format(module=module, plotting=plotting_modules)
+    runs = []
+    for _ in range(repeat):
+        out = subprocess.check_output([sys.executable, '-c', code], cwd=src)
+        runs.append(json.loads(out.decode('utf-8')))
+    seconds = sorted(run['seconds'] for run in runs)[len(runs) // 2]
+
+    return seconds, runs[-1]['plotting']
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--max-seconds', type=float, default=None)
+    parser.add_argument('modules', nargs='*', default=compute_modules)
+    args = parser.parse_args(args)
+
+    failed = False
+    for module in args.modules:
+        seconds, plotting = import_time(module, args.repeat)
+        problems = []
+        if plotting:
+            problems.append('imports {}'.format(', '.join(plotting)))
+        if args.max_seconds is not None and seconds > args.max_seconds:
+            problems.append('slower than {} s'.format(args.max_seconds))
+        failed = failed or bool(problems)
+        print('{:<14} {:7.3f} s  {}'.format(module, seconds,
+                                           '; '.join(problems) or 'ok'))
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,335 @@
+"""
+Benchmarks for the emissions -> forcing -> heatmap pipeline. Each stage is
+timed (best of --repeat runs) and its peak traced memory is recorded, over
+a grid of leak values, CCS start years, time steps, Monte Carlo runs and
+heatmap modes (bars and raster). Each case is appended to a JSON lines
+history file (benchmarks/history.jsonl, not tracked by git) as soon as it
+finishes, and the run can be compared with a baseline to flag regressions.
+A case that fails is recorded with its error and the run continues.
+
+    python benchmarks/pipeline.py                      # run and append
+    python benchmarks/pipeline.py --quick              # smaller grid
+    python benchmarks/pipeline.py --save-baseline      # new baseline
+    python benchmarks/pipeline.py --compare            # exit 1 if slower
+"""
+import argparse
+import datetime
+import gc
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import traceback
+import tracemalloc
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'src'))
+
+import numpy as np
+import pandas as pd
+
+from emissions import emissions, emissions_array, concat_arrays
+from forcing import emissions_to_forcing, array_to_forcing
+from uncertainty import monte_carlo, emission_differences
+
+
+history_file = os.path.join(here, 'history.jsonl')
+baseline_file = os.path.join(here, 'baseline.json')
+
+# Scenarios in the main paper figures
+fig_scenarios = {key: {'Coal CCS': coal, 'Gas CCS': gas, 'Methane': methane}
+                 for key, (methane, coal, gas) in zip(
+                     'abcdefgh',
+                     itertools.product(['Constant', 'Reduce'], ['90%', '16%'],
+                                       ['90%', '0%']))}
+
+grid = {'leaks': [5, 10, 20],
+        'starts': [1, 3],
+        'tstep': [0.1, 0.01],
+        'mc_runs': [100, 1000],
+        'raster': [False, True]}
+quick_grid = {'leaks': [5],
+              'starts': [1, 3],
+              'tstep': [0.01],
+              'mc_runs': [100],
+              'raster': [False, True]}
+
+
+class Skip(Exception):
+    'Raised by a stage for a case that cannot run in this environment'
+
+
+def measure(func, repeat=3):
+    """
+    Best wall time of *func* over *repeat* calls, and the peak traced memory
+    of one extra call.
+
+    outputs:
+        seconds: float
+        peak_mb: float
+        result: output of the last call
+    """
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        t0 = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - t0)
+
+    gc.collect()
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return min(times), peak / 2**20, result
+
+
+def _start_years(n):
+    return [10 * i for i in range(n)]
+
+
+def stage_emissions(leaks, starts, tstep, **_):
+    def run():
+        return pd.concat([emissions(CCS_start=start,
+                                    leak_values=range(1, leaks + 1),
+                                    tstep=tstep)
+                          for start in _start_years(starts)])
+    return run
+
+
+def stage_forcing(leaks, starts, tstep, **_):
+    df = stage_emissions(leaks, starts, tstep)()
+
+    def run():
+        return emissions_to_forcing(df, kind='CRF')
+    return run
+
+
+def _forcing_frame(leaks, starts, tstep, kind='CRF'):
+    arrays = [emissions_array(CCS_start=start,
+                              leak_values=range(1, leaks + 1), tstep=tstep)
+              for start in _start_years(starts)]
+
+    return array_to_forcing(*concat_arrays(arrays), kind=kind).reset_index()
+
+
+def stage_figure_data(leaks, starts, tstep, **_):
+    from heatmap import Main_figure
+    df = _forcing_frame(leaks, starts, tstep)
+    delay_years = _start_years(starts)
+
+    def run():
+        fig = Main_figure()
+        fig.figure_data(df, fig_scenarios, leak_rates=range(1, leaks + 1),
+                        kind='CRF', delay_years=delay_years)
+        fig.set_cbar_scale(leak_rates=range(1, leaks + 1))
+        fig.set_color_values()
+        return fig
+    return run
+
+
+def stage_plot_heatmap(leaks, starts, tstep, raster, **_):
+    import matplotlib
+    if not raster and int(matplotlib.__version__.split('.')[0]) >= 3:
+        # The bars mode passes left= to Axes.bar (matplotlib 2 only)
+        raise Skip('bars mode needs matplotlib < 3, not {}'
+                   .format(matplotlib.__version__))
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    fig = stage_figure_data(leaks, starts, tstep)()
+    delay_years = _start_years(starts)
+
+    def run():
+        fig.plot_heatmap(leak_rates=range(1, leaks + 1),
+                         delay_years=delay_years, figsize=[13, 6],
+                         scenario_keys=fig_scenarios, raster=raster)
+        plt.savefig(os.devnull, format='pdf')
+        plt.close('all')
+    return run
+
+
+def stage_monte_carlo(leaks, starts, tstep, mc_runs, **_):
+    keys, values, time_ = emissions_array(leak_values=range(1, leaks + 1),
+                                          tstep=tstep)
+    first = {'Fuel': 'Coal', 'CCS': '90%'}
+    second = {'Fuel': 'NG', 'CCS': '90%', 'Methane': 'Constant'}
+    diff_keys, diffs = emission_differences(keys, values, first, second)
+
+    def run():
+        return monte_carlo(diffs, time_, kind='CRF', n_runs=mc_runs,
+                           percentiles=(5, 95))
+    return run
+
+
+# Stage name, function, and the grid parameters it depends on
+stages = [('emissions', stage_emissions, ['leaks', 'starts', 'tstep']),
+          ('emissions_to_forcing', stage_forcing,
+           ['leaks', 'starts', 'tstep']),
+          ('figure_data', stage_figure_data, ['leaks', 'starts']),
+          ('plot_heatmap', stage_plot_heatmap, ['leaks', 'starts', 'raster']),
+          ('monte_carlo', stage_monte_carlo, ['leaks', 'tstep', 'mc_runs'])]
+
+
+def cases(grid, params):
+    "Every combination of the grid values for *params*"
+    for values in itertools.product(*[grid[p] for p in params]):
+        yield dict(zip(params, values))
+
+
+def case_id(stage, params):
+    return '{}[{}]'.format(stage, ','.join('{}={}'.format(k, params[k])
+                                           for k in sorted(params)))
+
+
+def run_benchmarks(grid, repeat=3, only=None, record=None):
+    """
+    Time every stage over its grid of parameters. A case that raises is
+    recorded with its error (or as skipped, for *Skip*) and the other cases
+    still run.
+
+    inputs:
+        grid: dict
+            Values of 'leaks', 'starts', 'tstep', 'mc_runs' and 'raster'
+        repeat: int
+            Number of timed calls for each case
+        only: list or None
+            Names of the stages to run. All stages if None.
+        record: function or None
+            Called with the result of each case as soon as it finishes
+    outputs:
+        results: list
+            One dict per case with 'id', 'stage', 'params', 'seconds' and
+            'peak_mb', or 'skipped' or 'error' (with seconds and peak_mb
+            None) if the case did not run
+    """
+    # Fixed values for parameters that a stage does not vary
+    fixed = {'leaks': grid['leaks'][0], 'starts': grid['starts'][0],
+             'tstep': 0.01, 'mc_runs': grid['mc_runs'][0]}
+    results = []
+    for name, stage, params in stages:
+        if only and name not in only:
+            continue
+        for case in cases(grid, params):
+            kwargs = dict(fixed, **case)
+            result = {'id': case_id(name, case), 'stage': name,
+                      'params': case, 'seconds': None, 'peak_mb': None}
+            try:
+                seconds, peak_mb, _ = measure(stage(**kwargs), repeat)
+            except Skip as e:
+                result['skipped'] = str(e)
+                print('{:<60} skipped: {}'.format(result['id'], e))
+            except Exception as e:
+                result['error'] = '{}: {}'.format(type(e).__name__, e)
+                print('{:<60} FAILED'.format(result['id']))
+                traceback.print_exc()
+            else:
+                result.update(seconds=seconds, peak_mb=peak_mb)
+                print('{:<60} {:9.4f} s {:9.1f} MB'.format(result['id'],
+                                                           seconds, peak_mb))
+            sys.stdout.flush()
+            results.append(result)
+            if record is not None:
+                record(result)
+
+    return results
+
+
+def environment():
+    "Version information stored with each run"
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=here,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'commit': commit,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'machine': platform.machine(),
+            'cpus': os.cpu_count()}
+
+
+def compare(results, baseline, tolerance=0.25):
+    """
+    Cases that are slower than the baseline by more than *tolerance*
+    (a fraction).
+
+    outputs:
+        regressions: list
+            (id, baseline seconds, new seconds) tuples
+    """
+    base = {r['id']: r for r in baseline['results']}
+    regressions = []
+    for r in results:
+        if r['seconds'] is not None and base.get(r['id'], {}).get('seconds'):
+            old = base[r['id']]['seconds']
+            if r['seconds'] > old * (1 + tolerance):
+                regressions.append((r['id'], old, r['seconds']))
+
+    return regressions
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--quick', action='store_true',
+                        help='Run a smaller grid')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--stage', action='append', dest='stages',
+                        help='Only run this stage (can be repeated)')
+    parser.add_argument('--history', default=history_file)
+    parser.add_argument('--baseline', default=baseline_file)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--compare', action='store_true',
+                        help='Exit with 1 if any case regressed')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args(args)
+
+    env = environment()
+
+    # One history line per case, so finished cases are kept if the run is
+    # interrupted. Lines of the same run share the same env.
+    def record(result):
+        with open(args.history, 'a') as f:
+            f.write(json.dumps({'env': env, 'results': [result]}) + '\n')
+
+    results = run_benchmarks(quick_grid if args.quick else grid,
+                             repeat=args.repeat, only=args.stages,
+                             record=record)
+    failed = [r['id'] for r in results if 'error' in r]
+    for case in failed:
+        print('FAILED {}'.format(case))
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({'env': env,
+                       'results': [r for r in results
+                                   if r['seconds'] is not None]},
+                      f, indent=1)
+
+    status = 1 if failed else 0
+    if not os.path.exists(args.baseline):
+        if args.compare:
+            print('No baseline at {}, nothing to compare (create one with '
+                  '--save-baseline)'.format(args.baseline))
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for case, old, new in regressions:
+            print('REGRESSION {}: {:.4f} s -> {:.4f} s'.format(case, old,
+                                                                new))
+        if regressions and args.compare:
+            status = 1
+
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
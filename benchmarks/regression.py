@@ -0,0 +1,204 @@
+"""
+Regression checks for the faster code paths. *emissions.emissions* must
+match the original implementation (loaded from git) exactly, and forcing
+from the change-point basis, ScenarioSpec lists and the reduced sweep
+metrics must agree with forcing from dense emission arrays.
+
+    python benchmarks/regression.py
+    python benchmarks/regression.py --rev v1.0 --rtol 1e-12
+"""
+import argparse
+import os
+import subprocess
+import sys
+import types
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'src'))
+
+import numpy as np
+import pandas as pd
+
+from basis import BasisCache
+from emissions import (emissions, emissions_array, emissions_segments,
+                       emissions_specs, iter_emissions)
+from forcing import forcing_array
+from metrics import point_metrics, reduce_forcing
+
+
+# Keyword arguments of *emissions* for each case. The original
+# implementation only has the default time grid.
+cases = [{},
+         {'CCS_start': 10, 'year_to_90CCS': 10, 'leak_values': range(1, 11)},
+         {'CCS_start': 40, 'year_to_90CCS': 40},
+         {'CCS_start': 20, 'leakage_drop_by': 20, 'life': 30,
+          'leak_values': [0.5, 1.0, 2, 3.5]},
+         {'CCS_start': 50, 'year_to_90CCS': 60},
+         {'CCS_start': 5, 'year_to_90CCS': 0, 'leakage_drop_by': 50,
+          'life': 30}]
+
+
+class _NumpyCompat:
+    """
+    numpy for the reference module. The original code passes a float number
+    of samples to np.linspace, which numpy 1.18 and later reject.
+    """
+    def __getattr__(self, name):
+        return getattr(np, name)
+
+    def linspace(self, start, stop, num=50, **kwargs):
+        return np.linspace(start, stop, int(num), **kwargs)
+
+
+def reference_module(rev=None):
+    """
+    The emissions module of an earlier commit, imported under another name.
+
+    inputs:
+        rev: str or None
+            Git revision. The first commit of the repository if None.
+    outputs:
+        module: module
+    """
+    if rev is None:
+        rev = subprocess.check_output(
+            ['git', 'rev-list', '--max-parents=0', 'HEAD'],
+            cwd=here).decode().split()[-1]
+    source = subprocess.check_output(['git', 'show',
+                                      '{}:src/emissions.py'.format(rev)],
+                                     cwd=here).decode()
+    module = types.ModuleType('emissions_reference')
+    exec(compile(source, 'emissions.py@{}'.format(rev), 'exec'),
+         module.__dict__)
+    module.np = _NumpyCompat()
+
+    return module
+
+
+def relative_error(value, expected):
+    'Largest absolute difference, relative to the largest expected value'
+    return np.abs(value - expected).max() / np.abs(expected).max()
+
+
+def check_emissions(reference):
+    """
+    Failures of *emissions* against the reference implementation.
+
+    outputs:
+        failures: list
+            Messages
+    """
+    failures = []
+    for case in cases:
+        try:
+            pd.testing.assert_frame_equal(emissions(**case),
+                                          reference.emissions(**case),
+                                          check_exact=True)
+        except AssertionError as e:
+            failures.append('emissions {}: {}'.format(case, e))
+
+    return failures
+
+
+def check_blocks(start_years=(0, 10, 20), leak_values=range(1, 8),
+                 block_size=3):
+    """
+    Failures of *iter_emissions* against *emissions_array* when the leak
+    values are a generator and there are several CCS start years.
+
+    outputs:
+        failures: list
+            Messages
+    """
+    failures = []
+    blocks = list(iter_emissions(CCS_start=list(start_years),
+                                 leak_values=(x for x in leak_values),
+                                 block_size=block_size))
+    keys = pd.concat([b[0] for b in blocks], ignore_index=True)
+    values = np.concatenate([b[1] for b in blocks])
+    ng_rows = [((keys['Fuel'] == 'NG') & (keys['Start year'] == start)).sum()
+               for start in start_years]
+    if len(set(ng_rows)) != 1:
+        failures.append('iter_emissions natural gas rows per start year: {}'
+                        .format(ng_rows))
+
+    arrays = [emissions_array(CCS_start=start, leak_values=leak_values)
+              for start in start_years]
+    expected_keys = pd.concat([a[0] for a in arrays], ignore_index=True)
+    if not (keys.equals(expected_keys)
+            and np.array_equal(values, np.concatenate([a[1]
+                                                       for a in arrays]))):
+        failures.append('iter_emissions blocks differ from emissions_array')
+
+    return failures
+
+
+def check_forcing(rtol=1e-13, tstep=0.01):
+    """
+    Failures of the basis, spec and metrics paths against dense forcing.
+
+    outputs:
+        failures: list
+            Messages
+        errors: dict
+            Largest relative error of each path
+    """
+    basis = BasisCache()
+    errors = {'basis': 0.0, 'spec': 0.0, 'metrics': 0.0}
+    for case in cases:
+        keys, values, time = emissions_array(tstep=tstep, **case)
+        _, segments, _ = emissions_segments(tstep=tstep, **case)
+        specs = emissions_specs(**case)
+        dense = {}
+        for kind in ['RF', 'CRF']:
+            dense[kind], years = forcing_array(values, time, kind=kind)
+            paths = {'basis': basis.forcing_array(segments, time,
+                                                  kind=kind)[0],
+                     'spec': forcing_array(specs, time, kind=kind)[0]}
+            for path, forcing in paths.items():
+                errors[path] = max(errors[path],
+                                   relative_error(forcing, dense[kind]))
+
+        point = dict({'name': 'Base', 'leakage_drop_by': 10, 'life': 40,
+                      'end': 100, 'tstep': tstep}, **case)
+        expected = reduce_forcing(dense['RF'], dense['CRF'], years)
+        scenarios, _ = point_metrics(point)
+        for name, value in expected.items():
+            errors['metrics'] = max(errors['metrics'],
+                                    relative_error(scenarios[name].values,
+                                                   value))
+
+    failures = ['{} forcing differs from dense forcing by {:.3g} (rtol {:g})'
+                .format(path, error, rtol)
+                for path, error in sorted(errors.items()) if error > rtol]
+
+    return failures, errors
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rev', default=None,
+                        help='Git revision of the reference emissions '
+                             '(default: first commit)')
+    parser.add_argument('--rtol', type=float, default=1e-13,
+                        help='Largest error relative to the largest forcing')
+    args = parser.parse_args(args)
+
+    failures = check_emissions(reference_module(args.rev))
+    print('emissions: {}'.format('FAIL' if failures else 'exact'))
+    block_failures = check_blocks()
+    print('blocks:    {}'.format('FAIL' if block_failures else 'exact'))
+    failures += block_failures
+    forcing_failures, errors = check_forcing(args.rtol)
+    for path, error in sorted(errors.items()):
+        print('{:<10} {:.3g}'.format(path + ':', error))
+    failures += forcing_failures
+
+    for message in failures:
+        print('FAIL ' + message)
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,238 @@
+from collections import OrderedDict
+import os
+
+import numpy as np
+
+from emissions import (generation, emissions_segments, scenario_segments,
+                       ScenarioSpec)
+from forcing import CH4_RE, irf_kernels, forcing_frame, _cumtrapz
+import profiling
+
+
+def _terms(segments):
+    """
+    Convert a piecewise-linear profile into the time index, step size and
+    change in slope at each change point.
+    """
+    idx = np.empty(len(segments), dtype=int)
+    step = np.empty(len(segments))
+    ramp = np.empty(len(segments))
+    prev_idx, prev_level, prev_slope = 0, 0.0, 0.0
+    for k, (i, level, slope) in enumerate(segments):
+        idx[k] = i
+        step[k] = level - (prev_level + prev_slope * (i - prev_idx))
+        ramp[k] = slope - prev_slope
+        prev_idx, prev_level, prev_slope = i, level, slope
+
+    return idx, step, ramp
+
+
+class BasisCache:
+    """
+    Forcing from piecewise-linear emission profiles, assembled from cached
+    responses to a unit step and a unit ramp in emissions of each gas.
+    Because forcing is linear in emissions, a scenario is the sum of shifted
+    and scaled copies of these responses. Results match *forcing.forcing_array*
+    on the same time grid.
+
+    Responses are stored for each time grid and CH4 radiative efficiency. The
+    least recently used grids are dropped when there are more than
+    *max_entries*. If *path* is given, responses are loaded from that file
+    when it exists and *save* writes them back.
+    """
+    def __init__(self, path=None, max_entries=8):
+        self.path = path
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _add(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    @profiling.timed('basis.responses')
+    def responses(self, n, tstep=0.01, CH4_RE=CH4_RE):
+        """
+        Step and ramp responses for a time grid.
+
+        inputs:
+            n: int
+                Number of points in the time grid
+            tstep: float
+                Time step of the grid in years
+            CH4_RE: float
+                Radiative efficiency of methane
+        outputs:
+            responses: dict
+                Arrays with shape (basis, gas, time) for 'RF' and 'CRF'. The
+                basis axis is the response to a unit step and to a unit ramp
+                (one unit per time step) that begin at time zero.
+        """
+        key = (n, float(tstep), float(CH4_RE))
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+        kernels = irf_kernels(n, tstep, CH4_RE)
+        step = np.cumsum(kernels, axis=-1) * tstep
+        ramp = np.zeros_like(step)
+        np.cumsum(step[:, :-1], axis=-1, out=ramp[:, 1:])
+
+        rf = np.stack([step, ramp]) * generation
+        entry = {'RF': rf, 'CRF': _cumtrapz(rf, tstep)}
+        self._add(key, entry)
+
+        return entry
+
+    def compose(self, segments, time, kind='RF', CH4_RE=CH4_RE):
+        """
+        Annual RF or CRF from each gas for piecewise-linear emission profiles.
+
+        inputs:
+            segments: list
+                One profile per gas, as returned by
+                *emissions.scenario_segments*
+            time: array
+                Evenly spaced time in years, starting at 0
+            kind: str
+                RF or CRF
+            CH4_RE: float
+                Radiative efficiency of methane
+        outputs:
+            forcing: array
+                Annual forcing from each gas with shape (gas, year)
+        """
+        tstep = time[1] - time[0]
+        slice_step = int(round(1 / tstep))
+        entry = self.responses(time.size, tstep, CH4_RE)
+        responses = entry[kind]
+        rows = np.arange(0, time.size, slice_step)
+
+        forcing = np.zeros((len(segments), rows.size))
+        for g, segs in enumerate(segments):
+            idx, step, ramp = _terms(segs)
+            lag = rows[None, :] - idx[:, None]
+            active = lag >= 0
+            lag = np.where(active, lag, 0)
+
+            out = (step[:, None] * responses[0, g, lag]
+                   + ramp[:, None] * responses[1, g, lag])
+            if kind == 'CRF':
+                # A step that starts after time zero also adds the trapezoid
+                # between zero emissions and its first forcing value.
+                out += ((idx > 0) * step)[:, None] * (entry['RF'][0, g, 0]
+                                                      * tstep / 2.0)
+            forcing[g] = (out * active).sum(axis=0)
+
+        return forcing
+
+    @profiling.timed('basis.forcing_array')
+    def forcing_array(self, segments, time, kind='RF', CH4_RE=CH4_RE):
+        """
+        Annual RF or CRF from each gas for a list of scenarios. Same output
+        as *forcing.forcing_array*.
+
+        inputs:
+            segments: list
+                Output of *emissions.scenario_segments* for each scenario,
+                or a list of *emissions.ScenarioSpec*
+            time: array
+                Evenly spaced time in years, starting at 0
+            kind: str
+                RF or CRF
+            CH4_RE: float
+                Radiative efficiency of methane
+        outputs:
+            forcing: array
+                Annual forcing from each gas with shape (scenario, gas, year)
+            years: array
+                Years for the last axis of *forcing*
+        """
+        years = time[0::int(round(1 / (time[1] - time[0])))]
+        forcing = np.empty((len(segments), 2, years.size))
+        for i, segs in enumerate(segments):
+            if isinstance(segs, ScenarioSpec):
+                segs = segs.segments(time)
+            forcing[i] = self.compose(segs, time, kind=kind, CH4_RE=CH4_RE)
+
+        return forcing, years
+
+    def scenario(self, fuel, ccs, time, kind='RF', CH4_RE=CH4_RE, **kwargs):
+        """
+        Annual RF or CRF from each gas for one scenario of *emissions*.
+        Keyword arguments are passed to *emissions.scenario_segments*.
+
+        outputs:
+            forcing: array
+                Annual forcing from each gas with shape (gas, year)
+        """
+        segments = scenario_segments(fuel, ccs, time, **kwargs)
+
+        return self.compose(segments, time, kind=kind, CH4_RE=CH4_RE)
+
+    def save(self, path=None):
+        'Write all cached responses to a compressed numpy file'
+        path = path or self.path
+        arrays = {}
+        for i, (key, entry) in enumerate(self._entries.items()):
+            arrays['key_{}'.format(i)] = np.array(key)
+            for kind, value in entry.items():
+                arrays['{}_{}'.format(kind, i)] = value
+        np.savez_compressed(path, **arrays)
+
+    def load(self, path=None):
+        'Add cached responses from a file written by *save*'
+        path = path or self.path
+        with np.load(path) as data:
+            i = 0
+            while 'key_{}'.format(i) in data:
+                n, tstep, ch4_re = data['key_{}'.format(i)]
+                self._add((int(n), float(tstep), float(ch4_re)),
+                          {kind: data['{}_{}'.format(kind, i)]
+                           for kind in ['RF', 'CRF']})
+                i += 1
+
+
+default_cache = BasisCache()
+
+
+def exact_forcing(kind='RF', end=100, tstep=0.01, CH4_RE=CH4_RE, cache=None,
+                  **kwargs):
+    """
+    Annual RF or CRF for every scenario of *emissions*, found from the change
+    points of each scenario rather than from dense emission arrays. Step
+    changes at CCS_start, leakage_drop_by, year_to_90CCS and life are handled
+    by shifting cached step and ramp responses, so results are the same as
+    *forcing.array_to_forcing* on a *tstep* grid (to about 1e-13 relative)
+    while no per-scenario time series is built. The horizon (*end*) only
+    changes the length of the cached responses.
+
+    inputs:
+        kind: str
+            RF or CRF
+        end: int
+            Number of years to calculate
+        tstep: float
+            Time step of the reference calculation grid
+        CH4_RE: float
+            Radiative efficiency of methane
+        cache: BasisCache or None
+            Cache of step and ramp responses. Uses *default_cache* if None.
+        Other keyword arguments are passed to *emissions.emissions_segments*.
+    outputs:
+        complete_df: dataframe
+            Same format as *forcing.forcing_frame*
+    """
+    if cache is None:
+        cache = default_cache
+    keys, segments, time = emissions_segments(end=end, tstep=tstep, **kwargs)
+    forcing, years = cache.forcing_array(segments, time, kind=kind,
+                                         CH4_RE=CH4_RE)
+
+    return forcing_frame(keys, forcing, years, kind=kind)
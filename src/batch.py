@@ -0,0 +1,310 @@
+"""
+Command-line batch runner for large sweeps. Scenarios from a JSON sweep
+spec are run in chunks, and each finished chunk is written to the results
+directory as a *store.ScenarioStore* in a single atomic rename. Running the
+same command again after a crash skips the chunks that are already there.
+
+    python batch.py sweep.json --out results/sweep1
+
+An example spec (missing fields use *batch_defaults*):
+
+    {"start_years": [0, 10, 20], "leak_values": [1, 2, 3, 4, 5],
+     "methane": ["Constant", "Reduce"], "gas_ccs": ["0%", "90%"],
+     "coal_ccs": ["0%", "90%", "16%-90%"], "kinds": ["RF", "CRF"],
+     "uncertainty_runs": 0, "chunk_size": 500}
+"""
+import argparse
+import datetime
+import itertools
+import json
+import os
+import shutil
+import sys
+import time as _time
+
+import pandas as pd
+import numpy as np
+
+from cache import emissions_constants, stable_hash
+from emissions import (coal_emissions, ng_emissions, ScenarioSpec,
+                       expand_specs, spec_keys, time_grid)
+from forcing import CH4_RE, forcing_array
+import profiling
+from store import ScenarioStore, write_store
+from uncertainty import mc_gases, monte_carlo
+
+
+batch_defaults = {'start_years': [0],
+                  'leak_values': [1, 2, 3, 4, 5],
+                  'methane': ['Constant', 'Reduce'],
+                  'gas_ccs': list(ng_emissions),
+                  'coal_ccs': list(coal_emissions) + ['16%-90%'],
+                  'kinds': ['RF', 'CRF'],
+                  'leakage_drop_by': [10],
+                  'life': [40],
+                  'year_to_90CCS': None,
+                  'end': 100,
+                  'tstep': 0.01,
+                  'uncertainty_runs': 0,
+                  'percentiles': [5, 95],
+                  'seed': 1,
+                  'chunk_size': 500}
+
+# Extra key columns of the batch results
+batch_cols = ['Leakage drop by', 'Life']
+
+_spec_file = 'spec.json'
+
+
+def load_spec(spec):
+    """
+    Sweep spec with defaults filled in.
+
+    inputs:
+        spec: dict or str
+            Spec, or the path of a JSON file with one
+    outputs:
+        spec: dict
+    """
+    if isinstance(spec, str):
+        with open(spec) as f:
+            spec = json.load(f)
+    unknown = set(spec) - set(batch_defaults)
+    if unknown:
+        raise ValueError('Unknown sweep spec fields: {}'
+                         .format(sorted(unknown)))
+    spec = dict(batch_defaults, **spec)
+    for field in ['start_years', 'leak_values', 'methane', 'gas_ccs',
+                  'coal_ccs', 'kinds', 'leakage_drop_by', 'life']:
+        if np.ndim(spec[field]) == 0:
+            spec[field] = [spec[field]]
+    for kind in spec['kinds']:
+        if kind not in ('RF', 'CRF'):
+            raise ValueError('kinds must be "RF" and/or "CRF"')
+
+    return spec
+
+
+def batch_scenarios(spec):
+    """
+    Every scenario of a sweep spec, in the order they are run.
+
+    outputs:
+        specs: list
+            *emissions.ScenarioSpec* for each scenario
+        keys: dataframe
+            Emission key columns and *batch_cols*
+    """
+    specs = []
+    extra = []
+    for start, drop, life in itertools.product(spec['start_years'],
+                                               spec['leakage_drop_by'],
+                                               spec['life']):
+        kwargs = dict(CCS_start=start, leakage_drop_by=drop, life=life,
+                      year_to_90CCS=(start if spec['year_to_90CCS'] is None
+                                     else spec['year_to_90CCS']))
+        for leak, ccs, methane in itertools.product(spec['leak_values'],
+                                                    spec['gas_ccs'],
+                                                    spec['methane']):
+            specs.append(ScenarioSpec('NG', ccs, methane, leak, **kwargs))
+            extra.append((drop, life))
+        for ccs in spec['coal_ccs']:
+            specs.append(ScenarioSpec('Coal', ccs, **kwargs))
+            extra.append((drop, life))
+
+    keys = pd.concat([spec_keys(specs),
+                      pd.DataFrame(extra, columns=batch_cols)], axis=1)
+
+    return specs, keys
+
+
+def run_chunk(specs, spec, CH4_RE=CH4_RE):
+    """
+    Forcing, and optionally Monte Carlo statistics, for one chunk.
+
+    outputs:
+        outputs: dict
+            (values, columns) for each output name: the kinds, and
+            '<kind> <stat>' for each uncertainty statistic
+        years: array
+    """
+    time = time_grid(spec['end'], spec['tstep'])
+    outputs = {}
+    for kind in spec['kinds']:
+        forcing, years = forcing_array(specs, time, kind=kind, CH4_RE=CH4_RE)
+        outputs[kind] = (forcing, ['CO2', 'CH4'])
+
+    if spec['uncertainty_runs'] > 0:
+        values = expand_specs(specs, time)
+        for kind in spec['kinds']:
+            stats, years = monte_carlo(values, time, kind=kind,
+                                       n_runs=spec['uncertainty_runs'],
+                                       percentiles=spec['percentiles'],
+                                       seed=spec['seed'], CH4_RE=CH4_RE)
+            for stat, value in stats.items():
+                name = stat if isinstance(stat, str) else 'p{:g}'.format(stat)
+                outputs['{} {}'.format(kind, name)] = (value, mc_gases)
+
+    return outputs, years
+
+
+def _chunk_dir(out_dir, i):
+    return os.path.join(out_dir, 'chunk-{:05d}'.format(i))
+
+
+def _write_chunk(out_dir, i, keys, outputs, years):
+    "Write a chunk to a temporary directory and rename it into place"
+    final = _chunk_dir(out_dir, i)
+    tmp = '{}.tmp-{}'.format(final, os.getpid())
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    for name, (values, columns) in outputs.items():
+        write_store(os.path.join(tmp, name), keys, values, years,
+                    columns=columns, attrs={'output': name})
+    os.rename(tmp, final)
+
+
+def run_batch(spec, out_dir, restart=False, CH4_RE=CH4_RE, log=print):
+    """
+    Run a sweep in chunks, writing each finished chunk to *out_dir*. If
+    *out_dir* already has results for the same spec, chunks that were
+    finished are skipped.
+
+    inputs:
+        spec: dict or str
+            Sweep spec (see *load_spec*)
+        out_dir: str
+            Results directory
+        restart: bool
+            If True, delete existing results first
+        CH4_RE: float
+            Radiative efficiency of methane
+        log: function or None
+            Called with a progress message after each chunk
+    outputs:
+        summary: dict
+            'scenarios', 'chunks', 'skipped' and 'seconds'
+    """
+    spec = load_spec(spec)
+    # Results also depend on the constants in the emissions module
+    spec_hash = stable_hash(spec, CH4_RE, emissions_constants())
+    spec_path = os.path.join(out_dir, _spec_file)
+
+    if restart and os.path.exists(out_dir):
+        shutil.rmtree(out_dir)
+    if os.path.exists(spec_path):
+        with open(spec_path) as f:
+            if json.load(f)['hash'] != spec_hash:
+                raise ValueError('{} has results for a different sweep spec. '
+                                 'Use another directory or restart.'
+                                 .format(out_dir))
+    else:
+        if not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+        with open(spec_path + '.tmp', 'w') as f:
+            json.dump({'hash': spec_hash, 'spec': spec, 'CH4_RE': CH4_RE},
+                      f, indent=1)
+        os.rename(spec_path + '.tmp', spec_path)
+
+    # Partial chunks from a run that was stopped
+    for name in os.listdir(out_dir):
+        if '.tmp-' in name:
+            shutil.rmtree(os.path.join(out_dir, name))
+
+    specs, keys = batch_scenarios(spec)
+    size = spec['chunk_size']
+    n_chunks = int(np.ceil(len(specs) / float(size)))
+    todo = [i for i in range(n_chunks)
+            if not os.path.exists(_chunk_dir(out_dir, i))]
+    skipped = n_chunks - len(todo)
+    if log and skipped:
+        log('Resuming: {} of {} chunks already done'.format(skipped,
+                                                             n_chunks))
+
+    total = sum(len(specs[i * size:(i + 1) * size]) for i in todo)
+    t0 = _time.perf_counter()
+    done = 0
+    for i in todo:
+        rows = slice(i * size, (i + 1) * size)
+        chunk_keys = keys.iloc[rows].reset_index(drop=True)
+        with profiling.span('batch.chunk', chunk=i):
+            outputs, years = run_chunk(specs[rows], spec, CH4_RE)
+            _write_chunk(out_dir, i, chunk_keys, outputs, years)
+        profiling.count('batch.scenarios', len(chunk_keys))
+
+        done += len(chunk_keys)
+        elapsed = _time.perf_counter() - t0
+        rate = done / elapsed
+        if log:
+            log('chunk {}/{}  {} scenarios  {:.1f} scenarios/s  ETA {}'.format(
+                i + 1, n_chunks, done, rate,
+                datetime.timedelta(seconds=int((total - done) / rate))))
+
+    return {'scenarios': len(specs), 'chunks': n_chunks, 'skipped': skipped,
+            'seconds': _time.perf_counter() - t0}
+
+
+def load_batch(out_dir, output='RF'):
+    """
+    Results of one output for every finished chunk of a batch run.
+
+    inputs:
+        out_dir: str
+            Results directory of *run_batch*
+        output: str
+            A kind (e.g. 'RF') or an uncertainty statistic (e.g. 'CRF mean',
+            'RF p95')
+    outputs:
+        keys: dataframe
+            One row per scenario
+        values: array
+            Shape (scenario, column, year). Pass kinds to
+            *forcing.forcing_frame* for the notebook format.
+        years: array
+    """
+    chunks = sorted(name for name in os.listdir(out_dir)
+                    if name.startswith('chunk-') and '.tmp-' not in name)
+    if not chunks:
+        raise ValueError('No finished chunks in {}'.format(out_dir))
+    stores = [ScenarioStore(os.path.join(out_dir, name, output))
+              for name in chunks]
+    keys = pd.concat([s.keys for s in stores], ignore_index=True)
+    values = np.concatenate([s.values for s in stores])
+
+    return keys, values, stores[0].axis
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('spec', help='JSON sweep spec')
+    parser.add_argument('--out', required=True, help='Results directory')
+    parser.add_argument('--chunk-size', type=int, default=None,
+                        help='Scenarios per chunk (overrides the spec)')
+    parser.add_argument('--restart', action='store_true',
+                        help='Delete existing results and start again')
+    parser.add_argument('--quiet', action='store_true')
+    parser.add_argument('--profile', default=None,
+                        help='Write a Chrome trace to this file')
+    args = parser.parse_args(args)
+
+    spec = load_spec(args.spec)
+    if args.chunk_size is not None:
+        spec['chunk_size'] = args.chunk_size
+
+    def log(message):
+        print(message)
+        sys.stdout.flush()
+
+    if args.profile is not None:
+        profiler = profiling.enable()
+    summary = run_batch(spec, args.out, restart=args.restart,
+                        log=None if args.quiet else log)
+    if args.profile is not None:
+        profiler.save(args.profile)
+
+    print('{scenarios} scenarios in {chunks} chunks ({skipped} already done),'
+          ' {seconds:.1f} s'.format(**summary))
+
+
+if __name__ == '__main__':
+    main()
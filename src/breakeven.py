@@ -0,0 +1,129 @@
+import pandas as pd
+import numpy as np
+
+from emissions import coal_emissions, ng_emissions, emissions_array
+from forcing import CH4_RE, forcing_array
+
+
+index_cols = ['Coal CCS', 'Gas CCS', 'Methane', 'Start year', 'Time']
+
+# Two leak values that define the affine NGCC response. 'NGCC 1%' is not
+# used because its 'Reduce' profile never drops (see *emissions_array*).
+_leak_points = [0, 2]
+
+
+def leak_response(kind='RF', CCS_start=0, CH4_RE=CH4_RE, total=True, **kwargs):
+    """
+    NGCC methane emissions are the leak rate times a fixed profile, and
+    forcing is linear in emissions, so NGCC forcing is exactly
+    intercept + slope * leak for every scenario and year. Find the intercept
+    and slope from two leak values, along with SCPC forcing.
+
+    inputs:
+        kind: str
+            RF or CRF
+        CCS_start: int
+            Year of operation that CCS begins
+        CH4_RE: float
+            Radiative efficiency of methane
+        total: bool
+            If False, keep forcing from each gas on an extra axis after the
+            scenario axis
+        Other keyword arguments are passed to *emissions.emissions_array*
+        (except leak_values).
+    outputs:
+        ng_keys: dataframe
+            One row per NGCC scenario (CCS and methane path)
+        intercept: array
+            Total NGCC forcing with no leakage, shape (NG scenario, year)
+        slope: array
+            Total NGCC forcing per 1% leakage, shape (NG scenario, year)
+        coal_keys: dataframe
+            One row per SCPC scenario
+        coal: array
+            Total SCPC forcing, shape (coal scenario, year)
+        years: array
+    """
+    keys, values, time = emissions_array(CCS_start=CCS_start,
+                                         leak_values=_leak_points, **kwargs)
+    forcing, years = forcing_array(values, time, kind=kind, CH4_RE=CH4_RE)
+    if total:
+        forcing = forcing.sum(axis=1)
+
+    is_ng = (keys['Fuel'] == 'NG').values
+    ng = forcing[is_ng].reshape((len(_leak_points), -1) + forcing.shape[1:])
+    ng_keys = (keys[is_ng].iloc[:ng.shape[1]].drop(columns='Leak')
+               .reset_index(drop=True))
+
+    intercept = ng[0]
+    slope = (ng[1] - ng[0]) / (_leak_points[1] - _leak_points[0])
+
+    coal_keys = keys[~is_ng].reset_index(drop=True)
+
+    return ng_keys, intercept, slope, coal_keys, forcing[~is_ng], years
+
+
+def break_even_leak(kind='RF', start_years=(0,), coal_ccs=None,
+                    CH4_RE=CH4_RE, coal_emissions=coal_emissions,
+                    ng_emissions=ng_emissions, **kwargs):
+    """
+    Leakage rate where NGCC and SCPC forcing are equal, for every pair of
+    SCPC and NGCC scenarios, CCS start year and year of the time axis.
+    Found in closed form from *leak_response*, with no run per leak value.
+    NGCC forcing is lower than SCPC when leakage is below the break-even
+    rate.
+
+    inputs:
+        kind: str
+            RF or CRF
+        start_years: list
+            Values of CCS_start
+        coal_ccs: list or None
+            SCPC CCS keys to compare against. All coal scenarios if None.
+        CH4_RE: float
+            Radiative efficiency of methane
+        coal_emissions: dict
+            Dictionary of CO2 and CH4 emission values for each CCS capture rate
+        ng_emissions: dict
+            Dictionary of CO2 and CH4 emission values for each CCS capture rate
+        Other keyword arguments are passed to *emissions.emissions_array*.
+    outputs:
+        df: dataframe
+            'Break-even leak' in percent with an index of *index_cols*. It is
+            NaN where methane leakage does not change NGCC forcing (year 0).
+            Negative values mean NGCC forcing is higher than SCPC even with
+            no leakage.
+    """
+    df_list = []
+    for start in start_years:
+        ng_keys, intercept, slope, coal_keys, coal, years = leak_response(
+            kind=kind, CCS_start=start, CH4_RE=CH4_RE,
+            coal_emissions=coal_emissions, ng_emissions=ng_emissions,
+            **kwargs)
+
+        if coal_ccs is not None:
+            keep = coal_keys['CCS'].isin(coal_ccs).values
+            coal_keys = coal_keys[keep].reset_index(drop=True)
+            coal = coal[keep]
+
+        # Shape (coal, NG, year)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            leak = (coal[:, None, :] - intercept) / slope
+        leak[:, slope <= 0] = np.nan
+
+        n_coal, n_ng = len(coal_keys), len(ng_keys)
+        df_list.append(pd.DataFrame({
+            'Coal CCS': np.repeat(coal_keys['CCS'].values, n_ng * years.size),
+            'Gas CCS': np.tile(np.repeat(ng_keys['CCS'].values, years.size),
+                               n_coal),
+            'Methane': np.tile(np.repeat(ng_keys['Methane'].values,
+                                         years.size), n_coal),
+            'Start year': start,
+            'Time': np.tile(np.round(years).astype(int), n_coal * n_ng),
+            'Break-even leak': leak.ravel()}))
+
+    df = pd.concat(df_list, ignore_index=True)
+    df.set_index(index_cols, inplace=True)
+    df.sort_index(inplace=True)
+
+    return df
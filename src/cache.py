@@ -0,0 +1,263 @@
+from collections import OrderedDict
+import hashlib
+from io import StringIO
+import json
+import os
+
+import pandas as pd
+import numpy as np
+
+import emissions as _emissions
+from basis import default_cache
+from emissions import (coal_emissions, ng_emissions, emissions_array,
+                       emissions_segments, tidy_emissions)
+from forcing import CH4_RE, generation, forcing_frame
+
+
+def _canonical(obj):
+    """
+    Convert inputs to a JSON-serializable form that does not depend on dict
+    order or numpy types. Floats use repr so that any change is seen.
+    """
+    if isinstance(obj, dict):
+        return {'dict': sorted([_canonical(k), _canonical(v)]
+                               for k, v in obj.items())}
+    if isinstance(obj, (list, tuple, range)):
+        return [_canonical(x) for x in obj]
+    if isinstance(obj, np.ndarray):
+        return {'array': hashlib.sha1(np.ascontiguousarray(obj).tobytes())
+                         .hexdigest(),
+                'dtype': obj.dtype.str, 'shape': list(obj.shape)}
+    if isinstance(obj, np.generic):
+        obj = obj.item()
+    if isinstance(obj, float):
+        return {'float': repr(obj)}
+    if obj is None or isinstance(obj, (bool, int, str)):
+        return obj
+    raise TypeError('Cannot hash inputs of type {}'.format(type(obj)))
+
+
+def stable_hash(*args, **kwargs):
+    """
+    Hash of any mix of numbers, strings, arrays, lists and dicts that is the
+    same across sessions and machines.
+
+    outputs:
+        key: str
+            Hex digest
+    """
+    text = json.dumps(_canonical([list(args), kwargs]), sort_keys=True)
+
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def emissions_constants():
+    """
+    Public numeric and dict constants of the emissions module (plant size,
+    heat rates, emission factors, etc). They are part of every cache key so
+    that editing a constant invalidates the results that depend on it.
+
+    outputs:
+        constants: dict
+    """
+    return {name: value for name, value in vars(_emissions).items()
+            if not name.startswith('_')
+            and isinstance(value, (int, float, dict))}
+
+
+class ResultCache:
+    """
+    Content-addressed cache of numpy arrays. Entries are stored under a hash
+    of their inputs (see *stable_hash*), in memory and optionally on disk as
+    one .npz file per entry. Both levels drop the least recently used entries
+    when they are over *max_bytes*. Counts of hits and misses are in *stats*.
+    """
+    def __init__(self, path=None, max_bytes=512 * 2**20,
+                 max_disk_bytes=4 * 2**30):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self.stats = {'hits': 0, 'disk_hits': 0, 'misses': 0,
+                      'evictions': 0}
+        if path is not None and not os.path.exists(path):
+            os.makedirs(path)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries or (self.path is not None
+                                         and os.path.exists(self._file(key)))
+
+    def _file(self, key):
+        return os.path.join(self.path, key + '.npz')
+
+    @staticmethod
+    def _size(value):
+        return sum(array.nbytes for array in value.values())
+
+    def _add(self, key, value):
+        if key in self._entries:
+            self._nbytes -= self._size(self._entries.pop(key))
+        self._entries[key] = value
+        self._nbytes += self._size(value)
+        while self._nbytes > self.max_bytes and len(self._entries) > 1:
+            _, old = self._entries.popitem(last=False)
+            self._nbytes -= self._size(old)
+            self.stats['evictions'] += 1
+
+    def get(self, key):
+        """
+        Cached value for a key, or None. Disk entries are loaded into memory.
+
+        inputs:
+            key: str
+                Output of *stable_hash*
+        outputs:
+            value: dict or None
+                Arrays stored with *put*
+        """
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return self._entries[key]
+
+        if self.path is not None and os.path.exists(self._file(key)):
+            with np.load(self._file(key)) as data:
+                value = {name: data[name] for name in data.files}
+            # Update the modification time, which orders disk evictions
+            os.utime(self._file(key), None)
+            self._add(key, value)
+            self.stats['disk_hits'] += 1
+            return value
+
+        self.stats['misses'] += 1
+        return None
+
+    def put(self, key, value):
+        """
+        Store a dict of arrays
+
+        inputs:
+            key: str
+                Output of *stable_hash*
+            value: dict
+                Arrays to store
+        """
+        value = {name: np.asarray(array) for name, array in value.items()}
+        self._add(key, value)
+        if self.path is not None:
+            np.savez(self._file(key), **value)
+            self._trim_disk()
+
+    def _trim_disk(self):
+        files = [os.path.join(self.path, name) for name in os.listdir(self.path)
+                 if name.endswith('.npz')]
+        files = sorted((os.path.getmtime(f), os.path.getsize(f), f)
+                       for f in files)
+        total = sum(size for _, size, _ in files)
+        for _, size, f in files[:-1]:
+            if total <= self.max_disk_bytes:
+                break
+            os.remove(f)
+            total -= size
+            self.stats['evictions'] += 1
+
+    def clear(self, disk=False):
+        'Remove all entries from memory, and from disk if *disk* is True'
+        self._entries.clear()
+        self._nbytes = 0
+        if disk and self.path is not None:
+            for name in os.listdir(self.path):
+                if name.endswith('.npz'):
+                    os.remove(os.path.join(self.path, name))
+
+
+default_results = ResultCache()
+
+
+def cached_emissions(coal_emissions=coal_emissions, ng_emissions=ng_emissions,
+                     CCS_start=0, leakage_drop_by=10,
+                     leak_values=range(1,6), year_to_90CCS=20, life=40,
+                     end=100, tstep=0.01, compact=False, cache=None):
+    """
+    Same output as *emissions.emissions*, stored in a *ResultCache* under a
+    hash of the inputs and the constants of the emissions module.
+
+    inputs:
+        Same as *emissions.emissions*
+        cache: ResultCache or None
+            Uses *default_results* if None
+    outputs:
+        emissions_df: dataframe
+    """
+    if cache is None:
+        cache = default_results
+    kwargs = dict(coal_emissions=coal_emissions, ng_emissions=ng_emissions,
+                  CCS_start=CCS_start, leakage_drop_by=leakage_drop_by,
+                  leak_values=list(leak_values), year_to_90CCS=year_to_90CCS,
+                  life=life, end=end, tstep=tstep)
+    key = stable_hash('emissions_array', emissions_constants(), **kwargs)
+
+    value = cache.get(key)
+    if value is None:
+        keys, values, time = emissions_array(**kwargs)
+        value = {'keys': np.array(keys.to_json(orient='split')),
+                 'values': values, 'time': time}
+        cache.put(key, value)
+
+    keys = pd.read_json(StringIO(str(value['keys'])), orient='split')
+
+    return tidy_emissions(keys, value['values'], value['time'],
+                          compact=compact)
+
+
+def cached_forcing(kind='RF', end=100, tstep=0.01, CH4_RE=CH4_RE, cache=None,
+                   **kwargs):
+    """
+    Annual RF or CRF for every scenario of *emissions*, cached one scenario
+    at a time. Each scenario is keyed by a hash of its change points (see
+    *emissions.scenario_segments*), time grid, CH4 radiative efficiency and
+    generation, so changing one emission factor only
+    recomputes the scenarios whose emissions it changes. Forcing is
+    calculated as in *basis.exact_forcing*.
+
+    inputs:
+        kind: str
+            RF or CRF
+        end: int
+            Number of years to calculate
+        tstep: float
+            Time step of the calculation grid
+        CH4_RE: float
+            Radiative efficiency of methane
+        cache: ResultCache or None
+            Uses *default_results* if None
+        Other keyword arguments are passed to *emissions.emissions_segments*.
+    outputs:
+        complete_df: dataframe
+            Same format as *forcing.forcing_frame*
+    """
+    if cache is None:
+        cache = default_results
+    keys, segments, time = emissions_segments(end=end, tstep=tstep, **kwargs)
+
+    # Emission factors are already in the segments. Generation scales forcing.
+    hashes = [stable_hash('forcing', segs, kind=kind, end=end, tstep=tstep,
+                          CH4_RE=CH4_RE, generation=generation)
+              for segs in segments]
+    results = [cache.get(key) for key in hashes]
+
+    missing = [i for i, value in enumerate(results) if value is None]
+    if missing:
+        forcing, years = default_cache.forcing_array(
+            [segments[i] for i in missing], time, kind=kind, CH4_RE=CH4_RE)
+        for i, scenario_forcing in zip(missing, forcing):
+            results[i] = {'forcing': scenario_forcing, 'years': years}
+            cache.put(hashes[i], results[i])
+
+    forcing = np.stack([value['forcing'] for value in results])
+
+    return forcing_frame(keys, forcing, results[0]['years'], kind=kind)
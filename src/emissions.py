@@ -1,6 +1,10 @@
+from collections import OrderedDict
+
 import pandas as pd
 import numpy as np
 
+import profiling
+
 
 size = 1000 # MW
 hours = 365 * 24
@@ -19,8 +23,10 @@ CO2_per_MJ = 3.8 / 1000 #kg CO2 per % emission per MJ NG
 
 CH4_per_leak =  ngcc_ng * CH4_per_kg_leak
 CH4_per_leak_CCS = ngcc_ccs_ng * CH4_per_kg_leak
-base_CO2 = 357 + CO2_per_MJ * ngcc_MJ # From Exhibit 4-8 of Ref. 3
-base_CO2_CCS = 40 + CO2_per_MJ * ngcc_ccs_MJ # From Exhibit 4-22 of Ref. 3
+ngcc_direct_co2 = 357 # From Exhibit 4-8 of Ref. 3
+ngcc_ccs_direct_co2 = 40 # From Exhibit 4-22 of Ref. 3
+base_CO2 = ngcc_direct_co2 + CO2_per_MJ * ngcc_MJ
+base_CO2_CCS = ngcc_ccs_direct_co2 + CO2_per_MJ * ngcc_ccs_MJ
 
 # Dictionary of emission values for NGCC power plants
 # Leak emissions are per percent leakage rate
@@ -47,16 +53,16 @@ scpc_ch4 = scpc_coal * coal_ch4
 
 
 scpc_ccs_coal = 408.6 #kg coal for 1MWh SCPC w/ CCS from PPFM with heat rate of 10508 btu/kWh
-scpc_ccs_co2 = 97 #kg co2 from 1MWh SCPC w/ CCS from PPFM with heat rate of 10508 btu/kWh
+scpc_ccs_direct_co2 = 97 #kg co2 from 1MWh SCPC w/ CCS from PPFM with heat rate of 10508 btu/kWh
 scpc_ccs_co2_product = 873.1 #kg co2 product from 1MWh SCPC w/ CCS from PPFM
-scpc_ccs_co2 = scpc_ccs_co2 + (scpc_ccs_coal * coal_co2)
+scpc_ccs_co2 = scpc_ccs_direct_co2 + (scpc_ccs_coal * coal_co2)
 scpc_ccs_ch4 = scpc_ccs_coal * coal_ch4
 
 # All 111b values are based on emissions of 1,400 lb/MWh gross from final EPA 111(b) rule
 scpc_111b_coal = 342.1 #kg coal for 1MWh SCPC w/ CCS from PPFM
-scpc_111b_co2 = 682.2 #kg co2 from 1MWh SCPC w/ CCS from PPFM
+scpc_111b_direct_co2 = 682.2 #kg co2 from 1MWh SCPC w/ CCS from PPFM
 scpc_111b_co2_product = 122 #kg co2 product from 1MWh SCPC w/ CCS from PPFM
-scpc_111b_co2 = scpc_111b_co2 + (scpc_111b_coal * coal_co2)
+scpc_111b_co2 = scpc_111b_direct_co2 + (scpc_111b_coal * coal_co2)
 scpc_111b_ch4 = scpc_111b_coal * coal_ch4
 
 # Dictionary of emission values for NGCC power plants
@@ -68,9 +74,422 @@ coal_emissions = {'90%': {'CO2':scpc_ccs_co2,
                           'CH4': scpc_111b_ch4}
                  }
 
+# Technical parameters that the emission values above are calculated from.
+# See *emission_factors*.
+factor_defaults = OrderedDict([
+    ('ngcc_ng', ngcc_ng),
+    ('ngcc_ccs_ng', ngcc_ccs_ng),
+    ('ngcc_MJ', ngcc_MJ),
+    ('ngcc_ccs_MJ', ngcc_ccs_MJ),
+    ('CH4_per_kg_leak', CH4_per_kg_leak),
+    ('CO2_per_MJ', CO2_per_MJ),
+    ('ngcc_direct_co2', ngcc_direct_co2),
+    ('ngcc_ccs_direct_co2', ngcc_ccs_direct_co2),
+    ('coal_co2', coal_co2),
+    ('coal_ch4', coal_ch4),
+    ('scpc_coal', scpc_coal),
+    ('scpc_direct_co2', scpc_direct_co2),
+    ('scpc_ccs_coal', scpc_ccs_coal),
+    ('scpc_ccs_direct_co2', scpc_ccs_direct_co2),
+    ('scpc_111b_coal', scpc_111b_coal),
+    ('scpc_111b_direct_co2', scpc_111b_direct_co2),
+])
+
+
+def emission_factors(**factors):
+    """
+    Build *coal_emissions* and *ng_emissions* from technical parameters, using
+    the same calculations as the module constants. Parameters that are not
+    given use the values in *factor_defaults*. Parameters can be numpy arrays
+    (e.g. one value per sample), in which case the emission values are arrays
+    too.
+
+    inputs:
+        factors: keyword arguments
+            Any of the names in *factor_defaults*
+    outputs:
+        coal_emissions: dict
+            Same structure as the module *coal_emissions*
+        ng_emissions: dict
+            Same structure as the module *ng_emissions*
+    """
+    unknown = set(factors) - set(factor_defaults)
+    if unknown:
+        raise KeyError('Unknown emission factors: {}'.format(sorted(unknown)))
+    f = dict(factor_defaults, **factors)
+
+    ng_emissions = {'0%': {'Fixed': {'CO2': (f['ngcc_direct_co2']
+                                             + f['CO2_per_MJ'] * f['ngcc_MJ']),
+                                     'CH4': 0},
+                           'Leak': {'CO2': 0,
+                                    'CH4': f['ngcc_ng'] * f['CH4_per_kg_leak']}
+                           },
+                    '90%': {'Fixed': {'CO2': (f['ngcc_ccs_direct_co2']
+                                              + f['CO2_per_MJ']
+                                              * f['ngcc_ccs_MJ']),
+                                      'CH4': 0},
+                            'Leak': {'CO2': 0,
+                                     'CH4': (f['ngcc_ccs_ng']
+                                             * f['CH4_per_kg_leak'])}
+                            }
+                    }
+
+    coal_emissions = {}
+    for ccs, prefix in [('90%', 'scpc_ccs'), ('0%', 'scpc'),
+                        ('16%', 'scpc_111b')]:
+        coal = f[prefix + '_coal']
+        coal_emissions[ccs] = {'CO2': (f[prefix + '_direct_co2']
+                                       + (coal * f['coal_co2'])),
+                               'CH4': coal * f['coal_ch4']}
+
+    return coal_emissions, ng_emissions
+
+
+# Order of the gas axis and the scenario key columns used by the array engine
+gases = ['CO2', 'CH4']
+key_cols = ['Leak', 'CCS', 'Fuel', 'Methane', 'Start year']
+
+
+def time_grid(end=100, tstep=0.01):
+    """
+    Evenly spaced time array in years, from 0 to end.
+
+    inputs:
+        end: int
+            Number of years
+        tstep: float
+            Time step in years. 1/tstep must be a whole number so that the
+            grid includes every year.
+    outputs:
+        time: array
+    """
+    steps_per_year = 1 / tstep
+    if abs(steps_per_year - round(steps_per_year)) > 1e-9 or tstep > 1:
+        raise ValueError('1/tstep must be a whole number, not '
+                         '{}'.format(steps_per_year))
+
+    return np.linspace(0, end, num=int(round(end/tstep))+1) #time array
+
+
+def leak_keys(leak_values):
+    """
+    Map leakage rate values to the 'NGCC x%' labels used in the 'Leak' column.
+
+    inputs:
+        leak_values: list or other iterable
+            Numeric values representing leakage rate scenarios. 1 = 1%, etc.
+    outputs:
+        leak: dict
+            Dictionary of leak labels and float leak values, in input order
+    """
+    leak = {} # dictionary of leak values
+    for value in leak_values:
+        # Change values to integer if possible
+        if (type(value) == float) and (value - int(value) == 0):
+            value = int(value)
+
+        key = 'NGCC ' + str(value) + '%' # define the key for a leak value
+        leak[key] = float(value) # Add key and value to the dictionary
+
+    return leak
+
+
+@profiling.timed('emissions.ng_block')
+def _ng_block(leak, time, ng_emissions, CCS_start, leakage_drop_by, life):
+    """
+    Natural gas rows of *emissions_array* for the leak labels and values in
+    *leak* (see *leak_keys*).
+    """
+    leak_labels = list(leak.keys())
+    leak_rates = np.array(list(leak.values()))
+
+    # Boolean masks that match the label slices of the original dataframes
+    pre_ccs = time <= CCS_start
+    after_life = time >= life
+    drop = time <= leakage_drop_by
+    half = (time >= leakage_drop_by) & (time <= life)
+
+    # Leakage rates (constant and reduced), shape (leak, time)
+    leakage = np.repeat(leak_rates[:, None], time.size, axis=1)
+    leakage_drop = leakage.copy()
+    for i, rate in enumerate(leak_labels):
+        # Methane emission rate that drops over time. Starts at initial, with a
+        # linear decrease until half of initial.
+        if rate != 'NGCC 1%':
+            leakage_drop[i, drop] = np.linspace(leak_rates[i], leak_rates[i]/2,
+                                                drop.sum())
+            leakage_drop[i, half] = leak_rates[i]/2
+            leakage_drop[i, after_life] = 0
+
+    # Methane profiles in scenario order, shape (leak, methane, time)
+    methane_labels = ['Constant', 'Reduce']
+    profiles = np.stack([leakage, leakage_drop], axis=1)
+
+    # NGCC emissions, shape (leak, ccs, methane, gas, time)
+    ng_ccs = list(ng_emissions.keys())
+    ng = np.empty((len(leak_labels), len(ng_ccs), 2, 2, time.size))
+    for j, ccs in enumerate(ng_ccs):
+        co2 = ng[:, j, :, 0, :]
+        ch4 = ng[:, j, :, 1, :]
+        co2[:] = ng_emissions[ccs]['Fixed']['CO2']
+        ch4[:] = ng_emissions[ccs]['Leak']['CH4'] * profiles
+
+        # This gets complicated when accounting for delayed CCS start
+        if CCS_start > 0:
+            co2[..., pre_ccs] = ng_emissions['0%']['Fixed']['CO2']
+            ch4[..., pre_ccs] = (ng_emissions['0%']['Leak']['CH4']
+                                 * profiles[..., pre_ccs])
+    ng[..., after_life] = 0
+
+    ng_keys = [(l, ccs, 'NG', methane, CCS_start)
+               for l in leak_labels
+               for ccs in ng_ccs
+               for methane in methane_labels]
+
+    return ng_keys, ng.reshape(-1, 2, time.size)
+
+
+@profiling.timed('emissions.coal_block')
+def _coal_block(time, coal_emissions, CCS_start, year_to_90CCS, life):
+    "SCPC rows of *emissions_array*, including the '16%-90%' scenario"
+    pre_ccs = time <= CCS_start
+    after_life = time >= life
+
+    # SCPC emissions, shape (ccs, gas, time)
+    coal_ccs = list(coal_emissions.keys())
+    coal = np.empty((len(coal_ccs) + 1, 2, time.size))
+    for j, ccs in enumerate(coal_ccs):
+        for g, gas in enumerate(gases):
+            coal[j, g, :] = coal_emissions[ccs][gas]
+        coal[j][:, after_life] = 0
+
+        if CCS_start > 0:
+            for g, gas in enumerate(gases):
+                coal[j, g, pre_ccs] = coal_emissions['0%'][gas]
+
+    # Add one more scenario for CCS that goes from 16% to 90%
+    to_90 = time >= year_to_90CCS
+    coal[-1] = coal[coal_ccs.index('16%')]
+    coal[-1][:, to_90] = coal[coal_ccs.index('90%')][:, to_90]
+    for g, gas in enumerate(gases):
+        coal[-1, g, time <= year_to_90CCS] = coal_emissions['16%'][gas]
+    coal_ccs.append('16%-90%')
+
+    coal_keys = [('SCPC', ccs, 'Coal', '-', CCS_start) for ccs in coal_ccs]
+
+    return coal_keys, coal
+
+
+@profiling.timed('emissions_array')
+def emissions_array(coal_emissions=coal_emissions, ng_emissions=ng_emissions,
+                    CCS_start=0, leakage_drop_by=10,
+                    leak_values=range(1,6), year_to_90CCS=20, life=40,
+                    end=100, tstep=0.01):
+    """
+    Array version of *emissions*. Builds every emission scenario as a single
+    dense float64 array rather than one dataframe per scenario. Inputs are the
+    same as *emissions*.
+
+    outputs:
+        keys: dataframe
+            One row per scenario with the columns in *key_cols*
+        values: array
+            Emissions with shape (scenario, gas, time). The gas axis follows
+            the order in *gases*.
+        time: array
+            Time in years for the last axis of *values*
+    """
+    time = time_grid(end, tstep)
+
+    ng_keys, ng = _ng_block(leak_keys(leak_values), time, ng_emissions,
+                            CCS_start, leakage_drop_by, life)
+    coal_keys, coal = _coal_block(time, coal_emissions, CCS_start,
+                                  year_to_90CCS, life)
+
+    values = np.concatenate([ng, coal])
+
+    # Scenario key table in the same order as the rows of *values*
+    keys = pd.DataFrame(ng_keys + coal_keys, columns=key_cols)
+    profiling.count('emissions.scenarios', len(keys))
+
+    return keys, values, time
+
+
+def iter_emissions(coal_emissions=coal_emissions, ng_emissions=ng_emissions,
+                   CCS_start=0, leakage_drop_by=10,
+                   leak_values=range(1,6), year_to_90CCS=20, life=40,
+                   end=100, tstep=0.01, block_size=10):
+    """
+    Generator version of *emissions_array* that yields the scenarios in
+    blocks, so memory use depends on *block_size* rather than the number of
+    leak values or CCS start years. Blocks come in the same order as the rows
+    of *emissions_array* and can be passed straight to
+    *forcing.iter_forcing*.
+
+    inputs:
+        CCS_start: int or list
+            Year of operation that CCS begins. A list gives the blocks for
+            each start year in turn.
+        block_size: int
+            Number of leak values in each natural gas block. The coal
+            scenarios for each start year are one extra block.
+        Other inputs are the same as *emissions*. *leak_values* can be any
+        iterable, including a generator.
+    outputs:
+        keys: dataframe
+            One row per scenario in the block with the columns in *key_cols*
+        values: array
+            Emissions with shape (scenario, gas, time)
+        time: array
+            Time in years for the last axis of *values*
+    """
+    time = time_grid(end, tstep)
+    start_years = [CCS_start] if np.ndim(CCS_start) == 0 else CCS_start
+
+    # Leak values are read once, since a generator can only be used for the
+    # first start year. Repeated labels are dropped by *leak_keys*.
+    leak = list(leak_keys(leak_values).items())
+
+    for start in start_years:
+        for i in range(0, len(leak), block_size):
+            ng_keys, ng = _ng_block(OrderedDict(leak[i:i + block_size]), time,
+                                    ng_emissions, start, leakage_drop_by, life)
+            yield pd.DataFrame(ng_keys, columns=key_cols), ng, time
+
+        coal_keys, coal = _coal_block(time, coal_emissions, start,
+                                      year_to_90CCS, life)
+        yield pd.DataFrame(coal_keys, columns=key_cols), coal, time
+
+
+def repeat_keys(keys, n, compact=False):
+    """
+    Repeat each row of a scenario key table *n* times, one row per time step.
+
+    inputs:
+        keys: dataframe
+            One row per scenario
+        n: int
+            Number of rows for each scenario
+        compact: bool
+            If True, return each key column as a categorical (integer codes
+            with sorted categories) instead of repeated Python objects
+    outputs:
+        columns: OrderedDict
+            Repeated values for each key column
+    """
+    columns = OrderedDict()
+    for col in keys.columns:
+        col_values = keys[col].values
+        if col == 'Start year':
+            col_values = pd.to_numeric(col_values)
+        if compact:
+            cat = pd.Categorical(col_values)
+            columns[col] = pd.Categorical.from_codes(np.repeat(cat.codes, n),
+                                                     cat.categories)
+        else:
+            columns[col] = np.repeat(col_values, n)
+
+    return columns
+
+
+@profiling.timed('tidy_emissions')
+def tidy_emissions(keys, values, time, compact=False, dtype=np.float64):
+    """
+    Expand the outputs of *emissions_array* into the tidy dataframe returned
+    by *emissions*.
+
+    inputs:
+        keys: dataframe
+            One row per scenario with the columns in *key_cols*
+        values: array
+            Emissions with shape (scenario, gas, time)
+        time: array
+            Time in years for the last axis of *values*
+        compact: bool
+            If True, key columns are categorical (see *repeat_keys*)
+        dtype: numpy dtype
+            Type of the gas columns, e.g. np.float32 to halve their size.
+            Time is always float64 so that it still matches the time grid.
+    outputs:
+        emissions_df: dataframe
+            A single tidy dataframe with all emission scenarios
+    """
+    emissions_df = pd.DataFrame({gas: values[:, g, :].ravel().astype(dtype)
+                                 for g, gas in enumerate(gases)},
+                                columns=gases)
+    for col, col_values in repeat_keys(keys[key_cols], time.size,
+                                       compact=compact).items():
+        emissions_df[col] = col_values
+    emissions_df['Time'] = np.tile(time, len(keys))
+
+    return emissions_df
+
+
+def compact_index(df, index):
+    """
+    Set a sorted, integer-coded MultiIndex. Object columns are converted to
+    categoricals first so that each index level stores only its unique values
+    and the codes.
+
+    inputs:
+        df: dataframe
+            Tidy dataframe with the columns in *index*
+        index: list
+            Columns to use as the index
+    outputs:
+        df: dataframe
+            Copy of *df* with a sorted MultiIndex
+    """
+    df = df.copy()
+    for col in index:
+        if df[col].dtype == object:
+            df[col] = df[col].astype('category')
+
+    return df.set_index(index).sort_index()
+
+
+def memory_report(df):
+    """
+    Bytes used by each column and index level of a dataframe, counting the
+    Python objects in object columns.
+
+    inputs:
+        df: dataframe
+    outputs:
+        report: dataframe
+            Columns 'dtype' and 'bytes', one row per index level and column,
+            plus a 'Total' row
+    """
+    rows = OrderedDict()
+    index = df.index
+    if isinstance(index, pd.MultiIndex):
+        codes = getattr(index, 'codes', None)
+        if codes is None:
+            codes = index.labels
+        for name, level, level_codes in zip(index.names, index.levels, codes):
+            rows['index: {}'.format(name)] = (
+                level.dtype,
+                level.memory_usage(deep=True) + np.asarray(level_codes).nbytes)
+    else:
+        rows['index: {}'.format(index.name)] = (
+            index.dtype, index.memory_usage(deep=True))
+
+    usage = df.memory_usage(index=False, deep=True)
+    for col in df.columns:
+        rows[col] = (df[col].dtype, usage[col])
+
+    report = pd.DataFrame(list(rows.values()), index=list(rows.keys()),
+                          columns=['dtype', 'bytes'])
+    report.loc['Total'] = ['', report['bytes'].sum()]
+
+    return report
+
+
+@profiling.timed('emissions')
 def emissions(coal_emissions=coal_emissions, ng_emissions=ng_emissions,
               CCS_start=0, leakage_drop_by=10,
-              leak_values=range(1,6), year_to_90CCS=20, life=40):
+              leak_values=range(1,6), year_to_90CCS=20, life=40,
+              end=100, tstep=0.01, compact=False, dtype=np.float64):
     """
     Create CO2 and CH4 emission functions for each power plant scenario. All
     natural gas scenarios include both constant leakage rates and leakage rates
@@ -94,144 +513,353 @@ def emissions(coal_emissions=coal_emissions, ng_emissions=ng_emissions,
             changes to 90% capture.
         life: int
             Lifetime of the power plants
+        end: int
+            Number of years to calculate
+        tstep: float
+            Time step in years. 1/tstep must be a whole number.
+        compact: bool
+            If True, key columns are categorical (see *repeat_keys*)
+        dtype: numpy dtype
+            Type of the gas columns
     outputs:
         emissions_df: dataframe
             A single tidy dataframe with all emission scenarios
-        df_list: list of dataframes
-            A list with individual dataframes for each specific emission scenario
     """
-    end = 100
-    tstep = 0.01
-    time = np.linspace(0, end, num=int(end/tstep+1)) #time array
+    keys, values, time = emissions_array(coal_emissions=coal_emissions,
+                                         ng_emissions=ng_emissions,
+                                         CCS_start=CCS_start,
+                                         leakage_drop_by=leakage_drop_by,
+                                         leak_values=leak_values,
+                                         year_to_90CCS=year_to_90CCS,
+                                         life=life, end=end, tstep=tstep)
 
+    return tidy_emissions(keys, values, time, compact=compact, dtype=dtype)
 
-    leak = {} # dictionary of leak values
-    for value in leak_values:
-        # Change values to integer if possible
-        if (type(value) == float) and (value - int(value) == 0):
-            value = int(value)
 
-        key = 'NGCC ' + str(value) + '%' # define the key for a leak value
-        leak[key] = float(value) # Add key and value to the dictionary
+def concat_arrays(arrays):
+    """
+    Combine several outputs of *emissions_array* (e.g. for different CCS
+    start years) into a single key table and emissions array.
 
+    inputs:
+        arrays: list
+            (keys, values, time) tuples that share the same time array
+    outputs:
+        keys: dataframe
+            One row per scenario with the columns in *key_cols*
+        values: array
+            Emissions with shape (scenario, gas, time)
+        time: array
+            Time in years for the last axis of *values*
+    """
+    arrays = list(arrays)
+    time = arrays[0][2]
+    for _, _, _time in arrays[1:]:
+        if not np.array_equal(_time, time):
+            raise ValueError('All emission arrays must use the same time array')
 
+    keys = pd.concat([x[0] for x in arrays], ignore_index=True)
+    values = np.concatenate([x[1] for x in arrays])
 
+    return keys, values, time
 
-    # Empty dataframes for leakage rates (constant and reduced)
-    leakage = pd.DataFrame(index=time, columns=leak.keys())
-    leakage_drop = pd.DataFrame(index=time, columns=leak.keys())
 
-    for rate in leak.keys():
-        #Initial methane emission (or leak) rate
-        leakage.loc[:,rate] = leak[rate]
+def _overlay(segments, other, start, stop):
+    """
+    Replace the part of a piecewise-linear emission profile between two time
+    indices with the same part of another profile.
 
-        #Methane emission rate that drops over time. Starts at initial, with a linear
-        #decrease until half of initial.
-        leakage_drop.loc[:,rate] = leak[rate]
-        if rate != 'NGCC 1%':
-            # Use linspace to interpolate between values
-            leakage_drop.loc[:leakage_drop_by,rate] = np.linspace(leak[rate],
-                                                                 leak[rate]/2,
-                                                                 leakage_drop_by/tstep+1)
-            leakage_drop.loc[leakage_drop_by:life,rate] = leak[rate]/2
-            leakage_drop.loc[life:,rate] = 0
+    Profiles are lists of (index, level, slope) tuples sorted by index. Each
+    segment runs until the index of the next one, with a value of
+    level + slope * (i - index) at time index i.
+    """
+    if start >= stop:
+        return segments
+
+    def clip(segs, lo, hi):
+        out = []
+        for k, (idx, level, slope) in enumerate(segs):
+            end = segs[k + 1][0] if k + 1 < len(segs) else np.inf
+            if end <= lo or idx >= hi:
+                continue
+            if idx < lo:
+                level, idx = level + slope * (lo - idx), lo
+            out.append((idx, level, slope))
+        return out
+
+    return (clip(segments, 0, start) + clip(other, start, stop)
+            + clip(segments, stop, np.inf))
+
+
+def _scale(segments, factor):
+    'Multiply a piecewise-linear emission profile by a constant'
+    return [(idx, factor * level, factor * slope)
+            for idx, level, slope in segments]
+
+
+def scenario_segments(fuel, ccs, time, methane='Constant', leak=1.0,
+                      coal_emissions=coal_emissions, ng_emissions=ng_emissions,
+                      CCS_start=0, leakage_drop_by=10, year_to_90CCS=20,
+                      life=40):
+    """
+    Describe the CO2 and CH4 emissions of a single scenario from *emissions*
+    as piecewise-linear profiles on a time grid, without building the
+    emission arrays.
 
-    df_list = []
+    inputs:
+        fuel: str
+            'NG' or 'Coal'
+        ccs: str
+            Key of *ng_emissions* or *coal_emissions*, or '16%-90%' for coal
+        time: array
+            Evenly spaced time in years, starting at 0
+        methane: str
+            'Constant' or 'Reduce'. Only used for natural gas.
+        leak: float
+            Leakage rate, 1 = 1%. Only used for natural gas.
+        Other inputs are the same as *emissions*.
+    outputs:
+        segments: list
+            One profile per gas in the order of *gases*. Each profile is a list
+            of (index, level, slope) tuples sorted by time index. A segment
+            runs until the index of the next one, with emissions of
+            level + slope * (i - index) at time index i.
+    """
+    n = time.size
+    # Index ranges that match the boolean masks in *emissions_array*
+    pre_ccs = np.searchsorted(time, CCS_start, side='right')
+    after_life = np.searchsorted(time, life, side='left')
+    zero = [(0, 0.0, 0.0)]
+
+    def const(value):
+        return [(0, float(value), 0.0)]
+
+    if fuel == 'NG':
+        label = list(leak_keys([leak]).keys())[0]
+        leak = float(leak)
+        profile = const(leak)
+        if methane == 'Reduce' and label != 'NGCC 1%':
+            drop = np.searchsorted(time, leakage_drop_by, side='right')
+            slope = (leak/2 - leak) / (drop - 1) if drop > 1 else 0.0
+            profile = _overlay(profile, [(0, leak, slope)], 0, drop)
+            profile = _overlay(profile, const(leak/2),
+                               np.searchsorted(time, leakage_drop_by, side='left'),
+                               np.searchsorted(time, life, side='right'))
+            profile = _overlay(profile, zero, after_life, n)
+
+        co2 = const(ng_emissions[ccs]['Fixed']['CO2'])
+        ch4 = _scale(profile, ng_emissions[ccs]['Leak']['CH4'])
+        if CCS_start > 0:
+            co2 = _overlay(co2, const(ng_emissions['0%']['Fixed']['CO2']),
+                           0, pre_ccs)
+            ch4 = _overlay(ch4, _scale(profile, ng_emissions['0%']['Leak']['CH4']),
+                           0, pre_ccs)
+        segments = [_overlay(co2, zero, after_life, n),
+                    _overlay(ch4, zero, after_life, n)]
+
+    elif fuel == 'Coal':
+        def coal(ccs):
+            segs = []
+            for gas in gases:
+                gas_segs = _overlay(const(coal_emissions[ccs][gas]), zero,
+                                    after_life, n)
+                if CCS_start > 0:
+                    gas_segs = _overlay(gas_segs,
+                                        const(coal_emissions['0%'][gas]),
+                                        0, pre_ccs)
+                segs.append(gas_segs)
+            return segs
+
+        if ccs == '16%-90%':
+            to_90 = np.searchsorted(time, year_to_90CCS, side='left')
+            until_90 = np.searchsorted(time, year_to_90CCS, side='right')
+            segments = []
+            for gas, low, high in zip(gases, coal('16%'), coal('90%')):
+                gas_segs = _overlay(low, high, to_90, n)
+                gas_segs = _overlay(gas_segs, const(coal_emissions['16%'][gas]),
+                                    0, until_90)
+                segments.append(gas_segs)
+        else:
+            segments = coal(ccs)
+
+    else:
+        raise ValueError('fuel must be "NG" or "Coal", not {}'.format(fuel))
+
+    return segments
+
+
+def expand_segments(segments, n):
+    """
+    Build the dense emission array for piecewise-linear profiles from
+    *scenario_segments*.
 
-    # NGCC emissions - don't worry about delayed CCS yet
-    for l in leak.keys():
-        for ccs in ng_emissions.keys():
-            # Constant methane
-            df = pd.DataFrame(index=time,
-                              columns=['CO2', 'CH4', 'Leak', 'CCS', 'Fuel', 'Methane', 'Start year'])
-            df.loc[:,'Start year'] = CCS_start
-            df.loc[:,'Methane'] = 'Constant'
-            df.loc[:,'Fuel'] = 'NG'
-            df.loc[:,'CCS'] = ccs
-            df.loc[:,'Leak'] = l
-            df.loc[:,'CO2'] = ng_emissions[ccs]['Fixed']['CO2']
-            df.loc[:,'CH4'] = (ng_emissions[ccs]['Leak']['CH4']
-                               * leakage.loc[:,l].copy())
-
-            # This gets complicated when accounting for delayed CCS start
-            if CCS_start > 0:
-                df.loc[:CCS_start,'CO2'] = ng_emissions['0%']['Fixed']['CO2'] #*
-                                            #np.ones_like(leakage.loc[:CCS_start,l]))
-                df.loc[:CCS_start,'CH4'] = ng_emissions['0%']['Leak']['CH4'] * leakage.loc[:CCS_start,l].copy()
-            df.loc[life:,['CO2', 'CH4']] = 0
-            df_list.append(df)
-
-            # Reduced methane
-            df = pd.DataFrame(index=time,
-                              columns=['CO2', 'CH4', 'Leak', 'CCS', 'Fuel', 'Methane', 'Start year'])
-            df.loc[:,'Start year'] = CCS_start
-            df.loc[:,'Methane'] = 'Reduce'
-            df.loc[:,'Fuel'] = 'NG'
-            df.loc[:,'CCS'] = ccs
-            df.loc[:,'Leak'] = l
-            df.loc[:,'CO2'] = ng_emissions[ccs]['Fixed']['CO2']
-            df.loc[:,'CH4'] = ng_emissions[ccs]['Leak']['CH4'] * leakage_drop.loc[:,l].copy()
-
-            # This gets complicated when accounting for delayed CCS start
-            if CCS_start > 0:
-                df.loc[:CCS_start,'CO2'] = ng_emissions['0%']['Fixed']['CO2'] #*
-                                            #np.ones_like(leakage_drop.loc[:CCS_start,l]))
-                df.loc[:CCS_start,'CH4'] = ng_emissions['0%']['Leak']['CH4'] * leakage_drop.loc[:CCS_start,l].copy()
-            df.loc[life:,['CO2', 'CH4']] = 0
-            df_list.append(df)
-
-
-    # SCPC emissions
-    for ccs in coal_emissions.keys():
-        df = pd.DataFrame(index=time,
-                              columns=['CO2', 'CH4', 'Leak', 'CCS', 'Fuel', 'Methane', 'Start year'])
-        df.loc[:,'Start year'] = CCS_start
-        df.loc[:,'Methane'] = '-'
-        df.loc[:,'Fuel'] = 'Coal'
-        df.loc[:,'CCS'] = ccs
-        df.loc[:,'Leak'] = 'SCPC'
-        df.loc[:,'CO2'] = coal_emissions[ccs]['CO2']
-        df.loc[:,'CH4'] = coal_emissions[ccs]['CH4']
-        df.loc[life:,['CO2', 'CH4']] = 0
+    inputs:
+        segments: list
+            One profile per gas
+        n: int
+            Number of points in the time grid
+    outputs:
+        values: array
+            Emissions with shape (gas, time)
+    """
+    values = np.empty((len(segments), n))
+    for g, segs in enumerate(segments):
+        for k, (idx, level, slope) in enumerate(segs):
+            end = segs[k + 1][0] if k + 1 < len(segs) else n
+            values[g, idx:end] = level + slope * np.arange(end - idx)
 
-        if CCS_start > 0:
-            df.loc[:CCS_start,'CO2'] = coal_emissions['0%']['CO2']
-            df.loc[:CCS_start,'CH4'] = coal_emissions['0%']['CH4']
-        df_list.append(df)
+    return values
 
-    # Concat all dataframes
-    emissions_df = pd.concat(df_list)
 
-    # Add one more scenario for CCS that goes from 16% to 90%
-    # if year_to_90CCS > 0:# and CCS_start == 0:
-    df = emissions_df.loc[(emissions_df['Fuel'] == 'Coal') &
-                          (emissions_df['CCS'] == '16%'),:].copy()
-    df_90 = emissions_df.loc[(emissions_df['Fuel'] == 'Coal') &
-                             (emissions_df['CCS'] == '90%'),:].copy()
+class ScenarioSpec:
+    """
+    Compact description of one scenario of *emissions*: the plant, its
+    change points (CCS start, leakage drop, switch to 90% capture and end of
+    life) and the emission dictionaries that hold its rates. The dictionaries
+    are shared between specs, so a spec takes about 100 bytes whatever the
+    time step. Emissions are only built on a time grid when *segments* or
+    *expand* is called, and a list of specs can be passed to
+    *forcing.forcing_array* or *basis.BasisCache.forcing_array* in place of
+    an emissions array.
 
-    df.loc[year_to_90CCS:, ['CO2', 'CH4']] = (df_90.loc[year_to_90CCS:,
-                                                       ['CO2', 'CH4']])
+    inputs:
+        fuel: str
+            'NG' or 'Coal'
+        ccs: str
+            Key of *ng_emissions* or *coal_emissions*, or '16%-90%' for coal
+        methane: str
+            'Constant' or 'Reduce' for natural gas, '-' for coal
+        leak: float
+            Leakage rate, 1 = 1%. Only used for natural gas.
+        Other inputs are the same as *emissions*.
+    """
+    __slots__ = ('fuel', 'ccs', 'methane', 'leak', 'CCS_start',
+                 'leakage_drop_by', 'year_to_90CCS', 'life',
+                 'coal_emissions', 'ng_emissions')
+
+    def __init__(self, fuel, ccs, methane='Constant', leak=1.0, CCS_start=0,
+                 leakage_drop_by=10, year_to_90CCS=20, life=40,
+                 coal_emissions=coal_emissions, ng_emissions=ng_emissions):
+        if fuel not in ('NG', 'Coal'):
+            raise ValueError('fuel must be "NG" or "Coal", not {}'.format(fuel))
+        self.fuel = fuel
+        self.ccs = ccs
+        self.methane = methane if fuel == 'NG' else '-'
+        self.leak = float(leak) if fuel == 'NG' else 0.0
+        self.CCS_start = CCS_start
+        self.leakage_drop_by = leakage_drop_by
+        self.year_to_90CCS = year_to_90CCS
+        self.life = life
+        self.coal_emissions = coal_emissions
+        self.ng_emissions = ng_emissions
+
+    def __repr__(self):
+        return 'ScenarioSpec({})'.format(', '.join(
+            '{}={!r}'.format(name, getattr(self, name))
+            for name in self.__slots__[:-2]))
+
+    @property
+    def key(self):
+        'Values of *key_cols* for this scenario, as in *emissions_array*'
+        if self.fuel == 'NG':
+            leak = list(leak_keys([self.leak]).keys())[0]
+        else:
+            leak = 'SCPC'
+
+        return leak, self.ccs, self.fuel, self.methane, self.CCS_start
+
+    def segments(self, time):
+        'Piecewise-linear profiles on a time grid (see *scenario_segments*)'
+        return scenario_segments(self.fuel, self.ccs, time,
+                                 methane=self.methane, leak=self.leak,
+                                 coal_emissions=self.coal_emissions,
+                                 ng_emissions=self.ng_emissions,
+                                 CCS_start=self.CCS_start,
+                                 leakage_drop_by=self.leakage_drop_by,
+                                 year_to_90CCS=self.year_to_90CCS,
+                                 life=self.life)
+
+    def expand(self, time):
+        'Dense emissions with shape (gas, time)'
+        return expand_segments(self.segments(time), time.size)
+
+
+def spec_keys(specs):
+    """
+    Scenario key table for a list of *ScenarioSpec*
+
+    outputs:
+        keys: dataframe
+            One row per spec with the columns in *key_cols*
+    """
+    return pd.DataFrame([spec.key for spec in specs], columns=key_cols)
+
+
+def expand_specs(specs, time):
+    """
+    Dense emissions for a list of *ScenarioSpec*
+
+    outputs:
+        values: array
+            Emissions with shape (scenario, gas, time)
+    """
+    values = np.empty((len(specs), len(gases), time.size))
+    for i, spec in enumerate(specs):
+        values[i] = spec.expand(time)
+
+    return values
 
-    df.loc[:year_to_90CCS, 'CO2'] = coal_emissions['16%']['CO2']
-    df.loc[:year_to_90CCS, 'CH4'] = coal_emissions['16%']['CH4']
 
-    df.loc[:,'CCS'] = '16%-90%'
+def emissions_specs(coal_emissions=coal_emissions, ng_emissions=ng_emissions,
+                    CCS_start=0, leakage_drop_by=10,
+                    leak_values=range(1,6), year_to_90CCS=20, life=40):
+    """
+    *ScenarioSpec* for every scenario of *emissions_array*, in the same
+    order. No time grid is needed.
 
-    # Concat the extra dataframe
-    emissions_df = pd.concat([emissions_df, df])
-        # df_list.append(df)
+    outputs:
+        specs: list
+    """
+    kwargs = dict(coal_emissions=coal_emissions, ng_emissions=ng_emissions,
+                  CCS_start=CCS_start, leakage_drop_by=leakage_drop_by,
+                  year_to_90CCS=year_to_90CCS, life=life)
+
+    specs = []
+    for value in leak_keys(leak_values).values():
+        for ccs in ng_emissions.keys():
+            for methane in ['Constant', 'Reduce']:
+                specs.append(ScenarioSpec('NG', ccs, methane, value,
+                                          **kwargs))
 
-    # Set values in the Time column and reset index in both the large dataframe
-    # and each of the individual dataframes
-    emissions_df.loc[:,'Time'] = emissions_df.index
-    emissions_df.reset_index(drop=True, inplace=True)
+    for ccs in list(coal_emissions.keys()) + ['16%-90%']:
+        specs.append(ScenarioSpec('Coal', ccs, **kwargs))
 
-    # Force numeric data types for emissions and start year
-    for col in ['CO2', 'CH4', 'Start year']:
-        emissions_df[col] = pd.to_numeric(emissions_df[col])
+    return specs
 
-    # for df in df_list:
-    #     df.loc[:,'Time'] = df.index
-    #     df.reset_index(drop=True, inplace=True)
 
-    return emissions_df#, df_list
+def emissions_segments(coal_emissions=coal_emissions, ng_emissions=ng_emissions,
+                       CCS_start=0, leakage_drop_by=10,
+                       leak_values=range(1,6), year_to_90CCS=20, life=40,
+                       end=100, tstep=0.01):
+    """
+    Change-point version of *emissions_array*. Every scenario is described by
+    *scenario_segments* instead of a dense array, so the cost does not depend
+    on the time step. Inputs are the same as *emissions*.
+
+    outputs:
+        keys: dataframe
+            One row per scenario with the columns in *key_cols*, in the same
+            order as *emissions_array*
+        segments: list
+            Output of *scenario_segments* for each scenario
+        time: array
+            Time grid that the segment indices refer to
+    """
+    time = time_grid(end, tstep)
+    specs = emissions_specs(coal_emissions=coal_emissions,
+                            ng_emissions=ng_emissions, CCS_start=CCS_start,
+                            leakage_drop_by=leakage_drop_by,
+                            leak_values=leak_values,
+                            year_to_90CCS=year_to_90CCS, life=life)
+
+    return spec_keys(specs), [spec.segments(time) for spec in specs], time
@@ -0,0 +1,103 @@
+import numpy as np
+
+import profiling
+
+
+class FigureData:
+    """
+    Data preparation for the heatmap figures in *heatmap.Main_figure*,
+    with no plotting dependencies.
+    """
+    @profiling.timed('figure_data')
+    def figure_data(self, df, scenarios, leak_rates=range(1,6), kind='RF',
+                    delay_years=[0,20]):
+        """
+        Calculate the difference between coal and natural gas (coal - NG) for
+        every scenario, delay year, leak rate and year. Each scenario in *df*
+        is found once through a lookup table of key columns, and the results
+        are stored in *self.diffs* with shape (scenario, delay, leak, year).
+
+        inputs:
+            df: dataframe
+                Tidy forcing results with the columns 'Fuel', 'CCS',
+                'Methane', 'Leak', 'Start year', 'Time' and *kind*
+            scenarios: dict
+                'Coal CCS', 'Gas CCS' and 'Methane' for each figure facet
+            leak_rates: list
+                Values of natural gas leakage rates to include
+            kind: str
+                RF or CRF
+            delay_years: list
+                Values of CCS start year to include
+        """
+        self.kind=kind #Use for selecting colorbar units label
+        self.scenarios=scenarios
+        self.leak_values = ['NGCC ' + str(x) + '%' for x in leak_rates]
+        self.data_delay_years = list(delay_years)
+
+        # One row of values per scenario, with years along the columns
+        cols = ['Fuel', 'CCS', 'Methane', 'Leak', 'Start year']
+        df = df.sort_values(cols + ['Time'])
+        years = np.unique(df['Time'].values)
+        if (len(df) % years.size != 0 or not
+                (df['Time'].values.reshape(-1, years.size) == years).all()):
+            raise ValueError('Every scenario must cover the same years')
+        values = df[kind].values.reshape(-1, years.size)
+        keys = df[cols].iloc[::years.size]
+
+        coal_rows = {}
+        ng_rows = {}
+        for row, (fuel, ccs, methane, leak, start) in enumerate(
+                keys.itertuples(index=False)):
+            if fuel == 'Coal':
+                coal_rows[(ccs, start)] = row
+            else:
+                ng_rows[(ccs, methane, leak, start)] = row
+
+        coal_idx = np.empty((len(scenarios), len(delay_years), 1), dtype=int)
+        ng_idx = np.empty((len(scenarios), len(delay_years), len(leak_rates)),
+                          dtype=int)
+        for s, key in enumerate(scenarios):
+            scenario = scenarios[key]
+            for j, start in enumerate(delay_years):
+                coal_idx[s, j] = coal_rows[(scenario['Coal CCS'], start)]
+                for k, leak in enumerate(self.leak_values):
+                    ng_idx[s, j, k] = ng_rows[(scenario['Gas CCS'],
+                                               scenario['Methane'],
+                                               leak, start)]
+
+        self.years = years
+        self.scenario_index = {key: s for s, key in enumerate(scenarios)}
+        self.diffs = values[coal_idx] - values[ng_idx]
+
+    def find_max_abs(self, data, leak_rates=range(1,6), data_column='Difference'):
+        """"
+        Returns the maximum absolute value from the dataframe.
+        Used to scale the colorbar.
+
+        -----
+        data: dataframe input
+        leak_rates: string or list of values that are expected in the 'leak' column of
+                    the dataframe
+        data_column: string or list of dataframe column to find the abs max of
+        """
+        leak_values = ['NGCC ' + str(x) + '%' for x in leak_rates]
+
+
+        filtered_data = data.loc[data['Leak'].isin(leak_values), data_column].copy()
+
+        max_value = filtered_data.values.max()
+        min_value = filtered_data.values.min()
+        self.abs_max = max(max_value, abs(min_value))
+
+        return self.abs_max
+
+    @profiling.timed('set_cbar_scale')
+    def set_cbar_scale(self, leak_rates=range(1,6)):
+        'Set the cbar scale with one set of data. Can apply to a second set'
+        leak_values = ['NGCC ' + str(x) + '%' for x in leak_rates]
+        leaks = [k for k, leak in enumerate(self.leak_values)
+                 if leak in leak_values]
+
+        self.abs_max = np.abs(self.diffs[:, :, leaks, :]).max()
+        self.cbar_scale = self.abs_max
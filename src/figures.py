@@ -0,0 +1,635 @@
+"""
+Registry of the figures in Figures/ and a runner that rebuilds them in a
+process pool. The builders are the plotting cells of the notebooks in
+Notebooks/ ('Forcing Calculations' and 'Emissions'), and each figure
+declares the slice of scenario data that it reads. The runner calculates
+those slices, hashes them together with the builder code, the modules it
+depends on and its parameters, and only renders figures whose hash changed
+since the last build (stored in a manifest next to the figures).
+
+    python figures.py --out ../Figures
+    python figures.py --out ../Figures --force "RF no CCS.pdf"
+"""
+import argparse
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import inspect
+import json
+import os
+
+import pandas as pd
+import numpy as np
+
+from cache import stable_hash
+from emissions import (coal_emissions, ng_emissions, emissions_array,
+                       tidy_emissions)
+import figure_data
+from forcing import CH4_RE, forcing_array, forcing_frame, tidy_to_array
+import heatmap
+import profiling
+import uncertainty
+from uncertainty import emission_differences, monte_carlo
+
+
+manifest_name = '.figures.json'
+
+# Facets of the main paper heatmaps. '_90%' is SCPC with CCS from year 0,
+# compared with NGCC at each CCS start year.
+paper_scenarios = OrderedDict([
+    ('a', {'Coal CCS': '90%', 'Gas CCS': '90%', 'Methane': 'Constant'}),
+    ('b', {'Coal CCS': '90%', 'Gas CCS': '0%', 'Methane': 'Constant'}),
+    ('c', {'Coal CCS': '_90%', 'Gas CCS': '90%', 'Methane': 'Constant'}),
+    ('d', {'Coal CCS': '90%', 'Gas CCS': '90%', 'Methane': 'Reduce'}),
+    ('e', {'Coal CCS': '90%', 'Gas CCS': '0%', 'Methane': 'Reduce'}),
+    ('f', {'Coal CCS': '_90%', 'Gas CCS': '90%', 'Methane': 'Reduce'})])
+
+# Layout of the main paper heatmaps, passed to *heatmap.plot_heatmap*
+paper_heatmap_kwargs = dict(
+    font_scale=1, group_spacing=0.15, cols=3, figsize=[7.2, 3.6],
+    cbar_pad=0.08, cbar=True,
+    label_dict=dict(x=0.0, y=1.02, ha='left', size=8, weight='bold'),
+    year_label_dict=dict(size=8, y=-0.25, horizontalalignment='center'),
+    xtick_label_dict=dict(labelsize=6, length=4, width=1),
+    alt_titles=dict(a='90% CCS Coal,\n90% CCS on Gas',
+                    b='90% CCS Coal,\nNo CCS on Gas',
+                    c='90% CCS Coal (Year 0),\nDelayed CCS on Gas'),
+    year_label_loc=[0.18, 0.49, 0.82],
+    arrowprops=dict(headwidth=2.5, headlength=3.5, width=0.001),
+    cbar_arrow_x=1.5)
+
+# Figure file name -> entry with the builder, the data it reads and the
+# builder parameters
+registry = OrderedDict()
+
+
+def register(filename, builder, data='forcing', kind='RF', start_years=(0,),
+             select=None, year_to_90CCS=None, depends=(), **params):
+    """
+    Add a figure to *registry*.
+
+    inputs:
+        filename: str
+            File name in the output directory
+        builder: function
+            Module-level function called as builder(df, path, **params)
+        data: str
+            'forcing' (annual forcing from *forcing.forcing_frame*) or
+            'emissions' (tidy emissions from *emissions.tidy_emissions*)
+        kind: str or list
+            RF and/or CRF, for forcing data. With a list, the data has the
+            columns of every kind.
+        start_years: list
+            CCS start years to calculate
+        select: dict or None
+            Key column values (or lists of values) to keep
+        year_to_90CCS: int or None
+            Year that coal CCS goes from 16% to 90% capture. If None, use
+            each CCS start year (as in the Forcing Calculations notebook).
+        depends: list
+            Modules and functions, other than *builder*, whose code changes
+            the figure. Their source is part of the figure hash.
+        params: keyword arguments
+            Passed to *builder*, along with *kind* for forcing data
+    """
+    if not isinstance(kind, str):
+        kind = list(kind)
+    if data == 'forcing':
+        params['kind'] = kind
+    registry[filename] = {'builder': builder,
+                          'data': data,
+                          'kind': kind,
+                          'start_years': list(start_years),
+                          'select': select or {},
+                          'year_to_90CCS': year_to_90CCS,
+                          'depends': list(depends),
+                          'params': params}
+
+
+def _select(df, select):
+    mask = np.ones(len(df), dtype=bool)
+    for col, value in select.items():
+        values = value if isinstance(value, (list, tuple)) else [value]
+        mask &= df[col].isin(values).values
+
+    return df.loc[mask].reset_index(drop=True)
+
+
+class _Inputs:
+    """
+    Scenario data for the registry entries of one build. Forcing and
+    emissions for each CCS start year are calculated once and shared by
+    every figure that reads them.
+    """
+    def __init__(self, coal_emissions, ng_emissions, leak_values, end, tstep,
+                 CH4_RE):
+        self.kwargs = dict(coal_emissions=coal_emissions,
+                           ng_emissions=ng_emissions, leak_values=leak_values,
+                           end=end, tstep=tstep)
+        self.CH4_RE = CH4_RE
+        self._arrays = {}
+        self._frames = {}
+
+    def _array(self, start, year_to_90CCS):
+        key = (start, year_to_90CCS)
+        if key not in self._arrays:
+            self._arrays[key] = emissions_array(
+                CCS_start=start,
+                year_to_90CCS=start if year_to_90CCS is None else year_to_90CCS,
+                **self.kwargs)
+        return self._arrays[key]
+
+    def _frame(self, data, kind, start, year_to_90CCS):
+        key = (data, None if data == 'emissions' else kind, start,
+               year_to_90CCS)
+        if key not in self._frames:
+            keys, values, time = self._array(start, year_to_90CCS)
+            if data == 'emissions':
+                df = tidy_emissions(keys, values, time)
+            else:
+                forcing, years = forcing_array(values, time, kind=kind,
+                                               CH4_RE=self.CH4_RE)
+                df = forcing_frame(keys, forcing, years,
+                                   kind=kind).reset_index()
+            self._frames[key] = df
+        return self._frames[key]
+
+    def get(self, entry):
+        'Data slice of a registry entry'
+        kinds = entry['kind'] if isinstance(entry['kind'], list) \
+            else [entry['kind']]
+        frames = []
+        for start in entry['start_years']:
+            df = self._frame(entry['data'], kinds[0], start,
+                             entry['year_to_90CCS'])
+            if entry['data'] == 'forcing' and len(kinds) > 1:
+                # Frames of each kind have the same rows in the same order
+                df = df.copy()
+                for kind in kinds[1:]:
+                    other = self._frame('forcing', kind, start,
+                                        entry['year_to_90CCS'])
+                    for col in other.columns:
+                        if col not in df.columns:
+                            df[col] = other[col].values
+            frames.append(df)
+
+        return _select(pd.concat(frames, ignore_index=True), entry['select'])
+
+
+def figure_hash(entry, df):
+    """
+    Hash of everything that a figure depends on: its data slice, the source
+    code of the builder and of everything in the entry's *depends*, and the
+    builder parameters.
+    """
+    data_hash = pd.util.hash_pandas_object(df, index=False).values
+    sources = [inspect.getsource(entry['builder'])]
+    sources += [inspect.getsource(dep) for dep in entry['depends']]
+
+    return stable_hash(sources, entry['builder'].__name__, entry['params'],
+                       entry['kind'], list(df.columns), data_hash)
+
+
+def _render(builder, df, path, params):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    builder(df, path, **params)
+    plt.close('all')
+
+    return path
+
+
+def build_figures(out_dir, names=None, processes=None, force=False,
+                  coal_emissions=coal_emissions, ng_emissions=ng_emissions,
+                  leak_values=range(1,11), end=100, tstep=0.01,
+                  CH4_RE=CH4_RE):
+    """
+    Render the registered figures whose inputs changed since the last build.
+
+    inputs:
+        out_dir: str
+            Directory for the figures and the manifest of figure hashes
+        names: list or None
+            File names in *registry* to consider. All figures if None.
+        processes: int or None
+            Number of worker processes. None uses all CPUs and 1 renders
+            everything in the current process.
+        force: bool
+            If True, render every figure in *names*
+        coal_emissions, ng_emissions: dict
+            Emission values, e.g. from *emissions.emission_factors*
+        leak_values: list
+            Leakage rates to calculate
+        end: int
+            Number of years to calculate
+        tstep: float
+            Time step of the calculation grid
+        CH4_RE: float
+            Radiative efficiency of methane
+    outputs:
+        status: dict
+            'built' or 'unchanged' for each figure
+    """
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if names is None:
+        names = list(registry)
+    unknown = set(names) - set(registry)
+    if unknown:
+        raise KeyError('Unknown figures: {}'.format(sorted(unknown)))
+
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    manifest_path = os.path.join(out_dir, manifest_name)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    inputs = _Inputs(coal_emissions, ng_emissions, leak_values, end, tstep,
+                     CH4_RE)
+    status = OrderedDict()
+    tasks = []
+    hashes = {}
+    with profiling.span('figures.inputs'):
+        for name in names:
+            entry = registry[name]
+            df = inputs.get(entry)
+            hashes[name] = figure_hash(entry, df)
+            path = os.path.join(out_dir, name)
+            if (force or manifest.get(name) != hashes[name]
+                    or not os.path.exists(path)):
+                tasks.append((name, (entry['builder'], df, path,
+                                     entry['params'])))
+            else:
+                status[name] = 'unchanged'
+
+    # Figures that were rendered are kept in the manifest even if a later
+    # one fails
+    def done(name):
+        status[name] = 'built'
+        manifest[name] = hashes[name]
+
+    try:
+        with profiling.span('figures.render', figures=len(tasks)):
+            if processes == 1 or len(tasks) <= 1:
+                for name, task in tasks:
+                    _render(*task)
+                    done(name)
+            else:
+                with ProcessPoolExecutor(max_workers=processes) as executor:
+                    futures = [(name, executor.submit(_render, *task))
+                               for name, task in tasks]
+                    for name, future in futures:
+                        future.result()
+                        done(name)
+    finally:
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+
+    return OrderedDict((name, status[name]) for name in names)
+
+
+def _axes_style():
+    'Seaborn style of the notebook figures'
+    return {'axes.linewidth': 1.5, 'axes.grid': True}
+
+
+def _forcing_label(kind):
+    if kind == 'RF':
+        return r'Forcing ($W \ m^{-2}$)'
+    return r'Cumulative Forcing ($W \ m^{-2} \ y$)'
+
+
+def _sci_ticks(ax):
+    'Scientific notation on the y-axis with small tick labels'
+    ax.ticklabel_format(style='sci', scilimits=(0,0), axis='y')
+    ax.tick_params(axis='both', which='both', labelsize=7)
+    ax.yaxis.offsetText.set_fontsize(7)
+
+
+def _both_methane(df):
+    "Coal rows repeated for the 'Constant' and 'Reduce' methane facets"
+    return pd.concat([df.replace({'Methane': {'-': methane}})
+                      for methane in ['Reduce', 'Constant']],
+                     ignore_index=True)
+
+
+def _scenario(df, kind, fuel, leak, methane, ccs, start):
+    'Years and values of one scenario'
+    row = ((df['Fuel'] == fuel) & (df['Leak'] == leak)
+           & (df['Methane'] == methane) & (df['CCS'] == ccs)
+           & (df['Start year'] == start))
+    scenario = df.loc[row].sort_values('Time')
+
+    return scenario['Time'].values, scenario[kind].values
+
+
+def plot_paper_heatmap(df, path, kind='RF', delay_years=(0, 10, 20),
+                       scenario_keys=paper_scenarios, raster=True, **kwargs):
+    """
+    Main paper heatmap of SCPC - NGCC forcing (see *heatmap.Main_figure*).
+    Coal CCS '_90%' is SCPC with CCS from year 0 at every delay year.
+    """
+    import matplotlib.pyplot as plt
+    from heatmap import Main_figure
+
+    coal = df.loc[(df['Fuel'] == 'Coal') & (df['CCS'] == '90%')
+                  & (df['Start year'] == 0)]
+    year_0 = pd.concat([coal.assign(**{'Start year': start})
+                        for start in delay_years], ignore_index=True)
+    year_0['CCS'] = '_90%'
+    df = pd.concat([df, year_0], ignore_index=True)
+
+    fig = Main_figure()
+    fig.figure_data(df, scenario_keys, delay_years=list(delay_years),
+                    kind=kind)
+    fig.set_cbar_scale()
+    fig.set_color_values()
+    fig.plot_heatmap(delay_years=list(delay_years),
+                     scenario_keys=scenario_keys, raster=raster, **kwargs)
+    plt.savefig(path, bbox_inches='tight')
+
+
+def plot_curves(df, path, kind='RF', leak_rates=range(1, 6)):
+    """
+    Forcing of SCPC with CCS and of NGCC with and without CCS, with a row of
+    facets for each CCS start year and a column for each methane path.
+    """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    leaks = ['NGCC {}%'.format(x) for x in leak_rates]
+    coal = df.loc[(df['Fuel'] == 'Coal') & (df['CCS'] == '90%')]
+    coal = _both_methane(coal.replace({'Leak': {'SCPC': 'SCPC with CCS'}}))
+    ng = df.loc[(df['Fuel'] == 'NG') & df['Leak'].isin(leaks)].copy()
+    ng['Leak'] = ng['Leak'] + np.where(ng['CCS'] == '90%', ' with CCS',
+                                       ' no CCS')
+    data = pd.concat([coal, ng], ignore_index=True)
+
+    colors = (sns.cubehelix_palette(1, start=0.4, rot=-.5, light=0.4,
+                                    dark=0.25, hue=1, reverse=True)
+              + sns.cubehelix_palette(len(leaks), start=0.2, hue=1,
+                                      light=0.85, dark=0.35) * 2)
+    hue_order = (['SCPC with CCS']
+                 + ['{} with CCS'.format(x) for x in leaks]
+                 + ['{} no CCS'.format(x) for x in leaks])
+    markers = ['--'] + ['-'] * len(leaks) + [':'] * len(leaks)
+    col_order = ['Constant', 'Reduce']
+
+    with sns.axes_style('white', _axes_style()):
+        g = sns.FacetGrid(data.loc[data['Leak'].isin(hue_order)],
+                          row='Start year', col='Methane',
+                          col_order=col_order, hue='Leak',
+                          hue_kws=dict(ls=markers), hue_order=hue_order,
+                          palette=colors, size=2, aspect=1.4)
+        g.map(plt.plot, 'Time', kind).add_legend(title='', fontsize=8)
+        g.set_ylabels(_forcing_label(kind), size=8)
+        g.set_xlabels('Year', size=8)
+        g.set(ylim=(0, None), xlim=(0, None))
+
+        # Clear previous titles and set the y-axis to scientific notation
+        for ax in g.axes.flat:
+            plt.setp(ax.texts, text='')
+            _sci_ticks(ax)
+
+        # Figure labels are added separately so they don't get cleared
+        for ax, label in zip(g.axes.flat, 'abcdefghijkl'):
+            ax.text(.95, 1.01, label, fontsize=8, weight='bold',
+                    transform=ax.transAxes, ha='right')
+        for ax, methane in zip(g.axes[0], col_order):
+            ax.text(0.5, 1.15, '{} Methane'.format(methane), ha='center',
+                    transform=ax.transAxes, size=8)
+
+        g.set_titles(template='CCS Year {row_name}', size=6)
+        plt.savefig(path, bbox_inches='tight')
+
+
+def plot_no_ccs(df, path, kind='RF', leak_rates=(2, 3, 7, 10), labels='ab',
+                xlabel='Year', xticklabels=True):
+    """
+    Forcing of SCPC without CCS and of NGCC with CCS at selected leakage
+    rates, with a facet for each methane path.
+    """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    coal = _both_methane(df.loc[(df['Fuel'] == 'Coal')
+                                & (df['CCS'] == '0%')])
+    ng = df.loc[(df['Fuel'] == 'NG') & (df['CCS'] == '90%')]
+    data = pd.concat([coal, ng], ignore_index=True)
+
+    colors = (sns.cubehelix_palette(1, start=0.4, rot=-.5, light=0.4,
+                                    dark=0.25, hue=1, reverse=True)
+              + sns.cubehelix_palette(len(leak_rates), start=0.2, hue=1,
+                                      light=0.8, dark=0.45))
+    hue_order = ['SCPC'] + ['NGCC {}%'.format(x) for x in leak_rates]
+    ls = {'ls': ['--'] + ['-'] * len(leak_rates)}
+
+    with sns.axes_style('white', _axes_style()):
+        g = sns.FacetGrid(data.loc[data['Leak'].isin(hue_order)],
+                          col='Methane', col_order=['Constant', 'Reduce'],
+                          hue='Leak', hue_order=hue_order, palette=colors,
+                          size=2, aspect=1.4, hue_kws=ls)
+        g.map(plt.plot, 'Time', kind).add_legend(title='', fontsize=8)
+        g.set_ylabels(_forcing_label(kind), size=8)
+        g.set_xlabels(xlabel, size=8)
+        g.set(ylim=(0, None), xlim=(0, None))
+
+        for ax in g.axes.flat:
+            plt.setp(ax.texts, text='')
+            _sci_ticks(ax)
+            if not xticklabels:
+                ax.xaxis.set_ticklabels([])
+
+        for ax, label in zip(g.axes.flat, labels):
+            plt.text(0.94, 1.02, label, fontsize=8, weight='bold',
+                     transform=ax.transAxes)
+
+        g.set_titles(template='{col_name} Methane', size=8)
+        plt.savefig(path, bbox_inches='tight')
+
+
+# Forcing savings: (legend label, scenario, scenario it is compared to)
+# with scenarios as (Fuel, Leak, Methane, CCS, Start year)
+savings = [('Reduce Methane (2%)', ('NG', 'NGCC 2%', 'Reduce', '0%', 20),
+            ('NG', 'NGCC 2%', 'Constant', '0%', 20)),
+           ('Reduce Methane (3%)', ('NG', 'NGCC 3%', 'Reduce', '0%', 20),
+            ('NG', 'NGCC 3%', 'Constant', '0%', 20)),
+           ('NGCC CCS Year 20 to 0', ('NG', 'NGCC 2%', 'Constant', '90%', 0),
+            ('NG', 'NGCC 2%', 'Constant', '90%', 20)),
+           ('SCPC CCS Year 10 to 0', ('Coal', 'SCPC', '-', '90%', 0),
+            ('Coal', 'SCPC', '-', '90%', 10))]
+
+
+def plot_savings(df, path, kind=('RF', 'CRF'), comparisons=savings):
+    """
+    Change in forcing from reducing methane and from starting CCS earlier,
+    with a panel for each kind.
+    """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    with sns.axes_style('white', _axes_style()):
+        fig, axs = plt.subplots(1, len(kind), figsize=(7, 2.7))
+        for ax, _kind in zip(axs, kind):
+            for label, scenario, base in comparisons:
+                years, values = _scenario(df, _kind, *scenario)
+                ax.plot(years, values - _scenario(df, _kind, *base)[1])
+            ax.set_ylabel(_forcing_label(_kind), size=8)
+            ax.set_xlabel('Year', size=8)
+        sns.despine()
+
+        for ax, label in zip(axs, 'ab'):
+            _sci_ticks(ax)
+            plt.text(0.9, 1, label, fontsize=8, weight='bold',
+                     transform=ax.transAxes)
+
+        plt.tight_layout()
+        axs[0].legend([c[0] for c in comparisons], framealpha=1,
+                      frameon=True, fontsize=8, ncol=4, loc='upper left',
+                      bbox_to_anchor=(-0.15, -0.15))
+        plt.savefig(path, bbox_inches='tight')
+
+
+def plot_uncertainty(df, path, kind='RF', coal_ccs='16%', gas_ccs='0%',
+                     methane='Constant', leak_rates=(1, 2, 3, 4, 5, 7, 9),
+                     n_runs=1000):
+    """
+    SCPC - NGCC forcing for each leakage rate with +/- 1 sigma Monte Carlo
+    uncertainty (sum of the CO2 and CH4 sigmas, as in the notebook).
+    """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    keys, values, time = tidy_to_array(df)
+    leaks = ['NGCC {}%'.format(x) for x in leak_rates]
+    diff_keys, diffs = emission_differences(
+        keys, values, {'Fuel': 'Coal', 'CCS': coal_ccs},
+        {'Fuel': 'NG', 'CCS': gas_ccs, 'Methane': methane})
+    stats, years = monte_carlo(diffs, time, kind=kind, n_runs=n_runs)
+    total = stats['mean'][:, 2]
+    upper = (stats['mean'][:, :2] + stats['sigma'][:, :2]).sum(axis=1)
+    lower = (stats['mean'][:, :2] - stats['sigma'][:, :2]).sum(axis=1)
+
+    colors = sns.color_palette('GnBu_d', len(leaks))
+    with sns.axes_style('whitegrid'):
+        fig, ax = plt.subplots()
+        for i, leak in enumerate(leaks):
+            row = np.flatnonzero(diff_keys['Leak'].values == leak)[0]
+            plt.plot(years, total[row], label=leak, c=colors[i])
+            plt.fill_between(years, upper[row], lower[row], color=colors[i],
+                             alpha=0.3)
+        handles, labels = ax.get_legend_handles_labels()
+        ax.legend(handles[::-1], labels[::-1], loc=0)
+        ax.ticklabel_format(style='sci', axis='y')
+        plt.ylabel(_forcing_label(kind))
+        plt.xlabel('Year')
+        plt.xlim(0, None)
+        plt.savefig(path, bbox_inches='tight')
+
+
+def _emissions_label(gas):
+    return 'kg {}/MWh'.format({'CO2': 'CO$_2$', 'CH4': 'CH$_4$'}[gas])
+
+
+def plot_scpc_emissions(df, path, gas='CO2', legend_title=None):
+    'SCPC emissions of one gas for each CCS case, faceted by start year'
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    with sns.axes_style('white', _axes_style()):
+        g = sns.FacetGrid(df.loc[df['Fuel'] == 'Coal'], hue='CCS',
+                          col='Start year',
+                          hue_order=['0%', '16%', '90%', '16%-90%'],
+                          col_wrap=2)
+        g.map(plt.plot, 'Time', gas)
+        g.add_legend(title=legend_title)
+        g.set_ylabels(_emissions_label(gas))
+        g.set_xlabels('Year')
+        plt.savefig(path)
+
+
+def plot_ngcc_emissions(df, path, gas='CO2', leak_rates=range(1, 11)):
+    'NGCC emissions of one gas for each leakage rate, CCS case and methane path'
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    leaks = ['NGCC {}%'.format(x) for x in leak_rates]
+    with sns.axes_style('white', _axes_style()):
+        g = sns.FacetGrid(df.loc[df['Fuel'] == 'NG'], row='CCS',
+                          col='Methane', hue='Leak',
+                          palette=sns.cubehelix_palette(len(leaks), 0.2,
+                                                        hue=1),
+                          hue_order=leaks)
+        g.map(plt.plot, 'Time', gas)
+        g.set_ylabels(_emissions_label(gas))
+        g.set_xlabels('Year')
+        g.add_legend()
+        plt.savefig(path)
+
+
+_curve_helpers = [_axes_style, _forcing_label, _sci_ticks, _both_methane]
+
+for _kind in ['RF', 'CRF']:
+    register('Main paper {} fig 020818.pdf'.format(_kind), plot_paper_heatmap,
+             kind=_kind, start_years=[0, 10, 20],
+             depends=[heatmap, figure_data], **paper_heatmap_kwargs)
+    register('{} curves.pdf'.format(_kind), plot_curves, kind=_kind,
+             start_years=[0, 10, 20], select={'CCS': ['0%', '90%']},
+             depends=_curve_helpers)
+    register('{} no CCS.pdf'.format(_kind), plot_no_ccs, kind=_kind,
+             start_years=[40], select={'CCS': ['0%', '90%']},
+             depends=_curve_helpers,
+             **(dict(labels='ab', xlabel='', xticklabels=False)
+                if _kind == 'RF' else dict(labels='cd')))
+
+register('RF CRF savings test.pdf', plot_savings, kind=['RF', 'CRF'],
+         start_years=[0, 10, 20],
+         select={'Leak': ['NGCC 2%', 'NGCC 3%', 'SCPC']},
+         depends=[_axes_style, _forcing_label, _sci_ticks, _scenario])
+
+for _name, _coal, _gas in [('111b', '16%', '0%'), ('both CCS', '90%', '90%')]:
+    register('Test uncertainty - {}.pdf'.format(_name), plot_uncertainty,
+             data='emissions', select={'Fuel': ['Coal', 'NG'],
+                                       'CCS': sorted({_coal, _gas})},
+             depends=[uncertainty, _forcing_label], coal_ccs=_coal,
+             gas_ccs=_gas)
+
+for _gas in ['CO2', 'CH4']:
+    register('SCPC {} emissions.pdf'.format(_gas), plot_scpc_emissions,
+             data='emissions', start_years=[0, 10, 20, 30], year_to_90CCS=20,
+             select={'Fuel': 'Coal'}, depends=[_axes_style, _emissions_label],
+             gas=_gas, legend_title='CCS rate' if _gas == 'CO2' else None)
+    for _name, _start in [('start', 0), ('delay', 20)]:
+        register('NGCC {} {} emissions.pdf'.format(_name, _gas),
+                 plot_ngcc_emissions, data='emissions', start_years=[_start],
+                 select={'Fuel': 'NG'},
+                 depends=[_axes_style, _emissions_label], gas=_gas)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--out', default=os.path.join('..', 'Figures'))
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--force', action='store_true',
+                        help='Render every figure, even if it is unchanged')
+    parser.add_argument('--list', action='store_true',
+                        help='List the registered figures')
+    parser.add_argument('names', nargs='*', default=None)
+    args = parser.parse_args(args)
+
+    if args.list:
+        for name in registry:
+            print(name)
+        return
+
+    status = build_figures(args.out, names=args.names or None,
+                           processes=args.processes, force=args.force)
+    for name, state in status.items():
+        print('{:<10} {}'.format(state, name))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+import pandas as pd
+import numpy as np
+
+from breakeven import leak_response
+from emissions import generation, hours
+from forcing import CH4_RE
+
+
+# Columns of a fleet table and the values used when a column is missing
+fleet_defaults = {'Methane': 'Constant',
+                  'CCS start': 0,
+                  'Build year': 0,
+                  'Size': 1000,
+                  'Capacity factor': 0.8,
+                  'Leak': 0.0}
+fleet_cols = ['Fuel', 'CCS', 'Methane', 'CCS start', 'Build year', 'Size',
+              'Capacity factor', 'Leak']
+
+# Plants with the same values of these columns share one response
+archetype_cols = ['Fuel', 'CCS', 'Methane', 'CCS start']
+
+
+def _shifted_sum(schedule, response):
+    """
+    Sum of copies of *response* that start in each year, weighted by
+    *schedule*. Output is truncated to the length of *response*.
+
+    inputs:
+        schedule: array
+            Weight for each build year, shape (year,)
+        response: array
+            Shape (gas, year)
+    outputs:
+        total: array
+            Shape (gas, year)
+    """
+    n = response.shape[-1]
+
+    return np.stack([np.convolve(schedule, r)[:n] for r in response])
+
+
+def archetype_responses(fleet, kind='RF', end=100, CH4_RE=CH4_RE, **kwargs):
+    """
+    Forcing from each gas for one 1000 MW plant at 80% capacity factor (the
+    module *generation*) that is built in year 0, for every archetype in a
+    fleet. NGCC forcing is intercept + slope * leak (see
+    *breakeven.leak_response*), so each archetype has an intercept and a
+    slope. For SCPC the slope is zero.
+
+    inputs:
+        fleet: dataframe
+            Fleet table with at least the columns in *archetype_cols*
+        kind: str
+            RF or CRF
+        end: int
+            Number of years to calculate
+        CH4_RE: float
+            Radiative efficiency of methane
+        Other keyword arguments are passed to *emissions.emissions_array*
+    outputs:
+        responses: dict
+            (intercept, slope) arrays with shape (gas, year) for each
+            archetype tuple
+        years: array
+    """
+    responses = {}
+    for start in fleet['CCS start'].unique():
+        (ng_keys, intercept, slope, coal_keys, coal,
+         years) = leak_response(kind=kind, CCS_start=start, CH4_RE=CH4_RE,
+                                total=False, end=end, **kwargs)
+        for i, (ccs, methane) in enumerate(
+                ng_keys[['CCS', 'Methane']].itertuples(index=False)):
+            responses[('NG', ccs, methane, start)] = (intercept[i], slope[i])
+        for i, ccs in enumerate(coal_keys['CCS']):
+            responses[('Coal', ccs, '-', start)] = (coal[i],
+                                                    np.zeros_like(coal[i]))
+
+    return responses, years
+
+
+def fleet_forcing(fleet, kind='RF', end=100, by=None, CH4_RE=CH4_RE,
+                  **kwargs):
+    """
+    Total RF or CRF from a fleet of power plants with their own build year,
+    size, capacity factor, CCS start year and leakage rate. Forcing is
+    linear in emissions and shifts in time with the build year, so each
+    archetype (*archetype_cols*) is calculated once. Plants are then summed
+    by convolving the archetype response with the annual build schedule of
+    generation (and of generation times leakage for NGCC). The cost depends
+    on the number of archetypes, not the number of plants.
+
+    inputs:
+        fleet: dataframe
+            One row per plant. 'Fuel' ('NG' or 'Coal') and 'CCS' (a key of
+            the emission dictionaries, or '16%-90%' for coal) are required.
+            Other columns of *fleet_cols* default to *fleet_defaults*.
+            'CCS start' is relative to the build year, 'Build year' must be
+            a whole number of years, and 'Leak' is in percent (only used for
+            NG). The 'Reduce' methane path is scaled linearly for every leak
+            rate, including 1%.
+        kind: str
+            RF or CRF
+        end: int
+            Number of years in the results, starting from year 0 of the
+            fleet. Plants built after *end* are ignored.
+        by: str, list or None
+            Fleet columns to report forcing for separately
+        CH4_RE: float
+            Radiative efficiency of methane
+        Other keyword arguments are passed to *emissions.emissions_array*
+        (e.g. life, leakage_drop_by, year_to_90CCS)
+    outputs:
+        df: dataframe
+            Columns for CO2, CH4 and total forcing, with an index of the
+            *by* columns and 'Time'
+    """
+    fleet = fleet.copy()
+    for col, value in fleet_defaults.items():
+        if col not in fleet.columns:
+            fleet[col] = value
+    fleet.loc[fleet['Fuel'] == 'Coal', 'Methane'] = '-'
+
+    build = fleet['Build year'].values
+    if not np.allclose(build, np.round(build)):
+        raise ValueError('Build years must be whole numbers of years')
+    fleet['Build year'] = np.round(build).astype(int)
+    fleet = fleet.loc[(fleet['Build year'] >= 0)
+                      & (fleet['Build year'] <= end)]
+
+    responses, years = archetype_responses(fleet, kind=kind, end=end,
+                                           CH4_RE=CH4_RE, **kwargs)
+
+    # Generation relative to the plant in the archetype responses
+    fleet['Scale'] = (fleet['Size'] * fleet['Capacity factor'] * hours
+                      / generation)
+    fleet['Scale leak'] = fleet['Scale'] * fleet['Leak']
+
+    if by is None:
+        by = []
+    elif isinstance(by, str):
+        by = [by]
+
+    results = {}
+    for key, group in fleet.groupby(by + archetype_cols):
+        arch = key[len(by):]
+        intercept, slope = responses[arch]
+        schedule = np.bincount(group['Build year'], weights=group['Scale'],
+                               minlength=years.size)
+        leak_schedule = np.bincount(group['Build year'],
+                                    weights=group['Scale leak'],
+                                    minlength=years.size)
+        total = (_shifted_sum(schedule, intercept)
+                 + _shifted_sum(leak_schedule, slope))
+
+        out_key = key[:len(by)]
+        results[out_key] = results.get(out_key, 0) + total
+
+    first_cols = ['{}{}'.format(x, kind) for x in ['CO2_', 'CH4_']]
+    df_list = []
+    for out_key, total in results.items():
+        df = pd.DataFrame({first_cols[0]: total[0], first_cols[1]: total[1]},
+                          columns=first_cols)
+        df[kind] = df[first_cols[0]] + df[first_cols[1]]
+        for col, value in zip(by, out_key):
+            df[col] = value
+        df['Time'] = np.round(years).astype(int)
+        df_list.append(df)
+
+    df = pd.concat(df_list, ignore_index=True)
+    df.set_index(by + ['Time'], inplace=True)
+    df.sort_index(inplace=True)
+
+    return df
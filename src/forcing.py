@@ -0,0 +1,409 @@
+import pandas as pd
+import numpy as np
+from ghgforcing import CO2_AR5, CH4_AR5, ch42co2, AR5_GTP
+
+from emissions import (generation, gases, key_cols, repeat_keys,
+                       ScenarioSpec, expand_specs)
+import profiling
+
+
+# Radiative efficiency of methane per kg, converted from per ppb
+ch4_re_ppb = 3.63E-4
+M_A = 28.97
+M_i = 16.04
+T_M = 5.1352E18
+
+ch4_re_mass = ch4_re_ppb * (M_A / M_i) * (1E9 / T_M)
+
+# Include the 15% and 50% adders for indirect effects on water vapor and ozone
+CH4_RE = ch4_re_mass * 1.65
+CO2_RE = 1.756E-15
+
+# kg carbon released per K temperature increase - Collins et al (2013)
+gamma = (44.0/12.0) * 10**12
+
+index_cols = ['Fuel', 'Leak', 'Methane', 'CCS', 'Start year', 'Time']
+
+_kernel_cache = {}
+
+# Number of *emissions.ScenarioSpec* expanded at once in *forcing_array*
+spec_block_size = 256
+
+
+def _convolve(kernel, x, tstep):
+    """
+    Convolution of a kernel with an array along the last axis, truncated to
+    the length of the array. Matches the fftconvolve/resize pattern used in
+    ghgforcing.
+    """
+    n = x.shape[-1]
+    nfft = 1 << int(2 * n - 1).bit_length()
+    out = np.fft.irfft(np.fft.rfft(kernel, nfft) * np.fft.rfft(x, nfft, axis=-1),
+                       nfft, axis=-1)
+
+    return out[..., :n] * tstep
+
+
+def _cumtrapz(y, dx):
+    'Cumulative trapezoid integral along the last axis, starting from zero'
+    out = np.zeros_like(y)
+    np.cumsum((y[..., 1:] + y[..., :-1]) * (dx / 2.0), axis=-1, out=out[..., 1:])
+
+    return out
+
+
+def irf_kernels(n, tstep=0.01, CH4_RE=CH4_RE):
+    """
+    Forcing per kg of a single pulse of CO2 and CH4 on the calculation time
+    grid. The CH4 kernel includes decay of methane to CO2 and climate-carbon
+    feedbacks, which is the default behavior of *ghgforcing.CH4*. Kernels are
+    cached for each set of inputs.
+
+    inputs:
+        n: int
+            Number of points in the time grid
+        tstep: float
+            Time step of the grid in years
+        CH4_RE: float
+            Radiative efficiency of methane
+    outputs:
+        kernels: array
+            Read-only array with shape (gas, time). The gas axis follows the
+            order in *emissions.gases*.
+    """
+    cache_key = (n, tstep, CH4_RE)
+    if cache_key not in _kernel_cache:
+        time = np.arange(n) * tstep
+
+        co2_kernel = CO2_AR5(time) * CO2_RE
+
+        # CH4 forcing plus forcing from the CO2 that methane decays into
+        ch4_kernel = (CH4_AR5(time) * CH4_RE
+                      + _convolve(CO2_AR5(time), ch42co2(time), tstep) * CO2_RE)
+
+        # Additional CO2 from climate-carbon feedbacks
+        temp = _convolve(AR5_GTP(time), ch4_kernel, tstep)
+        ch4_kernel = (ch4_kernel
+                      + _convolve(CO2_AR5(time), temp, tstep) * gamma * CO2_RE)
+
+        kernels = np.stack([co2_kernel, ch4_kernel])
+        kernels.flags.writeable = False
+        _kernel_cache[cache_key] = kernels
+
+    return _kernel_cache[cache_key]
+
+
+@profiling.timed('forcing.response_matrix')
+def response_matrix(n, tstep=0.01, kind='RF', CH4_RE=CH4_RE):
+    """
+    Matrix form of the convolution that maps emissions on the calculation
+    time grid to annual RF or CRF. Matrices are cached for each set of inputs.
+
+    inputs:
+        n: int
+            Number of points in the time grid
+        tstep: float
+            Time step of the grid in years
+        kind: str
+            RF or CRF
+        CH4_RE: float
+            Radiative efficiency of methane
+    outputs:
+        matrix: array
+            Read-only array with shape (gas, year, time)
+    """
+    cache_key = (n, tstep, kind, CH4_RE)
+    if cache_key not in _kernel_cache:
+        kernels = irf_kernels(n, tstep, CH4_RE)
+        slice_step = int(round(1 / tstep))
+        rows = np.arange(0, n, slice_step)
+
+        if kind == 'CRF':
+            # Integrating the convolution with the trapezoid rule is the same
+            # as convolving with the integrated kernel, except for the
+            # half-weight on the first emission step.
+            integrated = _cumtrapz(kernels, tstep)
+            first = integrated.copy()
+            integrated += kernels[:, :1] * (tstep / 2.0)
+        else:
+            integrated = first = kernels
+
+        matrix = np.zeros((len(kernels), rows.size, n))
+        for i, row in enumerate(rows):
+            matrix[:, i, 0] = first[:, row]
+            if row > 0:
+                matrix[:, i, 1:row + 1] = integrated[:, row - 1::-1]
+        matrix *= tstep
+        matrix.flags.writeable = False
+        _kernel_cache[cache_key] = matrix
+        profiling.count('forcing.response_matrix.built')
+
+    return _kernel_cache[cache_key]
+
+
+def forcing_array(values, time, kind='RF', CH4_RE=CH4_RE):
+    """
+    Calculate RF or CRF from each gas for every emission scenario in a single
+    batched matrix convolution.
+
+    inputs:
+        values: array or list
+            Emissions with shape (scenario, gas, time), as returned by
+            *emissions.emissions_array*, or a list of
+            *emissions.ScenarioSpec*. Specs are expanded *spec_block_size*
+            at a time, so the dense emissions of every scenario are never
+            in memory at once.
+        time: array
+            Evenly spaced time in years, starting at 0
+        kind: str
+            RF or CRF
+        CH4_RE: float
+            Radiative efficiency of methane
+    outputs:
+        forcing: array
+            Annual forcing from each gas with shape (scenario, gas, year)
+        years: array
+            Years for the last axis of *forcing*
+    """
+    tstep = time[1] - time[0]
+    slice_step = int(round(1 / tstep))
+    matrix = response_matrix(time.size, tstep, kind, CH4_RE)
+
+    years = time[0::slice_step]
+    if is_specs(values):
+        forcing = np.empty((len(values), len(matrix), years.size))
+        for start in range(0, len(values), spec_block_size):
+            block = values[start:start + spec_block_size]
+            apply_response(expand_specs(block, time), matrix,
+                           forcing[start:start + len(block)])
+    else:
+        forcing = apply_response(values, matrix)
+
+    return forcing, years
+
+
+def is_specs(values):
+    'True if *values* is a list of *emissions.ScenarioSpec*'
+    return (isinstance(values, (list, tuple)) and len(values) > 0
+            and isinstance(values[0], ScenarioSpec))
+
+
+@profiling.timed('forcing.apply_response')
+def apply_response(values, matrix, out=None):
+    """
+    Apply a matrix from *response_matrix* to emissions.
+
+    inputs:
+        values: array
+            Emissions with shape (scenario, gas, time)
+        matrix: array
+            Response matrix with shape (gas, year, time)
+        out: array or None
+            Array with shape (scenario, gas, year) to write the results to
+    outputs:
+        forcing: array
+            Annual forcing from each gas with shape (scenario, gas, year)
+    """
+    if out is None:
+        out = np.empty(values.shape[:2] + matrix.shape[1:2])
+    for g in range(len(matrix)):
+        out[:, g, :] = np.dot(values[:, g, :], matrix[g].T) * generation
+    profiling.count('forcing.scenarios', len(values))
+
+    return out
+
+
+@profiling.timed('forcing_frame')
+def forcing_frame(keys, forcing, years, kind='RF', compact=False,
+                  dtype=np.float64):
+    """
+    Arrange forcing from *forcing_array* as the annual dataframe used in the
+    notebooks, with one row per scenario and year.
+
+    inputs:
+        keys: dataframe
+            One row per scenario with the columns in *emissions.key_cols*
+        forcing: array
+            Annual forcing from each gas with shape (scenario, gas, year)
+        years: array
+            Years for the last axis of *forcing*
+        kind: str
+            RF or CRF. Used for column names.
+        compact: bool
+            If True, key index levels are categorical and Time is int16
+        dtype: numpy dtype
+            Type of the forcing columns
+    outputs:
+        complete_df: dataframe
+            Columns for CO2, CH4 and total forcing, with a sorted MultiIndex
+            of *index_cols* and any extra key columns
+    """
+    first_cols = ['{}{}'.format(x, kind) for x in ['CO2_', 'CH4_']]
+    complete_df = pd.DataFrame({col: forcing[:, g, :].ravel()
+                                for g, col in enumerate(first_cols)},
+                               columns=first_cols)
+    complete_df[kind] = complete_df[first_cols[0]] + complete_df[first_cols[1]]
+    if dtype != np.float64:
+        complete_df = complete_df.astype(dtype)
+
+    for col, col_values in repeat_keys(keys, years.size,
+                                       compact=compact).items():
+        complete_df[col] = col_values
+    time_dtype = np.int16 if compact else int
+    complete_df['Time'] = np.tile(np.round(years).astype(time_dtype),
+                                  len(keys))
+
+    complete_df.set_index(frame_index(keys), inplace=True)
+    complete_df.sort_index(inplace=True)
+
+    return complete_df
+
+
+def frame_index(keys):
+    """
+    Index columns for forcing dataframes. Any key columns beyond
+    *emissions.key_cols* (e.g. sweep parameters) go before 'Time'.
+    """
+    extra = [col for col in keys.columns if col not in index_cols]
+
+    return index_cols[:-1] + extra + index_cols[-1:]
+
+
+@profiling.timed('array_to_forcing')
+def array_to_forcing(keys, values, time, kind='RF', CH4_RE=CH4_RE,
+                     compact=False, dtype=np.float64):
+    """
+    Convert the outputs of *emissions.emissions_array* into forcing or
+    cumulative forcing.
+
+    inputs:
+        keys: dataframe
+            One row per scenario with the columns in *emissions.key_cols*
+        values: array
+            Emissions with shape (scenario, gas, time)
+        time: array
+            Time in years for the last axis of *values*
+        kind: str
+            RF or CRF
+        CH4_RE: float
+            Radiative efficiency of methane
+        compact: bool
+            Passed to *forcing_frame*
+        dtype: numpy dtype
+            Passed to *forcing_frame*
+    output:
+        complete_df: dataframe
+            Single dataframe with all results
+    """
+    forcing, years = forcing_array(values, time, kind=kind, CH4_RE=CH4_RE)
+
+    return forcing_frame(keys, forcing, years, kind=kind, compact=compact,
+                         dtype=dtype)
+
+
+def iter_forcing(blocks, kind='RF', CH4_RE=CH4_RE):
+    """
+    Forcing for each block of scenarios from *emissions.iter_emissions*,
+    computed as the blocks arrive.
+
+    inputs:
+        blocks: iterable
+            (keys, values, time) for each block of scenarios
+        kind: str
+            RF or CRF
+        CH4_RE: float
+            Radiative efficiency of methane
+    outputs:
+        keys: dataframe
+            Keys of the block
+        forcing: array
+            Annual forcing from each gas with shape (scenario, gas, year)
+        years: array
+            Years for the last axis of *forcing*
+    """
+    for keys, values, time in blocks:
+        forcing, years = forcing_array(values, time, kind=kind, CH4_RE=CH4_RE)
+        yield keys, forcing, years
+
+
+def blocks_to_forcing(blocks, kind='RF', CH4_RE=CH4_RE, compact=False):
+    """
+    Forcing dataframe for a stream of emission blocks. Only the annual
+    forcing of each block is kept, so memory use is about 1/tstep times
+    smaller than building every emission scenario first.
+
+    inputs:
+        blocks: iterable
+            (keys, values, time) for each block of scenarios, e.g. from
+            *emissions.iter_emissions*
+        kind: str
+            RF or CRF
+        CH4_RE: float
+            Radiative efficiency of methane
+        compact: bool
+            Passed to *forcing_frame*
+    output:
+        complete_df: dataframe
+            Same format as *forcing_frame*
+    """
+    key_list = []
+    forcing_list = []
+    for keys, forcing, years in iter_forcing(blocks, kind=kind, CH4_RE=CH4_RE):
+        key_list.append(keys)
+        forcing_list.append(forcing)
+
+    keys = pd.concat(key_list, ignore_index=True)
+
+    return forcing_frame(keys, np.concatenate(forcing_list), years, kind=kind,
+                         compact=compact)
+
+
+@profiling.timed('tidy_to_array')
+def tidy_to_array(df):
+    """
+    Reshape a tidy emissions dataframe from *emissions.emissions* back into
+    the scenario key table and emissions array. Key columns can also be in
+    the index.
+
+    inputs:
+        df: dataframe
+            Tidy emissions for one or more scenarios
+    outputs:
+        keys: dataframe
+            One row per scenario with the columns in *emissions.key_cols*
+        values: array
+            Emissions with shape (scenario, gas, time)
+        time: array
+            Time in years for the last axis of *values*
+    """
+    if not set(key_cols).issubset(df.columns):
+        df = df.reset_index()
+
+    df = df.sort_values(key_cols + ['Time'])
+    time = np.unique(df['Time'].values)
+    if len(df) % time.size != 0:
+        raise ValueError('Every scenario must cover the same time values')
+
+    keys = df[key_cols].iloc[::time.size].reset_index(drop=True)
+    values = (df[gases].values.astype(float)
+              .reshape(len(keys), time.size, len(gases))
+              .transpose(0, 2, 1))
+
+    return keys, values, time
+
+
+@profiling.timed('emissions_to_forcing')
+def emissions_to_forcing(df, kind='RF', CH4_RE=CH4_RE):
+    """
+    Convert a tidy dataframe of emissions into forcing or cumulative forcing
+
+    inputs:
+        df: full dataframe of emissions
+        kind: RF or CRF
+        CH4_RE: radiative efficiency of methane
+    output:
+        complete_df: single dataframe with all results
+    """
+    keys, values, time = tidy_to_array(df)
+
+    return array_to_forcing(keys, values, time, kind=kind, CH4_RE=CH4_RE)
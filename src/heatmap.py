@@ -1,8 +1,13 @@
-import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
-import matplotlib as mpl
-import seaborn as sns
 import itertools
+
+from figure_data import FigureData
+import profiling
+
+# matplotlib and seaborn are imported when a figure is drawn, so that the
+# data preparation in *FigureData* can be used without them.
+
 # from joblib import delayed, Parallel
 #
 def ax_plot(data_dfs, ax, key, leak, idx, i, **kwargs):
@@ -23,96 +28,28 @@ def ax_plot(data_dfs, ax, key, leak, idx, i, **kwargs):
                linewidth=0)
     pass
 
-class Main_figure:
+class Main_figure(FigureData):
     def __init__(self):
         self._start_delay_kwargs = {'size': 14,
                                       'horizontalalignment': 'center',
                                       'verticalalignment': 'center'}
         pass
 
-    def figure_data(self, df, scenarios, leak_rates=range(1,6), kind='RF',
-                    delay_years=[0,20]):
-        self.kind=kind #Use for selecting colorbar units label
-        leak_values = ['NGCC ' + str(x) + '%' for x in leak_rates]
-        self.years = set(df['Time'])
-        self.data_dfs = {}
-        self.scenarios=scenarios
-        for key in self.scenarios.keys():
-            self.data_dfs[key] = {}
-
-            for start in delay_years:
-                temp_df_coal = df.loc[(df['CCS']==self.scenarios[key]['Coal CCS']) &
-                                 (df['Fuel']=='Coal') &
-                                 (df['Start year']==start)]
-                temp_df_gas = df.loc[(df['CCS']==self.scenarios[key]['Gas CCS']) &
-                                 (df['Fuel']=='NG') &
-                                 (df['Methane']==self.scenarios[key]['Methane']) &
-                                 (df['Start year']==start)]
-                temp_df = pd.concat([temp_df_coal, temp_df_gas])
-
-                # Populate a temporary list of dfs that get concatenated
-                temp_list = []
-                for leak in leak_values:
-                    diff = pd.DataFrame(columns=['Difference', 'Leak', 'Time'])
-                    diff.loc[:,'Difference'] = (temp_df.loc[temp_df['Fuel']=='Coal', kind].values -
-                        temp_df.loc[(temp_df['Fuel']=='NG')&(temp_df['Leak']==leak), kind].values)
-                    diff.loc[:,'Leak'] = leak
-                    diff.loc[:,'Time'] = temp_df.loc[temp_df['Fuel']=='Coal', 'Time'].values
-
-                    temp_list.append(diff)
-
-                self.data_dfs[key][start] = pd.concat(temp_list)
-
-#         return data_dfs
-
-    def find_max_abs(self, data, leak_rates=range(1,6), data_column='Difference'):
-        """"
-        Returns the maximum absolute value from the dataframe.
-        Used to scale the colorbar.
-
-        -----
-        data: dataframe input
-        leak_rates: string or list of values that are expected in the 'leak' column of
-                    the dataframe
-        data_column: string or list of dataframe column to find the abs max of
-        """
-        leak_values = ['NGCC ' + str(x) + '%' for x in leak_rates]
-
-
-        filtered_data = data.loc[data['Leak'].isin(leak_values), data_column].copy()
-
-        max_value = filtered_data.values.max()
-        min_value = filtered_data.values.min()
-        self.abs_max = max(max_value, abs(min_value))
-
-        return self.abs_max
-
-    def set_cbar_scale(self):
-        'Set the cbar scale with one set of data. Can apply to a second set'
-        self.df_list = []
-        for key1 in self.data_dfs.keys():
-            for key2 in self.data_dfs[key1].keys():
-                self.df_list.append(self.data_dfs[key1][key2])
-
-        self.cbar_scale = self.find_max_abs(pd.concat(self.df_list))
-
-    def set_color_values(self):
-        # self.df_list = []
-        # for key1 in self.data_dfs.keys():
-        #     for key2 in self.data_dfs[key1].keys():
-        #         self.df_list.append(self.data_dfs[key1][key2])
-
-        # cbar_scale = self.find_max_abs(pd.concat(self.df_list))
+    def set_norm(self):
+        'Colormap and normalization shared by the cells and the colorbar'
+        import matplotlib as mpl
+        import matplotlib.pyplot as plt
 
         _norm = mpl.colors.Normalize(vmin=-self.cbar_scale,
                                      vmax=self.cbar_scale)
 
         self.c = plt.cm.ScalarMappable(norm=_norm, cmap='RdBu')
-        c_lambda = lambda x: self.c.to_rgba(x)
-        for key1 in self.data_dfs.keys():
-            for key2 in self.data_dfs[key1].keys():
-                self.data_dfs[key1][key2].loc[:,'Color'] = self.data_dfs[key1][key2].loc[:,'Difference'].apply(c_lambda)
-#         return self.data_dfs, self.c
+
+    @profiling.timed('set_color_values')
+    def set_color_values(self):
+        'RGBA color of every cell, with shape (scenario, delay, leak, year, 4)'
+        self.set_norm()
+        self.colors = self.c.to_rgba(self.diffs)
 
     def make_ticks(self, idx, leak_rates, offset, bar_width):
 
@@ -120,24 +57,85 @@ class Main_figure:
 
         return ticks
 
+    @profiling.timed('plot_heatmap.ax_plot')
     def ax_plot(self, ax, key, leak, idx, i):
 
+        s = self.scenario_index[key]
+        k = self.leak_values.index(leak)
+        year_idx = np.searchsorted(self.years, i)
         for j, year in enumerate(self.delay_years):
-            temp_df = self.data_dfs[key][year]
-            temp_df = temp_df.loc[temp_df['Leak']==leak,:]
+            delay_idx = self.data_delay_years.index(year)
 
             ax.bar(left = 1 + self.offset * j + idx * self.bar_width,
                    height = i+1,
                    width = self.bar_width,
                    bottom = i,
-                   color=temp_df.loc[i,'Color'],
+                   color=self.colors[s, delay_idx, k, year_idx],
                    linewidth=0)
         pass
 
+    def difference_matrix(self, key, leak_values):
+        """
+        Differences for one facet in plotting order.
+
+        inputs:
+            key: str
+                Scenario key
+            leak_values: list
+                Leak labels (e.g. 'NGCC 1%') in the order of the bars
+        outputs:
+            years: array
+                Sorted years
+            diffs: array
+                Differences with shape (year, delay year, leak)
+        """
+        delays = [self.data_delay_years.index(year)
+                  for year in self.delay_years]
+        leaks = [self.leak_values.index(leak) for leak in leak_values]
+        diffs = self.diffs[self.scenario_index[key]][np.ix_(delays, leaks)]
+
+        return self.years, diffs.transpose(2, 0, 1)
+
+    @profiling.timed('plot_heatmap.ax_mesh')
+    def ax_mesh(self, ax, key, leak_values):
+        """
+        Draw every bar of one facet as a single rasterized mesh. Cells are
+        in the same places as the bars from *ax_plot*: each delay year is a
+        group of bars centered on the x ticks, and each year fills the
+        interval up to the next year.
+        """
+        years, diffs = self.difference_matrix(key, leak_values)
+        n_delays = len(self.delay_years)
+        n_leaks = len(leak_values)
+
+        # Bar edges for each group. The cell between two groups is masked.
+        x_edges = np.concatenate(
+            [1 + self.offset * j - self.bar_width / 2
+             + self.bar_width * np.arange(n_leaks + 1)
+             for j in range(n_delays)])
+        y_edges = np.append(years, years[-1] + 1)
+
+        # masked_all leaves the data under the mask uninitialized, which can
+        # overflow when the colormap normalizes it
+        cells = np.ma.masked_array(
+            np.zeros((years.size, n_delays * (n_leaks + 1) - 1)), mask=True)
+        for j in range(n_delays):
+            start = j * (n_leaks + 1)
+            cells[:, start:start + n_leaks] = diffs[:, j, :]
+
+        mesh = ax.pcolormesh(x_edges, y_edges, cells, cmap=self.c.cmap,
+                             norm=self.c.norm, rasterized=True,
+                             linewidth=0)
+        # Keep the default x margins that the bars have
+        mesh.sticky_edges.x[:] = []
+
+        return mesh
+
+    @profiling.timed('plot_heatmap')
     def plot_heatmap(self, leak_rates=range(1,6), delay_years=[0,20],
                      font_scale=1.0, figsize=[13,6], cbar_pad=0.05,
                      bar_width=0.15, rows=2, cols=4, group_spacing=1.0,
-                     scenario_keys=None, cbar=True, **kwargs):
+                     scenario_keys=None, cbar=True, raster=False, **kwargs):
         """
 
         inputs:
@@ -165,6 +163,11 @@ class Main_figure:
                 scenarios in the original dataframe
             cbar: bool
                 If True, add a colorbar to the figure.
+            raster: bool
+                If True, draw each subplot as a single rasterized mesh
+                (see *ax_mesh*) instead of one bar per leak rate, delay
+                and year. The figure looks the same and is much faster to
+                build and save.
 
         """
         label_dict = kwargs.get('label_dict',
@@ -244,6 +247,9 @@ class Main_figure:
         first_column_top = keys_list[0]
         first_column_bottom = keys_list[half_scenarios]
 
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+
         sns.set_style('white')
 
         _figsize = tuple(figsize)
@@ -282,17 +288,24 @@ class Main_figure:
         #     'bar_width': self.bar_width
         # }
 
+        if raster and not hasattr(self, 'c'):
+            self.set_norm()
+
         # create each subplot
         for key, ax in zip(scenario_keys, axs.flat):
             # ax.set_aspect(aspect='equal', adjustable='box-forced')
 
+            if raster:
+                self.ax_mesh(ax, key, leak_values)
+
             # Plot bar for each of the leak rates
             # One bar for each of the delay year values
             for idx, leak in enumerate(leak_values):
 
                 # Create 1 year of the bar at a time
-                for i in self.years: #range(100):
-                    self.ax_plot(ax, key, leak, idx, i)
+                if not raster:
+                    for i in self.years: #range(100):
+                        self.ax_plot(ax, key, leak, idx, i)
                     # for j in range(len(delay_years)):
                 # if n_jobs !=1:
                 #     # Parallel(n_jobs=2)(delayed(sqrt)(i ** 2) for i in range(10))
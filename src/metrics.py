@@ -0,0 +1,295 @@
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+import pandas as pd
+import numpy as np
+
+from basis import default_cache
+from emissions import emissions_specs, spec_keys, time_grid
+from forcing import CH4_RE, forcing_array
+import profiling
+from sweep import sweep_cols
+
+
+# Key columns of the SCPC - NGCC comparison table
+pair_cols = ['Coal CCS', 'Gas CCS', 'Methane', 'Leak', 'Start year']
+
+
+def first_sign_change(values, years):
+    """
+    First year where each row of *values* changes sign (ignoring zeros at
+    the start, e.g. before a plant operates). NaN where the sign never
+    changes.
+
+    inputs:
+        values: array
+            Shape (row, year)
+        years: array
+    outputs:
+        change_years: array
+            Shape (row,)
+    """
+    sign = np.sign(values)
+    # Carry the last non-zero sign forward so a zero does not count
+    filled = sign.copy()
+    for i in range(1, sign.shape[1]):
+        zero = filled[:, i] == 0
+        filled[zero, i] = filled[zero, i - 1]
+    changed = (filled[:, 1:] * filled[:, :-1]) < 0
+    first = changed.argmax(axis=1) + 1
+
+    return np.where(changed.any(axis=1), years[first], np.nan)
+
+
+def reduce_forcing(rf, crf, years, horizons=(20, 100)):
+    """
+    Summary metrics of total (CO2 + CH4) forcing for each scenario.
+
+    inputs:
+        rf, crf: array
+            Annual RF and CRF with shape (scenario, gas, year)
+        years: array
+        horizons: list
+            Years to report RF and CRF at
+    outputs:
+        metrics: dict
+            Arrays with shape (scenario,) for 'RF <h>' and 'CRF <h>' at each
+            horizon, 'Peak RF' and 'Peak RF year'
+    """
+    rf = rf.sum(axis=1)
+    crf = crf.sum(axis=1)
+    metrics = {}
+    for h in horizons:
+        i = _year_index(years, h)
+        metrics['RF {}'.format(h)] = rf[:, i]
+        metrics['CRF {}'.format(h)] = crf[:, i]
+    peak = rf.argmax(axis=1)
+    metrics['Peak RF'] = rf[np.arange(len(rf)), peak]
+    metrics['Peak RF year'] = years[peak]
+
+    return metrics
+
+
+def reduce_difference(rf, crf, years, horizons=(20, 100)):
+    """
+    Summary metrics of SCPC - NGCC total forcing.
+
+    inputs:
+        rf, crf: array
+            Annual RF and CRF differences with shape (pair, gas, year)
+        years: array
+        horizons: list
+            Years to report differences at
+    outputs:
+        metrics: dict
+            Arrays with shape (pair,) for 'RF difference <h>' and
+            'CRF difference <h>' at each horizon, and the first year that
+            the RF and CRF differences change sign
+    """
+    rf = rf.sum(axis=1)
+    crf = crf.sum(axis=1)
+    metrics = {}
+    for h in horizons:
+        i = _year_index(years, h)
+        metrics['RF difference {}'.format(h)] = rf[:, i]
+        metrics['CRF difference {}'.format(h)] = crf[:, i]
+    metrics['RF sign change year'] = first_sign_change(rf, years)
+    metrics['CRF sign change year'] = first_sign_change(crf, years)
+
+    return metrics
+
+
+def _year_index(years, year):
+    i = np.searchsorted(years, year)
+    if i >= years.size or years[i] != year:
+        raise ValueError('Year {} is not in the results (0 to {})'
+                         .format(year, years[-1]))
+    return i
+
+
+def _frame(keys, metrics):
+    df = keys.copy()
+    for name, value in metrics.items():
+        df[name] = value
+    return df
+
+
+@profiling.timed('metrics.point')
+def point_metrics(point, horizons=(20, 100), CH4_RE=CH4_RE, exact=False,
+                  block_size=50):
+    """
+    Summary metrics for every scenario of one sweep point, and for SCPC -
+    NGCC for every pair of coal and natural gas scenarios. Forcing is
+    calculated for *block_size* natural gas scenarios at a time and reduced
+    straight away, so annual or dense time series are never kept for the
+    whole point.
+
+    inputs:
+        point: dict
+            Grid point from *sweep.sweep_points*
+        horizons: list
+            Years to report values at
+        CH4_RE: float
+            Radiative efficiency of methane
+        exact: bool
+            If True, calculate forcing from scenario change points (see
+            *basis.BasisCache*) instead of dense emission arrays
+        block_size: int
+            Number of natural gas scenarios in each block
+    outputs:
+        scenarios: dataframe
+            One row per scenario with the emission key columns, *sweep_cols*
+            and the outputs of *reduce_forcing*
+        pairs: dataframe
+            One row per SCPC and NGCC pair with *pair_cols*, *sweep_cols*
+            and the outputs of *reduce_difference*
+    """
+    kwargs = dict(point)
+    name = kwargs.pop('name')
+    end, tstep = kwargs.pop('end'), kwargs.pop('tstep')
+    time = time_grid(end, tstep)
+    specs = emissions_specs(**kwargs)
+    ng_specs = [spec for spec in specs if spec.fuel == 'NG']
+    coal_specs = [spec for spec in specs if spec.fuel == 'Coal']
+
+    def forcing(block):
+        out = []
+        for kind in ['RF', 'CRF']:
+            if exact:
+                f, years = default_cache.forcing_array(block, time, kind=kind,
+                                                       CH4_RE=CH4_RE)
+            else:
+                f, years = forcing_array(block, time, kind=kind,
+                                         CH4_RE=CH4_RE)
+            out.append(f)
+        return out[0], out[1], years
+
+    # Coal forcing is needed for every natural gas block, so it is done
+    # first. Rows are still in the order of *emissions_specs*.
+    coal_rf, coal_crf, years = forcing(coal_specs)
+    scenario_parts = []
+    pair_parts = []
+    pair_keys = []
+    for start in range(0, len(ng_specs), block_size):
+        block = ng_specs[start:start + block_size]
+        rf, crf, _ = forcing(block)
+        scenario_parts.append(reduce_forcing(rf, crf, years, horizons))
+        for c, coal_spec in enumerate(coal_specs):
+            pair_parts.append(reduce_difference(coal_rf[c] - rf,
+                                                coal_crf[c] - crf, years,
+                                                horizons))
+            pair_keys.extend((coal_spec.ccs, spec.ccs, spec.methane,
+                              spec.key[0], spec.CCS_start)
+                             for spec in block)
+    scenario_parts.append(reduce_forcing(coal_rf, coal_crf, years, horizons))
+
+    def merge(parts):
+        return {col: np.concatenate([p[col] for p in parts])
+                for col in parts[0]}
+
+    scenarios = _frame(spec_keys(ng_specs + coal_specs),
+                       merge(scenario_parts))
+    pairs = _frame(pd.DataFrame(pair_keys, columns=pair_cols),
+                   merge(pair_parts))
+    for df in [scenarios, pairs]:
+        df['Leakage drop by'] = point['leakage_drop_by']
+        df['Life'] = point['life']
+        df['Emissions'] = name
+
+    return scenarios, pairs
+
+
+def run_metrics(points, horizons=(20, 100), processes=None, chunk_size=None,
+                CH4_RE=CH4_RE, exact=False, block_size=50):
+    """
+    Summary metrics for a whole sweep, without building the annual forcing
+    frames of *sweep.run_sweep*. Memory use depends on the number of
+    scenarios, not on scenarios times years. Points are run in a process
+    pool in chunks, as in *sweep.run_sweep*.
+
+    inputs:
+        points: list
+            Grid points from *sweep.sweep_points*
+        horizons: list
+            Years to report values at
+        processes: int or None
+            Number of worker processes. None uses all CPUs and 1 runs
+            everything in the current process.
+        chunk_size: int or None
+            Number of grid points per task
+        Other inputs are passed to *point_metrics*.
+    outputs:
+        scenarios: dataframe
+        pairs: dataframe
+            Outputs of *point_metrics* for every point
+    """
+    if len(points) == 0:
+        raise ValueError('No sweep points to run')
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if chunk_size is None:
+        chunk_size = max(1, int(np.ceil(len(points) / (4.0 * processes))))
+
+    chunks = [points[i:i + chunk_size]
+              for i in range(0, len(points), chunk_size)]
+    args = ([chunk, horizons, CH4_RE, exact, block_size] for chunk in chunks)
+
+    if processes == 1:
+        outputs = [_run_chunk(*a) for a in args]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            outputs = list(executor.map(_run_chunk, *zip(*args)))
+
+    scenarios = pd.concat([out[0] for out in outputs], ignore_index=True)
+    pairs = pd.concat([out[1] for out in outputs], ignore_index=True)
+
+    return scenarios, pairs
+
+
+def _run_chunk(points, horizons, CH4_RE, exact, block_size):
+    outputs = [point_metrics(point, horizons, CH4_RE, exact, block_size)
+               for point in points]
+
+    return (pd.concat([out[0] for out in outputs], ignore_index=True),
+            pd.concat([out[1] for out in outputs], ignore_index=True))
+
+
+def ccs_savings(df, early=0, late=20, value=None):
+    """
+    Change in a metric when CCS starts in year *early* instead of *late*
+    (value with late CCS minus value with early CCS), for every scenario or
+    pair that was run with both start years.
+
+    inputs:
+        df: dataframe
+            *scenarios* or *pairs* from *run_metrics*
+        early, late: int
+            CCS start years to compare
+        value: str or None
+            Metric column. If None, 'CRF difference 100' for *pairs* and
+            'CRF 100' for *scenarios*.
+    outputs:
+        savings: dataframe
+            Key columns (without 'Start year') and the early, late and
+            'Savings' values
+    """
+    keys = [col for col in df.columns
+            if col in pair_cols + sweep_cols + ['CCS', 'Fuel']
+            and col != 'Start year']
+    if value is None:
+        value = ('CRF difference 100' if 'CRF difference 100' in df.columns
+                 else 'CRF 100')
+    if value not in df.columns:
+        metric_cols = [col for col in df.columns
+                       if col not in keys + ['Start year']]
+        raise ValueError('No metric column {!r}, choose from {}'
+                         .format(value, metric_cols))
+    early_df = df.loc[df['Start year'] == early, keys + [value]]
+    late_df = df.loc[df['Start year'] == late, keys + [value]]
+    savings = early_df.merge(late_df, on=keys,
+                             suffixes=(' start {}'.format(early),
+                                       ' start {}'.format(late)))
+    savings['Savings'] = (savings['{} start {}'.format(value, late)]
+                          - savings['{} start {}'.format(value, early)])
+
+    return savings
@@ -0,0 +1,354 @@
+"""
+Timing spans, counters and memory snapshots for the pipeline stages.
+Nothing is recorded unless profiling is enabled, and instrumented functions
+then cost a single check of a module variable.
+
+Turn it on for a whole run with an environment variable
+
+    CCS_PROFILE=trace.json python server.py
+
+(CCS_PROFILE_FORMAT=json for plain JSON instead of Chrome trace format, and
+CCS_PROFILE_MEMORY=1 to trace memory), or in code with
+
+    with profiling.profile('trace.json'):
+        df = emissions()
+
+Chrome trace files open in chrome://tracing or https://ui.perfetto.dev.
+Only the current process is recorded, not process pool workers.
+"""
+import atexit
+from collections import OrderedDict
+from contextlib import contextmanager
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+
+# Active *Profiler*, or None when profiling is off
+_profiler = None
+
+
+class _NullSpan:
+    'Span used when profiling is off'
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_null_span = _NullSpan()
+
+
+class _Span:
+    def __init__(self, profiler, name, args):
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        stack = self.profiler._stack()
+        self.depth = len(stack)
+        stack.append(self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        self.profiler._stack().pop()
+        event = {'name': self.name,
+                 'start': self.start - self.profiler.start,
+                 'duration': end - self.start,
+                 'depth': self.depth,
+                 'thread': threading.get_ident()}
+        if self.args:
+            event['args'] = self.args
+        if self.profiler.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            event['memory'] = current
+            event['peak_memory'] = peak
+        self.profiler.spans.append(event)
+        return False
+
+
+class Profiler:
+    """
+    Records timing spans, counters and memory snapshots.
+
+    inputs:
+        memory: bool
+            If True, trace memory allocations with tracemalloc and store the
+            current and peak traced memory (bytes) with every span
+    """
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.start = time.perf_counter()
+        self.spans = []
+        self.counters = OrderedDict()
+        self.counter_events = []
+        self.snapshots = []
+        self._local = threading.local()
+        self._started_tracemalloc = False
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def span(self, name, **args):
+        'Context manager that times a block of code'
+        return _Span(self, name, args)
+
+    def count(self, name, n=1):
+        'Add *n* to a counter'
+        self.counters[name] = self.counters.get(name, 0) + n
+        self.counter_events.append((time.perf_counter() - self.start, name,
+                                    self.counters[name]))
+
+    def snapshot(self, name):
+        """
+        Record the current and peak traced memory (bytes). Without
+        *memory*, only the time of the snapshot is recorded.
+        """
+        event = {'name': name, 'time': time.perf_counter() - self.start}
+        if tracemalloc.is_tracing():
+            event['memory'], event['peak_memory'] = \
+                tracemalloc.get_traced_memory()
+        self.snapshots.append(event)
+
+    def close(self):
+        'Stop tracing memory if this profiler started it'
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def summary(self):
+        """
+        Totals for each span name, sorted by total time.
+
+        outputs:
+            summary: list
+                Dicts with 'name', 'calls', 'total', 'mean' and 'max'
+                (seconds)
+        """
+        totals = OrderedDict()
+        for event in self.spans:
+            row = totals.setdefault(event['name'],
+                                    {'name': event['name'], 'calls': 0,
+                                     'total': 0.0, 'max': 0.0})
+            row['calls'] += 1
+            row['total'] += event['duration']
+            row['max'] = max(row['max'], event['duration'])
+        for row in totals.values():
+            row['mean'] = row['total'] / row['calls']
+
+        return sorted(totals.values(), key=lambda row: -row['total'])
+
+    def report(self):
+        'Text table of *summary* and the counters'
+        lines = ['{:<40} {:>7} {:>10} {:>10} {:>10}'.format(
+            'span', 'calls', 'total s', 'mean s', 'max s')]
+        for row in self.summary():
+            lines.append('{name:<40} {calls:>7} {total:>10.4f} {mean:>10.4f} '
+                         '{max:>10.4f}'.format(**row))
+        for name, value in self.counters.items():
+            lines.append('{:<40} {:>7}'.format(name, value))
+
+        return '\n'.join(lines)
+
+    def to_dict(self):
+        'All events as a JSON-compatible dict. Times are in seconds.'
+        return {'spans': self.spans,
+                'counters': dict(self.counters),
+                'snapshots': self.snapshots,
+                'summary': self.summary()}
+
+    def chrome_trace(self):
+        """
+        Events in the Chrome trace event format, with spans as complete
+        ('X') events and counters and memory as counter ('C') events.
+        Times are in microseconds.
+        """
+        pid = os.getpid()
+        events = []
+        for span in self.spans:
+            event = {'name': span['name'], 'ph': 'X', 'pid': pid,
+                     'tid': span['thread'], 'ts': span['start'] * 1e6,
+                     'dur': span['duration'] * 1e6}
+            args = dict(span.get('args', {}))
+            if 'memory' in span:
+                args['memory'] = span['memory']
+            if args:
+                event['args'] = {k: _jsonable(v) for k, v in args.items()}
+            events.append(event)
+        for t, name, value in self.counter_events:
+            events.append({'name': name, 'ph': 'C', 'pid': pid, 'ts': t * 1e6,
+                           'args': {name: value}})
+        for snap in self.snapshots:
+            events.append({'name': snap['name'], 'ph': 'i', 's': 'p',
+                           'pid': pid, 'ts': snap['time'] * 1e6})
+            if 'memory' in snap:
+                events.append({'name': 'memory', 'ph': 'C', 'pid': pid,
+                               'ts': snap['time'] * 1e6,
+                               'args': {'current': snap['memory'],
+                                        'peak': snap['peak_memory']}})
+
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def save(self, path, format='chrome'):
+        """
+        Write the events to a file.
+
+        inputs:
+            path: str
+            format: str
+                'chrome' for Chrome trace format or 'json' for *to_dict*
+        """
+        if format == 'chrome':
+            data = self.chrome_trace()
+        elif format == 'json':
+            data = self.to_dict()
+        else:
+            raise ValueError('format must be "chrome" or "json"')
+        with open(path, 'w') as f:
+            json.dump(data, f, default=_jsonable)
+
+
+def _jsonable(value):
+    'Plain Python value for numpy scalars and other objects in span args'
+    if hasattr(value, 'item'):
+        return value.item()
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+
+def enable(memory=False):
+    """
+    Start recording with a new *Profiler*.
+
+    outputs:
+        profiler: Profiler
+    """
+    global _profiler
+    if _profiler is not None:
+        _profiler.close()
+    _profiler = Profiler(memory=memory)
+
+    return _profiler
+
+
+def disable():
+    """
+    Stop recording.
+
+    outputs:
+        profiler: Profiler or None
+            The profiler that was active, with everything it recorded
+    """
+    global _profiler
+    profiler, _profiler = _profiler, None
+    if profiler is not None:
+        profiler.close()
+
+    return profiler
+
+
+def active():
+    'The active *Profiler*, or None'
+    return _profiler
+
+
+def span(name, **args):
+    """
+    Time a block of code when profiling is on.
+
+        with profiling.span('forcing', scenarios=n):
+            ...
+    """
+    if _profiler is None:
+        return _null_span
+    return _profiler.span(name, **args)
+
+
+def count(name, n=1):
+    'Add *n* to a counter when profiling is on'
+    if _profiler is not None:
+        _profiler.count(name, n)
+
+
+def snapshot(name):
+    'Record memory use when profiling is on'
+    if _profiler is not None:
+        _profiler.snapshot(name)
+
+
+def timed(name=None):
+    """
+    Decorator that times every call of a function as a span. The span is
+    named *name*, or module.function by default.
+    """
+    def decorator(func):
+        label = name or '{}.{}'.format(func.__module__, func.__name__)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _profiler is None:
+                return func(*args, **kwargs)
+            with _profiler.span(label):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def profile(path=None, format='chrome', memory=False):
+    """
+    Record everything in a block of code and optionally save the events.
+    A profiler that was already active is restored afterwards.
+
+    inputs:
+        path: str or None
+            File for *Profiler.save*
+        format: str
+            'chrome' or 'json'
+        memory: bool
+            Trace memory (see *Profiler*)
+    outputs:
+        profiler: Profiler
+    """
+    global _profiler
+    previous = _profiler
+    profiler = _profiler = Profiler(memory=memory)
+    try:
+        yield profiler
+    finally:
+        _profiler = previous
+        profiler.close()
+        if path is not None:
+            profiler.save(path, format)
+
+
+def _from_environment():
+    path = os.environ.get('CCS_PROFILE')
+    if not path:
+        return
+    memory = os.environ.get('CCS_PROFILE_MEMORY', '') not in ('', '0')
+    format = os.environ.get('CCS_PROFILE_FORMAT', 'chrome')
+    profiler = enable(memory=memory)
+
+    def save():
+        profiler.save(path, format)
+
+    atexit.register(save)
+
+
+_from_environment()
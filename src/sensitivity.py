@@ -0,0 +1,353 @@
+import pandas as pd
+import numpy as np
+
+from emissions import (coal_emissions, ng_emissions, emissions_array,
+                       emission_factors, factor_defaults)
+from forcing import CH4_RE, forcing_array
+
+
+index_cols = ['Coal CCS', 'Gas CCS', 'Methane', 'Leak', 'Time', 'Factor']
+
+
+def _leaves(coal_emissions=coal_emissions, ng_emissions=ng_emissions):
+    "Paths to every emission value in the coal and NG dictionaries"
+    coal = [('Coal', ccs, gas) for ccs in coal_emissions
+            for gas in coal_emissions[ccs]]
+    ng = [('NG', ccs, source, gas) for ccs in ng_emissions
+          for source in ng_emissions[ccs]
+          for gas in ng_emissions[ccs][source]]
+
+    return coal + ng
+
+
+def _unit_dicts(leaf):
+    "Emission dictionaries with a value of 1 at *leaf* and 0 everywhere else"
+    coal = {ccs: {gas: 0.0 for gas in coal_emissions[ccs]}
+            for ccs in coal_emissions}
+    ng = {ccs: {source: {gas: 0.0 for gas in ng_emissions[ccs][source]}
+                for source in ng_emissions[ccs]}
+          for ccs in ng_emissions}
+    if leaf[0] == 'Coal':
+        coal[leaf[1]][leaf[2]] = 1.0
+    else:
+        ng[leaf[1]][leaf[2]][leaf[3]] = 1.0
+
+    return coal, ng
+
+
+def leaf_values(coal_emissions, ng_emissions):
+    """
+    Emission values in the order of *_leaves*, as a matrix with one row per
+    sample.
+
+    inputs:
+        coal_emissions: dict
+        ng_emissions: dict
+            Emission dictionaries, e.g. from *emissions.emission_factors*,
+            where each value is a number or an array of samples
+    outputs:
+        values: array
+            Shape (sample, leaf)
+    """
+    values = []
+    for leaf in _leaves():
+        if leaf[0] == 'Coal':
+            values.append(coal_emissions[leaf[1]][leaf[2]])
+        else:
+            values.append(ng_emissions[leaf[1]][leaf[2]][leaf[3]])
+
+    return np.column_stack(np.broadcast_arrays(*values))
+
+
+def factor_forcing(kind='RF', CH4_RE=CH4_RE, **kwargs):
+    """
+    Forcing of every scenario is linear in the emission values of the coal
+    and NG dictionaries. Find the total forcing from a value of 1 for each
+    of them, so that forcing for any set of emission values is a single
+    matrix product.
+
+    inputs:
+        kind: str
+            RF or CRF
+        CH4_RE: float
+            Radiative efficiency of methane
+        Other keyword arguments are passed to *emissions.emissions_array*
+        (except the emission dictionaries).
+    outputs:
+        keys: dataframe
+            One row per scenario
+        basis: array
+            Total forcing with shape (leaf, scenario, year)
+        years: array
+    """
+    leaves = _leaves()
+    arrays = []
+    for leaf in leaves:
+        coal, ng = _unit_dicts(leaf)
+        keys, values, time = emissions_array(coal_emissions=coal,
+                                             ng_emissions=ng, **kwargs)
+        arrays.append(values)
+
+    forcing, years = forcing_array(np.concatenate(arrays), time, kind=kind,
+                                   CH4_RE=CH4_RE)
+    basis = forcing.sum(axis=1).reshape(len(leaves), len(keys), years.size)
+
+    return keys, basis, years
+
+
+def difference_outputs(keys, basis, years, output_years=(20, 100)):
+    """
+    Basis for the SCPC - NGCC difference of every pair of coal and natural
+    gas scenarios at some years.
+
+    inputs:
+        keys: dataframe
+        basis: array
+        years: array
+            Outputs of *factor_forcing*
+        output_years: list
+            Years to report
+    outputs:
+        out_keys: dataframe
+            Columns of *index_cols* except 'Factor', one row per output
+        out_basis: array
+            Differences with shape (leaf, output)
+    """
+    is_ng = (keys['Fuel'] == 'NG').values
+    coal_rows = np.flatnonzero(~is_ng)
+    ng_rows = np.flatnonzero(is_ng)
+    year_idx = np.searchsorted(years, output_years)
+
+    diffs = (basis[:, coal_rows[:, None, None], year_idx]
+             - basis[:, ng_rows[None, :, None], year_idx])
+
+    out_keys = pd.DataFrame({
+        'Coal CCS': np.repeat(keys['CCS'].values[coal_rows],
+                              len(ng_rows) * len(year_idx)),
+        'Gas CCS': np.tile(np.repeat(keys['CCS'].values[ng_rows],
+                                     len(year_idx)), len(coal_rows)),
+        'Methane': np.tile(np.repeat(keys['Methane'].values[ng_rows],
+                                     len(year_idx)), len(coal_rows)),
+        'Leak': np.tile(np.repeat(keys['Leak'].values[ng_rows],
+                                  len(year_idx)), len(coal_rows)),
+        'Time': np.tile(years[year_idx].round().astype(int),
+                        len(coal_rows) * len(ng_rows))},
+        columns=index_cols[:-1])
+
+    return out_keys, diffs.reshape(len(basis), -1)
+
+
+def sample_factors(n, bounds, random_state):
+    """
+    Uniform samples of emission factors.
+
+    inputs:
+        n: int
+            Number of samples
+        bounds: dict
+            (low, high) for each factor name in *emissions.factor_defaults*
+        random_state: numpy RandomState
+    outputs:
+        samples: array
+            Shape (n, factor) in the order of *bounds*
+    """
+    low = np.array([b[0] for b in bounds.values()], dtype=float)
+    high = np.array([b[1] for b in bounds.values()], dtype=float)
+
+    return low + (high - low) * random_state.random_sample((n, len(bounds)))
+
+
+def default_bounds(spread=0.1, factors=None):
+    """
+    Bounds of +/- *spread* (as a fraction) around the nominal value of each
+    emission factor.
+
+    inputs:
+        spread: float
+        factors: list or None
+            Names from *emissions.factor_defaults*. All factors if None.
+    outputs:
+        bounds: dict
+    """
+    factors = factors or list(factor_defaults)
+
+    return {name: (factor_defaults[name] * (1 - spread),
+                   factor_defaults[name] * (1 + spread))
+            for name in factors}
+
+
+def sobol_indices(kind='CRF', n_samples=1024, bounds=None,
+                  output_years=(20, 100), seed=1, CH4_RE=CH4_RE, **kwargs):
+    """
+    First-order and total-order Sobol indices of emission factors on the
+    SCPC - NGCC difference in RF or CRF. Uses the Saltelli (2010) sampling
+    scheme with the Saltelli first-order and Jansen total-order estimators,
+    which needs n_samples * (factors + 2) model runs. All runs are evaluated
+    at once: sampled factors give emission values through
+    *emissions.emission_factors*, and forcing is a matrix product with the
+    basis from *factor_forcing*.
+
+    inputs:
+        kind: str
+            RF or CRF
+        n_samples: int
+            Number of base samples
+        bounds: dict or None
+            (low, high) for each factor to vary. Factors that are not in the
+            dict stay at their nominal values. Uses *default_bounds* if None.
+        output_years: list
+            Years of the differences to analyze
+        seed: int
+            Random seed
+        CH4_RE: float
+            Radiative efficiency of methane
+        Other keyword arguments are passed to *emissions.emissions_array*
+    outputs:
+        df: dataframe
+            Columns 'S1', 'ST' and 'Variance' of the output, with an index of
+            *index_cols*
+    """
+    bounds = bounds or default_bounds()
+    names = list(bounds)
+    k = len(names)
+
+    keys, basis, years = factor_forcing(kind=kind, CH4_RE=CH4_RE, **kwargs)
+    out_keys, out_basis = difference_outputs(keys, basis, years,
+                                             output_years=output_years)
+
+    def model(samples):
+        coal, ng = emission_factors(**{name: samples[:, i]
+                                       for i, name in enumerate(names)})
+        return leaf_values(coal, ng).dot(out_basis)
+
+    random_state = np.random.RandomState(seed)
+    A = sample_factors(n_samples, bounds, random_state)
+    B = sample_factors(n_samples, bounds, random_state)
+    f_A = model(A)
+    f_B = model(B)
+    variance = np.var(np.concatenate([f_A, f_B]), axis=0)
+
+    S1 = np.empty((k, f_A.shape[1]))
+    ST = np.empty((k, f_A.shape[1]))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for i in range(k):
+            AB = A.copy()
+            AB[:, i] = B[:, i]
+            f_AB = model(AB)
+            S1[i] = np.mean(f_B * (f_AB - f_A), axis=0) / variance
+            ST[i] = 0.5 * np.mean((f_A - f_AB)**2, axis=0) / variance
+
+    n_out = len(out_keys)
+    df = out_keys.loc[np.tile(np.arange(n_out), k)].reset_index(drop=True)
+    df['Factor'] = np.repeat(names, n_out)
+    df['S1'] = S1.ravel()
+    df['ST'] = ST.ravel()
+    df['Variance'] = np.tile(variance, k)
+    df.set_index(index_cols, inplace=True)
+    df.sort_index(inplace=True)
+
+    return df
+
+
+def leaf_derivatives(at=None, factors=None):
+    """
+    Derivative of every emission value (in the order of *_leaves*) with
+    respect to each emission factor. Every emission value is a sum of
+    products of different factors, so it is linear in each single factor
+    and a difference with any step is exact.
+
+    inputs:
+        at: dict or None
+            Factor values to take derivatives at. Other factors use
+            *emissions.factor_defaults*.
+        factors: list or None
+            Names from *emissions.factor_defaults*. All factors if None.
+    outputs:
+        derivatives: array
+            Shape (leaf, factor)
+    """
+    point = dict(factor_defaults, **(at or {}))
+    factors = factors or list(factor_defaults)
+    steps = np.array([abs(point[name]) or 1.0 for name in factors])
+
+    # Row 0 is the base point and row i + 1 moves factor i by its step
+    samples = {name: np.full(len(factors) + 1, float(point[name]))
+               for name in factor_defaults}
+    for i, name in enumerate(factors):
+        samples[name][i + 1] += steps[i]
+    values = leaf_values(*emission_factors(**samples))
+
+    return ((values[1:] - values[0]) / steps[:, None]).T
+
+
+def jacobian(kind='RF', at=None, factors=None, CH4_RE=CH4_RE, **kwargs):
+    """
+    Exact derivative of the total RF or CRF of every scenario and year with
+    respect to each emission factor, from the unit responses of
+    *factor_forcing*.
+
+    inputs:
+        kind: str
+            RF or CRF
+        at: dict or None
+            Factor values to take derivatives at. Other factors use
+            *emissions.factor_defaults*.
+        factors: list or None
+            Names from *emissions.factor_defaults*. All factors if None.
+        CH4_RE: float
+            Radiative efficiency of methane
+        Other keyword arguments are passed to *emissions.emissions_array*
+    outputs:
+        keys: dataframe
+            One row per scenario
+        forcing: array
+            Total forcing at *at* with shape (scenario, year)
+        jac: array
+            Derivatives with shape (scenario, year, factor)
+        years: array
+        factors: list
+            Factor names for the last axis of *jac*
+    """
+    point = dict(factor_defaults, **(at or {}))
+    factors = factors or list(factor_defaults)
+
+    keys, basis, years = factor_forcing(kind=kind, CH4_RE=CH4_RE, **kwargs)
+    values = leaf_values(*emission_factors(**point))[0]
+    forcing = np.tensordot(values, basis, axes=1)
+    jac = np.tensordot(basis, leaf_derivatives(point, factors),
+                       axes=([0], [0]))
+
+    return keys, forcing, jac, years, factors
+
+
+def what_if(forcing, jac, factors, at=None, **changes):
+    """
+    First-order update of forcing from *jacobian* for new factor values,
+    without recalculating emissions or forcing. The update is exact when a
+    single factor changes, or several factors that do not multiply each
+    other in *emissions.emission_factors*.
+
+        keys, forcing, jac, years, factors = jacobian('CRF')
+        new = what_if(forcing, jac, factors,
+                      coal_ch4=1.2 * factor_defaults['coal_ch4'])
+
+    inputs:
+        forcing, jac, factors:
+            Outputs of *jacobian*
+        at: dict or None
+            Factor values that *jacobian* was called with
+        changes: keyword arguments
+            New values of factors in *factors*
+    outputs:
+        forcing: array
+            Updated forcing with shape (scenario, year)
+    """
+    unknown = set(changes) - set(factors)
+    if unknown:
+        raise KeyError('Factors not in the Jacobian: {}'
+                       .format(sorted(unknown)))
+    point = dict(factor_defaults, **(at or {}))
+    delta = np.array([changes.get(name, point[name]) - point[name]
+                      for name in factors], dtype=float)
+
+    return forcing + jac.dot(delta)
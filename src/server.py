@@ -0,0 +1,251 @@
+"""
+Local query server for scenario forcing. Keeps the step and ramp responses
+of *basis.BasisCache* in memory, so each query only composes the scenarios
+it asks for. Runs offline on localhost HTTP or a Unix socket.
+
+Start it with
+
+    python server.py --port 8765
+    python server.py --socket /tmp/ccs.sock
+
+and POST JSON to http://127.0.0.1:8765/query, e.g.
+
+    {"kind": "RF", "coal_ccs": "90%", "gas_ccs": "90%",
+     "methane": "Reduce", "leak": 3, "start_year": 20}
+
+or {"queries": [...]} for a batch. On the Unix socket, send one JSON
+request per line and read one JSON response per line.
+"""
+import argparse
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import os
+import socketserver
+
+import numpy as np
+
+from basis import BasisCache
+from emissions import coal_emissions, ng_emissions, time_grid
+from forcing import CH4_RE
+import profiling
+
+
+# Query fields and their defaults. Other *emissions* parameters
+# (leakage_drop_by, year_to_90CCS, life) can also be given.
+query_defaults = {'kind': 'RF',
+                  'coal_ccs': '90%',
+                  'gas_ccs': '90%',
+                  'methane': 'Constant',
+                  'leak': 1,
+                  'start_year': 0,
+                  'years': None}
+_scenario_fields = ['leakage_drop_by', 'year_to_90CCS', 'life']
+
+
+class ScenarioEngine:
+    """
+    Answers forcing queries from a warm *basis.BasisCache*.
+
+    inputs:
+        end: int
+            Number of years to calculate
+        tstep: float
+            Time step of the calculation grid
+        CH4_RE: float
+            Radiative efficiency of methane
+    """
+    def __init__(self, end=100, tstep=0.01, CH4_RE=CH4_RE):
+        self.time = time_grid(end, tstep)
+        self.CH4_RE = CH4_RE
+        self.cache = BasisCache()
+        # Build the responses now so that the first query is fast
+        self.cache.responses(self.time.size, tstep, CH4_RE)
+
+    @profiling.timed('server.query')
+    def query(self, request):
+        """
+        Forcing of one SCPC and one NGCC scenario and the difference
+        (SCPC - NGCC) in each year.
+
+        inputs:
+            request: dict
+                Fields in *query_defaults* and, optionally, leakage_drop_by,
+                year_to_90CCS and life
+        outputs:
+            response: dict
+                'years', 'coal', 'ng' and 'difference' lists, plus the
+                query with defaults filled in
+        """
+        unknown = set(request) - set(query_defaults) - set(_scenario_fields)
+        if unknown:
+            raise ValueError('Unknown query fields: {}'.format(sorted(unknown)))
+        q = dict(query_defaults, **request)
+        if q['kind'] not in ('RF', 'CRF'):
+            raise ValueError('kind must be "RF" or "CRF"')
+        if q['coal_ccs'] not in list(coal_emissions) + ['16%-90%']:
+            raise ValueError('Unknown coal_ccs: {}'.format(q['coal_ccs']))
+        if q['gas_ccs'] not in ng_emissions:
+            raise ValueError('Unknown gas_ccs: {}'.format(q['gas_ccs']))
+        if q['methane'] not in ('Constant', 'Reduce'):
+            raise ValueError('methane must be "Constant" or "Reduce"')
+
+        kwargs = {field: q[field] for field in _scenario_fields if field in q}
+        kwargs['CCS_start'] = q['start_year']
+        coal = self.cache.scenario('Coal', q['coal_ccs'], self.time,
+                                   kind=q['kind'], CH4_RE=self.CH4_RE,
+                                   **kwargs).sum(axis=0)
+        ng = self.cache.scenario('NG', q['gas_ccs'], self.time,
+                                 kind=q['kind'], CH4_RE=self.CH4_RE,
+                                 methane=q['methane'], leak=q['leak'],
+                                 **kwargs).sum(axis=0)
+
+        years = np.arange(coal.size)
+        if q['years'] is not None:
+            years = np.atleast_1d(q['years'])
+            if (years.ndim != 1 or years.dtype.kind not in 'iuf'
+                    or not np.isfinite(years).all()
+                    or (years != np.round(years)).any()):
+                raise ValueError('years must be a whole number or a list of '
+                                 'whole numbers')
+            if years.size and (years.min() < 0 or years.max() >= coal.size):
+                raise ValueError('years must be between 0 and {}'
+                                 .format(coal.size - 1))
+            years = years.astype(int)
+
+        return {'query': q,
+                'years': years.tolist(),
+                'coal': coal[years].tolist(),
+                'ng': ng[years].tolist(),
+                'difference': (coal - ng)[years].tolist()}
+
+    def handle(self, request):
+        """
+        Answer a single query or a batch ({"queries": [...]}). Errors are
+        returned as {"error": message} instead of being raised.
+        """
+        if not isinstance(request, dict):
+            return {'error': 'A request must be a JSON object'}
+        if 'queries' in request:
+            if not isinstance(request['queries'], list):
+                return {'error': '"queries" must be a list of queries'}
+            return {'results': [self.handle(q) for q in request['queries']]}
+        try:
+            return self.query(request)
+        except (ValueError, TypeError, KeyError) as e:
+            return {'error': str(e)}
+
+
+def _http_handler(engine):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, code, body):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == '/health':
+                self._send(200, {'status': 'ok'})
+            else:
+                self._send(404, {'error': 'Not found'})
+
+        def do_POST(self):
+            if self.path != '/query':
+                self._send(404, {'error': 'Not found'})
+                return
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                if length < 0:
+                    raise ValueError(length)
+            except ValueError:
+                self._send(400, {'error': 'Invalid Content-Length: {}'.format(
+                    self.headers.get('Content-Length'))})
+                return
+            try:
+                request = json.loads(self.rfile.read(length).decode('utf-8'))
+            except ValueError as e:
+                self._send(400, {'error': 'Invalid JSON: {}'.format(e)})
+                return
+            self._send(200, engine.handle(request))
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def _unix_handler(engine):
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                if not line.strip():
+                    continue
+                try:
+                    request = json.loads(line.decode('utf-8'))
+                except ValueError as e:
+                    response = {'error': 'Invalid JSON: {}'.format(e)}
+                else:
+                    response = engine.handle(request)
+                self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+                self.wfile.flush()
+
+    return Handler
+
+
+def make_server(engine=None, host='127.0.0.1', port=8765, socket_path=None):
+    """
+    HTTP server on *host* and *port*, or a line-based JSON server on a Unix
+    socket if *socket_path* is given. Call serve_forever() to start it.
+
+    inputs:
+        engine: ScenarioEngine or None
+            A new engine with default settings if None
+        host: str
+        port: int
+        socket_path: str or None
+    outputs:
+        server: socketserver server
+    """
+    engine = engine or ScenarioEngine()
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        return socketserver.UnixStreamServer(socket_path,
+                                             _unix_handler(engine))
+
+    return HTTPServer((host, port), _http_handler(engine))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--socket', default=None,
+                        help='Serve on this Unix socket instead of HTTP')
+    parser.add_argument('--end', type=int, default=100)
+    parser.add_argument('--tstep', type=float, default=0.01)
+    parser.add_argument('--profile', default=None,
+                        help='Write a Chrome trace of the requests to this '
+                             'file on exit')
+    args = parser.parse_args(args)
+
+    if args.profile is not None:
+        profiler = profiling.enable()
+    engine = ScenarioEngine(end=args.end, tstep=args.tstep)
+    server = make_server(engine, args.host, args.port, args.socket)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.profile is not None:
+            profiler.save(args.profile)
+        if args.socket is not None and os.path.exists(args.socket):
+            os.remove(args.socket)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+from concurrent.futures import ProcessPoolExecutor
+import os
+import tempfile
+
+import numpy as np
+
+from forcing import CH4_RE, response_matrix, apply_response
+from uncertainty import monte_carlo
+
+
+# Files in /dev/shm are kept in memory on Linux. Elsewhere, memory-mapped
+# files in the temp directory are shared through the page cache.
+shared_dir = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+# Arrays that a worker process has already mapped, by file path
+_attached = {}
+
+
+class SharedArray:
+    """
+    Numpy array backed by a named memory-mapped file that other processes
+    can attach to without copying. Only *spec* (path, shape and dtype) needs
+    to be sent to a worker. The process that creates the array removes the
+    file in *close*.
+    """
+    def __init__(self, path, shape, dtype=np.float64, mode='r+',
+                 owner=False):
+        self.path = path
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.owner = owner
+        self.array = np.memmap(path, dtype=self.dtype, mode=mode,
+                               shape=self.shape)
+
+    @classmethod
+    def create(cls, shape, dtype=np.float64, data=None):
+        """
+        New shared array, filled with *data* if given
+
+        inputs:
+            shape: tuple
+            dtype: numpy dtype
+            data: array or None
+        outputs:
+            shared: SharedArray
+        """
+        fd, path = tempfile.mkstemp(prefix='ccs-', suffix='.dat',
+                                    dir=shared_dir)
+        os.close(fd)
+        shared = cls(path, shape, dtype, mode='w+', owner=True)
+        if data is not None:
+            shared.array[...] = data
+
+        return shared
+
+    @classmethod
+    def from_array(cls, data):
+        'New shared array with a copy of *data*'
+        data = np.asarray(data)
+
+        return cls.create(data.shape, data.dtype, data)
+
+    @property
+    def spec(self):
+        'Small, picklable description used by *attach*'
+        return self.path, self.shape, self.dtype.str
+
+    def close(self):
+        'Unmap the array, and remove the file if this process created it'
+        self.array = None
+        _attached.pop(self.path, None)
+        if self.owner and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def attach(spec):
+    """
+    Map a shared array from its *SharedArray.spec*. Arrays are mapped once
+    per process and reused by later tasks.
+
+    inputs:
+        spec: tuple
+    outputs:
+        array: numpy memmap
+    """
+    path, shape, dtype = spec
+    if path not in _attached:
+        _attached[path] = np.memmap(path, dtype=dtype, mode='r+',
+                                    shape=tuple(shape))
+
+    return _attached[path]
+
+
+def _slices(n, processes, chunk_size):
+    if chunk_size is None:
+        chunk_size = max(1, int(np.ceil(n / (4.0 * processes))))
+
+    return [(i, min(i + chunk_size, n)) for i in range(0, n, chunk_size)]
+
+
+def _run_tasks(func, tasks, processes):
+    if processes == 1:
+        for task in tasks:
+            func(*task)
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            list(executor.map(func, *zip(*tasks)))
+
+
+def _forcing_task(values_spec, matrix_spec, out_spec, start, stop):
+    values = attach(values_spec)
+    out = attach(out_spec)
+    apply_response(values[start:stop], attach(matrix_spec), out[start:stop])
+
+
+def parallel_forcing(values, time, kind='RF', CH4_RE=CH4_RE, processes=None,
+                     chunk_size=None):
+    """
+    Same output as *forcing.forcing_array*, calculated in a process pool.
+    Emissions, the response matrix and the output are shared arrays, so
+    workers only receive the start and stop rows of their block of
+    scenarios.
+
+    inputs:
+        values: array or SharedArray
+            Emissions with shape (scenario, gas, time). A SharedArray is used
+            as is, anything else is copied into one.
+        time: array
+            Evenly spaced time in years, starting at 0
+        kind: str
+            RF or CRF
+        CH4_RE: float
+            Radiative efficiency of methane
+        processes: int or None
+            Number of worker processes. None uses all CPUs and 1 runs
+            everything in the current process.
+        chunk_size: int or None
+            Number of scenarios per task. Defaults to about 4 tasks per
+            process.
+    outputs:
+        forcing: array
+            Annual forcing from each gas with shape (scenario, gas, year)
+        years: array
+            Years for the last axis of *forcing*
+    """
+    if processes is None:
+        processes = os.cpu_count() or 1
+
+    tstep = time[1] - time[0]
+    matrix = response_matrix(time.size, tstep, kind, CH4_RE)
+    years = time[0::int(round(1 / tstep))]
+
+    owned = not isinstance(values, SharedArray)
+    shared_values = SharedArray.from_array(values) if owned else values
+    n = shared_values.shape[0]
+    shared_matrix = SharedArray.from_array(matrix)
+    out = SharedArray.create((n, len(matrix), years.size))
+    try:
+        tasks = [(shared_values.spec, shared_matrix.spec, out.spec,
+                  start, stop)
+                 for start, stop in _slices(n, processes, chunk_size)]
+        _run_tasks(_forcing_task, tasks, processes)
+        forcing = np.array(out.array)
+    finally:
+        out.close()
+        shared_matrix.close()
+        if owned:
+            shared_values.close()
+
+    return forcing, years
+
+
+def _monte_carlo_task(values_spec, time_spec, out_spec, stat_names, start,
+                      stop, kwargs):
+    values = attach(values_spec)
+    out = attach(out_spec)
+    stats, years = monte_carlo(np.asarray(values[start:stop]),
+                               np.asarray(attach(time_spec)), **kwargs)
+    for i, name in enumerate(stat_names):
+        out[i, start:stop] = stats[name]
+
+
+def parallel_monte_carlo(values, time, kind='RF', n_runs=1000,
+                         percentiles=(), seed=1, chunk_size=100, bins=500,
+                         CH4_RE=CH4_RE, processes=None, scenarios_per_task=None):
+    """
+    Same output as *uncertainty.monte_carlo*, with blocks of scenarios run
+    in a process pool. Every block draws the same random parameters, so
+    results do not depend on the number of processes. Emissions and results
+    are shared arrays, and workers only receive the rows of their block.
+
+    inputs:
+        values: array or SharedArray
+            Emissions with shape (scenario, gas, time)
+        processes: int or None
+            Number of worker processes. None uses all CPUs and 1 runs
+            everything in the current process.
+        scenarios_per_task: int or None
+            Number of scenarios per task. Defaults to about 4 tasks per
+            process.
+        Other inputs are the same as *uncertainty.monte_carlo*.
+    outputs:
+        stats: dict
+        years: array
+            Same as *uncertainty.monte_carlo*
+    """
+    if processes is None:
+        processes = os.cpu_count() or 1
+
+    years = time[0::int(round(1 / (time[1] - time[0])))]
+    stat_names = ['mean', 'sigma', 'min', 'max'] + list(percentiles)
+    kwargs = dict(kind=kind, n_runs=n_runs, percentiles=percentiles,
+                  seed=seed, chunk_size=chunk_size, bins=bins, CH4_RE=CH4_RE)
+
+    owned = not isinstance(values, SharedArray)
+    shared_values = SharedArray.from_array(values) if owned else values
+    n = shared_values.shape[0]
+    shared_time = SharedArray.from_array(time)
+    # Gas axis of the results is CO2, CH4 and Total
+    out = SharedArray.create((len(stat_names), n, 3, years.size))
+    try:
+        tasks = [(shared_values.spec, shared_time.spec, out.spec, stat_names,
+                  start, stop, kwargs)
+                 for start, stop in _slices(n, processes,
+                                            scenarios_per_task)]
+        _run_tasks(_monte_carlo_task, tasks, processes)
+        stats = {name: np.array(out.array[i])
+                 for i, name in enumerate(stat_names)}
+    finally:
+        out.close()
+        shared_time.close()
+        if owned:
+            shared_values.close()
+
+    return stats, years
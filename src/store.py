@@ -0,0 +1,319 @@
+import json
+import os
+
+import pandas as pd
+import numpy as np
+
+from emissions import gases, key_cols, tidy_emissions
+from forcing import forcing_frame, frame_index
+
+
+# Files in a store directory
+_values_file = 'values.npy'
+_axis_file = 'axis.npy'
+_meta_file = 'meta.json'
+
+
+def _to_json(value):
+    "Convert numpy scalars in a key table so they can be written as JSON"
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def write_store(path, keys, values, axis, columns=gases, attrs=None):
+    """
+    Write a scenario tensor (e.g. from *emissions.emissions_array* or
+    *forcing.forcing_array*) as a binary store that can be opened
+    memory-mapped with *ScenarioStore*. The store is a directory with the raw
+    array, the time axis and a JSON file with the key table, the byte offset
+    of each scenario and any other metadata.
+
+    inputs:
+        path: str
+            Directory to write. Created if it does not exist.
+        keys: dataframe
+            One row per scenario
+        values: array
+            Data with shape (scenario, column, time)
+        axis: array
+            Time in years for the last axis of *values*
+        columns: list
+            Names for the second axis of *values*
+        attrs: dict
+            Extra JSON-serializable metadata (e.g. the kind of forcing)
+    outputs:
+        None
+    """
+    values = np.ascontiguousarray(values)
+    if values.shape != (len(keys), len(columns), len(axis)):
+        raise ValueError('values must have shape (scenario, column, time), '
+                         'got {}'.format(values.shape))
+    if keys.duplicated().any():
+        raise ValueError('Scenario keys must be unique')
+
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+    np.save(os.path.join(path, _values_file), values)
+    np.save(os.path.join(path, _axis_file), np.asarray(axis))
+
+    stride = values.strides[0]
+    meta = {'key_columns': list(keys.columns),
+            'keys': [[_to_json(x) for x in row]
+                     for row in keys.itertuples(index=False)],
+            'offsets': [i * stride for i in range(len(keys))],
+            'columns': list(columns),
+            'dtype': values.dtype.str,
+            'shape': list(values.shape),
+            'attrs': attrs or {}}
+    with open(os.path.join(path, _meta_file), 'w') as f:
+        json.dump(meta, f)
+
+
+class ScenarioStore:
+    """
+    Read-only, memory-mapped view of a store written by *write_store*.
+    Opening a store only reads the metadata, and each scenario is a view into
+    the mapped file, so single scenarios load without reading the rest.
+    *offsets* has the byte offset of each scenario in the array data, and
+    *read* uses it to load one scenario without mapping the file.
+
+    inputs:
+        path: str
+            Store directory
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, _meta_file)) as f:
+            meta = json.load(f)
+
+        self.columns = meta['columns']
+        self.attrs = meta['attrs']
+        self.keys = pd.DataFrame(meta['keys'], columns=meta['key_columns'])
+        self.values = np.load(os.path.join(path, _values_file),
+                              mmap_mode='r')
+        # Stores written without offsets have contiguous rows
+        self.offsets = np.array(
+            meta.get('offsets', np.arange(len(self.keys))
+                     * self.values.strides[0]), dtype=np.int64)
+        if not np.array_equal(self.offsets, np.arange(len(self.values))
+                              * self.values.strides[0]):
+            raise ValueError('Scenario offsets in {} do not match {}'
+                             .format(_meta_file, _values_file))
+        self.axis = np.load(os.path.join(path, _axis_file))
+        self._index = {tuple(row): i for i, row in
+                       enumerate(self.keys.itertuples(index=False))}
+        # Forcing dataframes put the key columns in another order (see
+        # *forcing.frame_index*). Keys in that order are found too.
+        self._frame_cols = None
+        if set(key_cols) <= set(self.keys.columns):
+            cols = frame_index(self.keys)[:-1]
+            if cols != list(self.keys.columns):
+                self._frame_cols = cols
+                self._frame_index = {
+                    tuple(row): i for i, row in
+                    enumerate(self.keys[cols].itertuples(index=False))}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        try:
+            self.position(key)
+        except KeyError:
+            return False
+        return True
+
+    def position(self, key=None, **columns):
+        """
+        Row of a scenario in the store. The key is a tuple of the key column
+        values in the order of *self.keys* or, for stores of emissions or
+        forcing, in the index order of *forcing.forcing_frame*. It can also
+        be a dict of key column values, or keyword arguments with spaces in
+        the column names replaced by underscores:
+
+            store.position(('NGCC 2%', '0%', 'NG', 'Reduce', 20))
+            store.position(('NG', 'NGCC 2%', 'Reduce', '0%', 20))
+            store.position(Fuel='NG', Leak='NGCC 2%', Methane='Reduce',
+                           CCS='0%', Start_year=20)
+
+        inputs:
+            key: tuple, dict or None
+                Values of the key columns
+            columns: key column values
+                Used instead of *key*
+        outputs:
+            i: int
+        """
+        if key is None:
+            key = {name.replace('_', ' '): value
+                   for name, value in columns.items()}
+        elif columns:
+            raise TypeError('Give a key or key column values, not both')
+
+        if isinstance(key, dict):
+            missing = set(self.keys.columns) - set(key)
+            unknown = set(key) - set(self.keys.columns)
+            if missing or unknown:
+                raise KeyError('Key columns are {}, got {}'
+                               .format(list(self.keys.columns), sorted(key)))
+            key = [key[col] for col in self.keys.columns]
+
+        key = tuple(key)
+        if key in self._index:
+            return self._index[key]
+        if self._frame_cols is not None and key in self._frame_index:
+            return self._frame_index[key]
+        raise KeyError('Scenario {} is not in the store. Key columns are {}'
+                       .format(key, list(self.keys.columns)))
+
+    def get(self, key=None, **columns):
+        """
+        Data for a single scenario
+
+        inputs:
+            key: tuple, dict or None
+            columns: key column values
+                See *position*
+        outputs:
+            values: array
+                Read-only view with shape (column, time)
+        """
+        return self.values[self.position(key, **columns)]
+
+    def read(self, key=None, **columns):
+        """
+        Data for a single scenario, read from its offset in the values file
+        instead of through the memory map (e.g. to keep a copy after the
+        store files are replaced).
+
+        inputs:
+            key: tuple, dict or None
+            columns: key column values
+                See *position*
+        outputs:
+            values: array
+                Array with shape (column, time)
+        """
+        i = self.position(key, **columns)
+        shape = self.values.shape[1:]
+        with open(os.path.join(self.path, _values_file), 'rb') as f:
+            f.seek(self.values.offset + self.offsets[i])
+            values = np.fromfile(f, dtype=self.values.dtype,
+                                 count=int(np.prod(shape)))
+
+        return values.reshape(shape)
+
+    def select(self, **filters):
+        """
+        Scenarios where each key column matches a value or list of values.
+        Use the key column names with spaces replaced by underscores, e.g.
+        select(Fuel='NG', Start_year=[0, 20]).
+
+        inputs:
+            filters: key column values
+        outputs:
+            keys: dataframe
+                Matching rows of the key table
+            values: array
+                Data with shape (scenario, column, time)
+        """
+        mask = np.ones(len(self.keys), dtype=bool)
+        for name, value in filters.items():
+            col = name.replace('_', ' ')
+            if col not in self.keys.columns:
+                raise KeyError('{} is not a key column'.format(col))
+            if np.ndim(value) == 0:
+                value = [value]
+            mask &= self.keys[col].isin(value).values
+
+        idx = np.flatnonzero(mask)
+
+        return self.keys.iloc[idx].reset_index(drop=True), self.values[idx]
+
+
+def emissions_store(path, keys, values, time):
+    """
+    Write the outputs of *emissions.emissions_array* to a store
+
+    inputs:
+        path: str
+            Store directory
+        keys: dataframe
+            One row per scenario with the columns in *emissions.key_cols*
+        values: array
+            Emissions with shape (scenario, gas, time)
+        time: array
+            Time in years for the last axis of *values*
+    outputs:
+        None
+    """
+    write_store(path, keys[key_cols], values, time, columns=gases,
+                attrs={'kind': 'emissions'})
+
+
+def load_emissions(path, compact=False, **filters):
+    """
+    Tidy emissions dataframe (as from *emissions.emissions*) for all or some
+    of the scenarios in a store written by *emissions_store*.
+
+    inputs:
+        path: str
+            Store directory
+        compact: bool
+            Passed to *emissions.tidy_emissions*
+        filters: key column values
+            Passed to *ScenarioStore.select*
+    outputs:
+        emissions_df: dataframe
+    """
+    store = ScenarioStore(path)
+    keys, values = store.select(**filters)
+
+    return tidy_emissions(keys, values, store.axis, compact=compact)
+
+
+def forcing_store(path, keys, forcing, years, kind='RF'):
+    """
+    Write the outputs of *forcing.forcing_array* to a store
+
+    inputs:
+        path: str
+            Store directory
+        keys: dataframe
+            One row per scenario
+        forcing: array
+            Annual forcing from each gas with shape (scenario, gas, year)
+        years: array
+            Years for the last axis of *forcing*
+        kind: str
+            RF or CRF
+    outputs:
+        None
+    """
+    write_store(path, keys, forcing, years, columns=gases,
+                attrs={'kind': kind})
+
+
+def load_forcing(path, compact=False, **filters):
+    """
+    Forcing dataframe (as from *forcing.forcing_frame*) for all or some of
+    the scenarios in a store written by *forcing_store*.
+
+    inputs:
+        path: str
+            Store directory
+        compact: bool
+            Passed to *forcing.forcing_frame*
+        filters: key column values
+            Passed to *ScenarioStore.select*
+    outputs:
+        complete_df: dataframe
+    """
+    store = ScenarioStore(path)
+    keys, forcing = store.select(**filters)
+
+    return forcing_frame(keys, forcing, store.axis, kind=store.attrs['kind'],
+                         compact=compact)
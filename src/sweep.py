@@ -0,0 +1,182 @@
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import os
+
+import pandas as pd
+import numpy as np
+
+from basis import default_cache
+from emissions import (coal_emissions, ng_emissions, emissions_array,
+                       emissions_segments)
+from forcing import CH4_RE, forcing_array, forcing_frame
+import profiling
+
+
+# Extra key columns that identify the sweep parameters of each scenario
+sweep_cols = ['Leakage drop by', 'Life', 'Emissions']
+
+
+def sweep_points(start_years=(0,), leakage_drop_by=(10,), life=(40,),
+                 leak_values=range(1,6), emission_sets=None,
+                 year_to_90CCS=None, end=100, tstep=0.01):
+    """
+    Grid of *emissions.emissions* parameters for a sweep. Every combination
+    of start year, leakage_drop_by, life and emission set is one point, and
+    each point includes all of the leak values.
+
+    inputs:
+        start_years: list
+            Values of CCS_start
+        leakage_drop_by: list
+            Values of leakage_drop_by
+        life: list
+            Values of life
+        leak_values: list or other iterable
+            Numeric leakage rates used at every point. 1 = 1%, etc.
+        emission_sets: dict
+            Names and (coal_emissions, ng_emissions) tuples. Defaults to the
+            values in *emissions* under the name 'Base'.
+        year_to_90CCS: int or None
+            Year that coal CCS goes from 16% to 90% capture. If None, use the
+            CCS start year of each point (as in the notebooks).
+        end: int
+            Number of years to calculate
+        tstep: float
+            Time step in years
+    outputs:
+        points: list
+            One dictionary of *emissions* keyword arguments per grid point,
+            plus a 'name' key for the emission set
+    """
+    if emission_sets is None:
+        emission_sets = {'Base': (coal_emissions, ng_emissions)}
+    leak_values = list(leak_values)
+
+    points = []
+    for name, start, drop, _life in itertools.product(emission_sets,
+                                                      start_years,
+                                                      leakage_drop_by, life):
+        coal, ng = emission_sets[name]
+        points.append({'name': name,
+                       'coal_emissions': coal,
+                       'ng_emissions': ng,
+                       'CCS_start': start,
+                       'leakage_drop_by': drop,
+                       'life': _life,
+                       'leak_values': leak_values,
+                       'year_to_90CCS': (start if year_to_90CCS is None
+                                         else year_to_90CCS),
+                       'end': end,
+                       'tstep': tstep})
+
+    return points
+
+
+@profiling.timed('sweep.run_points')
+def run_points(points, kinds=('RF', 'CRF'), CH4_RE=CH4_RE, exact=False):
+    """
+    Calculate emissions and forcing for a list of sweep points. This is the
+    unit of work for each process in *run_sweep*.
+
+    inputs:
+        points: list
+            Grid points from *sweep_points*
+        kinds: list
+            Forcing types to calculate (RF and/or CRF)
+        CH4_RE: float
+            Radiative efficiency of methane
+        exact: bool
+            If True, calculate forcing from scenario change points (see
+            *basis.exact_forcing*) instead of dense emission arrays
+    outputs:
+        keys: dataframe
+            One row per scenario, with the emission key columns and
+            *sweep_cols*
+        forcing: dict
+            Annual forcing array with shape (scenario, gas, year) for each kind
+        years: array
+            Years for the last axis of the forcing arrays
+    """
+    key_list = []
+    forcing = {kind: [] for kind in kinds}
+    for point in points:
+        kwargs = dict(point)
+        name = kwargs.pop('name')
+        if exact:
+            keys, values, time = emissions_segments(**kwargs)
+        else:
+            keys, values, time = emissions_array(**kwargs)
+        keys['Leakage drop by'] = point['leakage_drop_by']
+        keys['Life'] = point['life']
+        keys['Emissions'] = name
+        key_list.append(keys)
+
+        for kind in kinds:
+            if exact:
+                _forcing, years = default_cache.forcing_array(values, time,
+                                                              kind=kind,
+                                                              CH4_RE=CH4_RE)
+            else:
+                _forcing, years = forcing_array(values, time, kind=kind,
+                                                CH4_RE=CH4_RE)
+            forcing[kind].append(_forcing)
+
+    keys = pd.concat(key_list, ignore_index=True)
+    forcing = {kind: np.concatenate(forcing[kind]) for kind in kinds}
+
+    return keys, forcing, years
+
+
+def run_sweep(points, kinds=('RF', 'CRF'), processes=None, chunk_size=None,
+              CH4_RE=CH4_RE, exact=False):
+    """
+    Run a grid of emission scenarios and their forcing in a process pool.
+    Points are split into chunks that are handed to worker processes, and
+    results are merged in the order of *points*, so output does not depend
+    on the number of processes.
+
+    inputs:
+        points: list
+            Grid points from *sweep_points*
+        kinds: list
+            Forcing types to calculate (RF and/or CRF)
+        processes: int or None
+            Number of worker processes. None uses all CPUs and 1 runs
+            everything in the current process.
+        chunk_size: int or None
+            Number of grid points per task. Defaults to spreading the points
+            over about 4 tasks per process.
+        CH4_RE: float
+            Radiative efficiency of methane
+        exact: bool
+            Passed to *run_points*
+    outputs:
+        results: dict
+            Forcing dataframe (see *forcing.forcing_frame*) for each kind,
+            with *sweep_cols* as extra index levels
+    """
+    if len(points) == 0:
+        raise ValueError('No sweep points to run')
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if chunk_size is None:
+        chunk_size = max(1, int(np.ceil(len(points) / (4.0 * processes))))
+
+    chunks = [points[i:i + chunk_size]
+              for i in range(0, len(points), chunk_size)]
+    args = ([chunk, kinds, CH4_RE, exact] for chunk in chunks)
+
+    if processes == 1:
+        outputs = [run_points(*a) for a in args]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            outputs = list(executor.map(run_points, *zip(*args)))
+
+    keys = pd.concat([out[0] for out in outputs], ignore_index=True)
+    years = outputs[0][2]
+    results = {}
+    for kind in kinds:
+        forcing = np.concatenate([out[1][kind] for out in outputs])
+        results[kind] = forcing_frame(keys, forcing, years, kind=kind)
+
+    return results
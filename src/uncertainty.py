@@ -0,0 +1,462 @@
+import pandas as pd
+import numpy as np
+from ghgforcing import CO2_AR5, CH4_AR5, ch42co2, AR5_GTP
+
+from emissions import generation
+from forcing import CH4_RE, CO2_RE, gamma, frame_index, _convolve, _cumtrapz
+import profiling
+
+
+# sigma and x are from Olivie and Peters (2013) Table 5 (J13 values)
+# They are the covariance and mean arrays for CO2 IRF uncertainty
+co2_irf_sigma = np.array([[0.129, -0.058, 0.017, -0.042, -0.004, -0.009],
+                          [-0.058, 0.167, -0.109, 0.072, -0.015, 0.003],
+                          [0.017, -0.109, 0.148, -0.043, 0.013, -0.013],
+                          [-0.042, 0.072, -0.043, 0.090, 0.009, 0.006],
+                          [-0.004, -0.015, 0.013, 0.009, 0.082, 0.013],
+                          [-0.009, 0.003, -0.013, 0.006, 0.013, 0.046]])
+co2_irf_mean = np.array([5.479, 2.913, 0.496, 0.181, 0.401, -0.472])
+
+# Output rows of the gas axis. 'Total' is CO2 + CH4 within each run.
+mc_gases = ['CO2', 'CH4', 'Total']
+
+
+def sample_parameters(n_runs, random_state, CH4_RE=CH4_RE):
+    """
+    Draw random forcing parameters for a set of Monte Carlo runs. The
+    distributions are the ones used by the ghgforcing CO2 and CH4 functions.
+    Each run uses the same CO2 response parameters for CO2 emissions and for
+    the CO2 that methane decays into.
+
+    inputs:
+        n_runs: int
+            Number of runs
+        random_state: numpy RandomState
+            Source of random numbers
+        CH4_RE: float
+            Median radiative efficiency of methane, including indirect effects
+    outputs:
+        params: dict
+            Arrays of length n_runs for each parameter
+    """
+    data = np.exp(random_state.multivariate_normal(co2_irf_mean, co2_irf_sigma,
+                                                   n_runs))
+    b_total = 1 + data[:, 3:].sum(axis=1)
+
+    params = {'a0': 1 / b_total,
+              'a1': data[:, 3] / b_total,
+              'a2': data[:, 4] / b_total,
+              'a3': data[:, 5] / b_total,
+              'tau1': data[:, 0],
+              'tau2': data[:, 1],
+              'tau3': data[:, 2]}
+
+    # 90% CI is +/- 10% of mean. Divide by 1.64 to find sigma
+    params['CO2_RE'] = random_state.normal(CO2_RE, CO2_RE * 0.1 / 1.64, n_runs)
+
+    # Adjusted CH4 lifetime
+    params['CH4tau'] = random_state.normal(12.4, 1.4, n_runs)
+
+    # Indirect effects on ozone (f1, 90% CI is +/- 60%) and water vapor
+    # (f2, 90% CI is +/- 71.43%) on top of direct CH4 forcing (+/- 10%)
+    f1 = random_state.normal(0.5, 0.5 * 0.6 / 1.64, n_runs)
+    f2 = random_state.normal(0.15, 0.15 * 0.7143 / 1.64, n_runs)
+    ch4_re = CH4_RE / 1.65
+    RE = random_state.normal(ch4_re, ch4_re * 0.1 / 1.64, n_runs)
+    params['CH4_RE'] = RE * (1 + f1 + f2)
+
+    # Fraction of CH4 that decays to CO2 (51% to 100%)
+    params['alpha'] = random_state.uniform(0.51, 1.0, n_runs)
+
+    # Scaling of climate-carbon feedbacks. ghgforcing uses a triangular
+    # distribution from 0 to 2 with the mode at 2.
+    params['cc_fb'] = random_state.triangular(0, 2, 2, n_runs)
+
+    return params
+
+
+def _exponential_forcing(values, rates, tstep, slice_step, kind='RF'):
+    """
+    Annual RF or CRF for a kernel that decays geometrically with each time
+    step (rate ** i at time index i). The convolution is found block by block
+    between output years, so it costs much less than a full convolution for
+    each rate.
+
+    inputs:
+        values: array
+            Emissions with shape (series, time)
+        rates: array
+            Decay per time step of each kernel, with shape (rate,)
+        tstep: float
+            Time step of the grid in years
+        slice_step: int
+            Number of time steps per output year
+        kind: str
+            RF or CRF
+    outputs:
+        forcing: array
+            Forcing per unit radiative efficiency, shape (series, rate, year)
+    """
+    n_series, n = values.shape
+    n_years = (n - 1) // slice_step + 1
+    blocks = values[:, 1:].reshape(n_series, n_years - 1, slice_step)
+    weights = rates[None, :] ** np.arange(slice_step - 1, -1, -1)[:, None]
+    increments = np.dot(blocks, weights) * tstep
+
+    rf = np.empty((n_series, rates.size, n_years))
+    rf[:, :, 0] = values[:, :1] * tstep
+    decay = rates ** slice_step
+    for y in range(1, n_years):
+        rf[:, :, y] = decay * rf[:, :, y - 1] + increments[:, y - 1, :]
+
+    if kind == 'CRF':
+        # Sum of the forcing at every time step, from the geometric series
+        cumulative = (np.cumsum(values, axis=-1)[:, None, 0::slice_step]
+                      * tstep)
+        total = ((cumulative - rates[None, :, None] * rf)
+                 / (1 - rates)[None, :, None])
+        rf = (total - rf[:, :, :1] / 2.0 - rf / 2.0) * tstep
+
+    return rf
+
+
+def _fixed_forcing(kernel, values, tstep, slice_step, kind='RF'):
+    'Annual RF or CRF for a kernel that is the same in every run'
+    rf = _convolve(kernel, values, tstep)
+    if kind == 'CRF':
+        rf = _cumtrapz(rf, tstep)
+
+    return rf[..., 0::slice_step]
+
+
+class _MonteCarloBasis:
+    """
+    Parts of the Monte Carlo forcing calculation that are the same in every
+    run. The CO2 response function and methane decay are sums of
+    exponentials, so each run's forcing is a weighted sum of exponential
+    responses plus fixed responses for the constant part of the CO2 response
+    and for climate-carbon feedbacks.
+    """
+    def __init__(self, values, time, kind):
+        self.values = values
+        self.kind = kind
+        self.tstep = time[1] - time[0]
+        self.slice_step = int(round(1 / self.tstep))
+        tstep, slice_step = self.tstep, self.slice_step
+
+        # Response to the constant part of the CO2 IRF, for both gases
+        ones = np.ones(time.size)
+        self.constant = _fixed_forcing(ones, values, tstep, slice_step, kind)
+
+        # Climate-carbon feedbacks use the default response functions, with
+        # the sampled radiative efficiencies and feedback scaling.
+        co2_default = CO2_AR5(time)
+        gtp = AR5_GTP(time)
+        from_ch4 = _convolve(co2_default,
+                             _convolve(gtp, CH4_AR5(time), tstep), tstep)
+        from_co2 = _convolve(co2_default,
+                             _convolve(gtp, _convolve(co2_default,
+                                                      ch42co2(time), tstep),
+                                       tstep), tstep)
+        self.cc_fb = np.stack([
+            _fixed_forcing(k, values[:, 1], tstep, slice_step, kind)
+            for k in [from_ch4, from_co2]])
+
+    def forcing(self, params):
+        """
+        Annual forcing for each run, with shape (run, scenario, gas, year)
+        where the gas axis follows *mc_gases*.
+        """
+        tstep, slice_step = self.tstep, self.slice_step
+        runs = len(params['a0'])
+        n_scen = len(self.values)
+
+        def col(name):
+            return params[name][:, None]
+
+        # Decay of each exponential per time step, shape (run, term)
+        p = np.exp(-tstep / np.stack([params['tau1'], params['tau2'],
+                                      params['tau3']], axis=1))
+        q = np.exp(-tstep / col('CH4tau'))
+        a = np.stack([params['a1'], params['a2'], params['a3']], axis=1)
+
+        co2_x = _exponential_forcing(self.values[:, 0], p.ravel(), tstep,
+                                     slice_step, self.kind)
+        co2_x = co2_x.reshape(n_scen, runs, 3, -1)
+        ch4_rates = np.concatenate([p, q], axis=1)
+        ch4_x = _exponential_forcing(self.values[:, 1], ch4_rates.ravel(),
+                                     tstep, slice_step, self.kind)
+        ch4_x = ch4_x.reshape(n_scen, runs, 4, -1)
+
+        out = np.empty((runs, n_scen, 3, co2_x.shape[-1]))
+
+        # CO2 IRF is a0 + sum of a_i * p_i ** i
+        out[:, :, 0] = (col('a0')[:, :, None] * self.constant[None, :, 0]
+                        + np.einsum('srky,rk->rsy', co2_x, a))
+        out[:, :, 0] *= col('CO2_RE')[:, :, None]
+
+        # Convolution of the CO2 IRF with methane decay, alpha/tau * q ** i,
+        # expanded as a sum of exponentials
+        decay_scale = col('CO2_RE') * tstep * col('alpha') / col('CH4tau')
+        coef = np.concatenate([a * p / (p - q),
+                               col('CH4_RE') / decay_scale
+                               - q * (col('a0') / (1 - q)
+                                      + (a / (p - q)).sum(axis=1)[:, None])],
+                              axis=1)
+        out[:, :, 1] = (np.einsum('srky,rk->rsy', ch4_x, coef)
+                        + (col('a0') / (1 - q))[:, :, None]
+                        * self.constant[None, :, 1])
+        out[:, :, 1] *= decay_scale[:, :, None]
+
+        cc_scale = col('cc_fb') * gamma * col('CO2_RE')
+        out[:, :, 1] += np.einsum('rk,ksy->rsy',
+                                  cc_scale * np.concatenate(
+                                      [col('CH4_RE'), col('CO2_RE')], axis=1),
+                                  self.cc_fb)
+
+        out[:, :, :2] *= generation
+        out[:, :, 2] = out[:, :, 0] + out[:, :, 1]
+
+        return out
+
+
+class _Moments:
+    'Streaming count, mean and sum of squared deviations (Chan et al.)'
+    def __init__(self, shape):
+        self.count = 0
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+        self.min = np.full(shape, np.inf)
+        self.max = np.full(shape, -np.inf)
+
+    def update(self, x):
+        'Add a batch of runs, with the run on the first axis'
+        n = len(x)
+        mean = x.mean(axis=0)
+        m2 = ((x - mean) ** 2).sum(axis=0)
+        delta = mean - self.mean
+        total = self.count + n
+        self.mean += delta * n / total
+        self.m2 += m2 + delta ** 2 * self.count * n / total
+        self.count = total
+        np.minimum(self.min, x.min(axis=0), out=self.min)
+        np.maximum(self.max, x.max(axis=0), out=self.max)
+
+    @property
+    def std(self):
+        return np.sqrt(self.m2 / self.count)
+
+
+class _Histogram:
+    """
+    Streaming fixed-bin histogram for approximate percentiles. *low* and
+    *high* must bound every value (e.g. the min and max from a first pass
+    over the same runs), since values outside are counted in the edge bins.
+    """
+    def __init__(self, low, high, bins):
+        self.low = low
+        self.high = high
+        self.width = np.where(high > low, (high - low) / bins, 1.0)
+        self.bins = bins
+        self.counts = np.zeros(low.shape + (bins,), dtype=np.int64)
+
+    def update(self, x):
+        b = np.clip(((x - self.low) / self.width).astype(int), 0, self.bins - 1)
+        b = b.reshape(len(x), -1)
+        flat = np.arange(b.shape[1]) * self.bins + b
+        self.counts += np.bincount(flat.ravel(), minlength=self.counts.size
+                                   ).reshape(self.counts.shape)
+
+    def _order_value(self, cdf, k):
+        'Estimate of the k-th smallest value (from 0), inside its bin'
+        b = np.minimum((cdf <= k).sum(axis=-1, keepdims=True), self.bins - 1)
+        below = np.where(b > 0, np.take_along_axis(cdf, b - 1, axis=-1), 0)
+        inside = np.maximum(np.take_along_axis(self.counts, b, axis=-1), 1)
+        frac = (k - below + 0.5) / inside
+
+        return self.low + (b[..., 0] + frac[..., 0]) * self.width
+
+    def percentile(self, q):
+        """
+        Percentile with the same definition as np.percentile (linear
+        interpolation between the two nearest values). Each of those values
+        is estimated inside its histogram bin, so the result is within one
+        bin width, (high - low) / bins, of np.percentile of the same values.
+        """
+        cdf = np.cumsum(self.counts, axis=-1)
+        n = cdf[..., -1:]
+        position = q / 100.0 * (n - 1)
+        k = np.floor(position)
+        lower = self._order_value(cdf, k)
+        upper = self._order_value(cdf, np.minimum(k + 1, n - 1))
+        value = lower + (position - k)[..., 0] * (upper - lower)
+
+        return np.where(self.high > self.low, value, self.low)
+
+
+def _run_chunks(basis, n_runs, seed, chunk_size, CH4_RE):
+    """
+    Generate annual forcing for each chunk of Monte Carlo runs, with shape
+    (run, scenario, gas, year) where the gas axis follows *mc_gases*.
+    """
+    for chunk, start in enumerate(range(0, n_runs, chunk_size)):
+        runs = min(chunk_size, n_runs - start)
+        random_state = np.random.RandomState([seed, chunk])
+        params = sample_parameters(runs, random_state, CH4_RE)
+        profiling.count('monte_carlo.runs', runs)
+
+        with profiling.span('monte_carlo.chunk', runs=runs):
+            out = basis.forcing(params)
+        yield out
+
+
+@profiling.timed('monte_carlo')
+def monte_carlo(values, time, kind='RF', n_runs=1000, percentiles=(),
+                seed=1, chunk_size=100, bins=500, CH4_RE=CH4_RE):
+    """
+    Monte Carlo uncertainty in RF or CRF for a batch of emission scenarios.
+    Random parameters are drawn once per run and applied to every scenario,
+    and results are reduced chunk by chunk so memory does not grow with
+    n_runs. Because forcing is linear in emissions, the uncertainty in a
+    difference between scenarios can be found by passing the difference in
+    emissions (see *emission_differences*).
+
+    Runs are split into chunks of *chunk_size*, and each chunk draws from
+    its own random state seeded with (seed, chunk number). Results are
+    reproducible for the same seed and chunk_size.
+
+    inputs:
+        values: array
+            Emissions with shape (scenario, gas, time)
+        time: array
+            Evenly spaced time in years, starting at 0
+        kind: str
+            RF or CRF
+        n_runs: int
+            Number of Monte Carlo runs
+        percentiles: list
+            Percentiles (0-100) to estimate. These need a second pass over
+            the runs and are within (max - min) / bins of np.percentile of
+            all of the runs.
+        seed: int
+            Seed for the random states
+        chunk_size: int
+            Number of runs to sample and calculate at once
+        bins: int
+            Number of histogram bins used for percentiles
+        CH4_RE: float
+            Median radiative efficiency of methane
+    outputs:
+        stats: dict
+            Arrays with shape (scenario, gas, year) where the gas axis follows
+            *mc_gases*. Keys are 'mean', 'sigma', 'min', 'max' and each
+            requested percentile.
+        years: array
+            Years for the last axis of the arrays in *stats*
+    """
+    basis = _MonteCarloBasis(values, time, kind)
+    args = (basis, n_runs, seed, chunk_size, CH4_RE)
+
+    moments = None
+    for out in _run_chunks(*args):
+        if moments is None:
+            moments = _Moments(out.shape[1:])
+        moments.update(out)
+
+    stats = {'mean': moments.mean,
+             'sigma': moments.std,
+             'min': moments.min,
+             'max': moments.max}
+
+    if len(percentiles) > 0:
+        hist = _Histogram(moments.min, moments.max, bins)
+        for out in _run_chunks(*args):
+            hist.update(out)
+        for q in percentiles:
+            stats[q] = hist.percentile(q)
+
+    years = time[0::int(round(1 / (time[1] - time[0])))]
+
+    return stats, years
+
+
+def emission_differences(keys, values, first, second):
+    """
+    Difference in emissions between one scenario and a set of others, e.g.
+    SCPC minus each NGCC leakage rate.
+
+    inputs:
+        keys: dataframe
+            One row per scenario with the columns in *emissions.key_cols*
+        values: array
+            Emissions with shape (scenario, gas, time)
+        first: dict
+            Key values that select a single scenario
+        second: dict
+            Key values that select one or more scenarios
+    outputs:
+        diff_keys: dataframe
+            Keys of the scenarios selected by *second*
+        diff_values: array
+            Emissions of *first* minus each of *second*
+    """
+    def select(criteria):
+        mask = np.ones(len(keys), dtype=bool)
+        for col, value in criteria.items():
+            mask &= (keys[col] == value).values
+        return np.flatnonzero(mask)
+
+    first_idx = select(first)
+    if len(first_idx) != 1:
+        raise ValueError('first must select exactly one scenario, '
+                         'not {}'.format(len(first_idx)))
+    second_idx = select(second)
+
+    diff_keys = keys.iloc[second_idx].reset_index(drop=True)
+    diff_values = values[first_idx] - values[second_idx]
+
+    return diff_keys, diff_values
+
+
+def uncertainty_frame(keys, stats, years, kind='RF'):
+    """
+    Arrange the outputs of *monte_carlo* as an annual dataframe with the same
+    index as *forcing.forcing_frame*. Columns follow the notebook naming,
+    e.g. 'CO2_RF', 'CO2_RF -sigma', 'CO2_RF +sigma', plus 'RF p5' style
+    columns for percentiles.
+    """
+    names = ['CO2_' + kind, 'CH4_' + kind, kind]
+    data = {}
+    for g, name in enumerate(names):
+        mean = stats['mean'][:, g, :].ravel()
+        sigma = stats['sigma'][:, g, :].ravel()
+        data[name] = mean
+        data[name + ' -sigma'] = mean - sigma
+        data[name + ' +sigma'] = mean + sigma
+        for q in stats:
+            if not isinstance(q, str):
+                data['{} p{:g}'.format(name, q)] = stats[q][:, g, :].ravel()
+
+    complete_df = pd.DataFrame(data)
+    for col in keys.columns:
+        complete_df[col] = np.repeat(keys[col].values, years.size)
+    complete_df['Time'] = np.tile(np.round(years).astype(int), len(keys))
+
+    complete_df.set_index(frame_index(keys), inplace=True)
+    complete_df.sort_index(inplace=True)
+
+    return complete_df
+
+
+def array_to_uncertainty(keys, values, time, kind='RF', n_runs=1000,
+                         percentiles=(), seed=1, CH4_RE=CH4_RE):
+    """
+    Monte Carlo mean, +/- sigma and percentiles of forcing for the outputs
+    of *emissions.emissions_array* (or *emission_differences*), arranged by
+    *uncertainty_frame*.
+    """
+    stats, years = monte_carlo(values, time, kind=kind, n_runs=n_runs,
+                               percentiles=percentiles, seed=seed,
+                               CH4_RE=CH4_RE)
+
+    return uncertainty_frame(keys, stats, years, kind=kind)